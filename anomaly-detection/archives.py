@@ -0,0 +1,144 @@
+import gzip
+import io
+import locale
+import mmap
+import os
+import re
+import zipfile
+
+MAPPED_BLOCK_SIZE = 1024 * 1024
+# Blank lines, which the readers strip and skip rather than parse: after a newline, and at the start of a span
+BLANK_LINE = re.compile(rb'\n[ \t\r\x0b\x0c]*(?=\n)')
+LEADING_BLANK_LINE = re.compile(rb'[ \t\r\x0b\x0c]*\n')
+
+
+def is_gzip_file(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read(2) == b'\x1f\x8b'
+
+
+def is_compressed(file_path):
+    return zipfile.is_zipfile(file_path) or is_gzip_file(file_path)
+
+
+def zip_log_members(zip_ref):
+    members = [info.filename for info in zip_ref.infolist() if not info.is_dir() and info.filename.endswith('.log')]
+    if not members:
+        raise FileNotFoundError("No .log file found in the archive.")
+    return members
+
+
+def iter_log_lines(file_path, encoding=None):
+    """
+    Yields the lines of a log file as text, streaming them out of .zip and .gz archives without extracting them.
+
+    Parameters:
+        file_path (str): Path to a plain log file, a .zip archive (every .log member is read, in archive order)
+            or a gzip file such as a rotated access.log.N.gz.
+        encoding (str, optional): Text encoding of the log.
+    """
+    if zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            for member in zip_log_members(zip_ref):
+                with zip_ref.open(member, 'r') as stream:
+                    yield from io.TextIOWrapper(stream, encoding=encoding)
+    elif is_gzip_file(file_path):
+        with gzip.open(file_path, 'rt', encoding=encoding) as stream:
+            yield from stream
+    else:
+        with open(file_path, 'r', encoding=encoding) as stream:
+            yield from stream
+
+
+def count_lines(data, start=0, end=None):
+    """
+    Returns:
+        int: The number of non-blank lines in data[start:end], whole lines ending with a newline.
+    """
+    end = len(data) if end is None else end
+    if start >= end:
+        return 0
+    blank = len(BLANK_LINE.findall(data, start, end))
+    if LEADING_BLANK_LINE.match(data, start, end):
+        blank += 1
+    return data.count(b'\n', start, end) - blank
+
+
+def iter_mapped_lines(file_path, encoding=None, needle=None, start=0, end=None, anchored=False,
+                      block_size=MAPPED_BLOCK_SIZE, skipped=None):
+    """
+    Yields the lines of a plain log file through a memory map, skipping the lines without needle before decoding.
+
+    The map is processed in blocks ending on a newline. Blocks where some lines lack needle are searched with
+    bytes.find, so these lines are never decoded. Blocks where nearly all lines contain it are decoded whole, which is
+    cheaper than extracting every line, and may then yield a few lines without needle. Lines are split on '\\n' only.
+
+    Parameters:
+        file_path (str): Path to an uncompressed log file.
+        encoding (str, optional): Text encoding of the log.
+        needle (bytes, optional): Substring a line must contain, in the encoding of the log. If None, every line
+            is yielded.
+        start (int): Byte offset to start from, at the beginning of a line.
+        end (int, optional): Byte offset to stop at, at the end of a line. If None, reads to the end of the file.
+        anchored (bool): The wanted lines end with needle, trailing whitespace aside, so its other occurrences can be
+            skipped.
+        block_size (int): Approximate size in bytes of the blocks.
+        skipped (callable, optional): Called with the number of non-blank lines skipped without being decoded, so
+            that the line counters match the text reader's.
+    """
+    encoding = encoding or locale.getpreferredencoding(False)
+    with open(file_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if start >= end:
+            # Empty files can't be mapped
+            return
+        # Whitespace bytes.rstrip removes, right after needle
+        spaced = re.compile(re.escape(needle) + rb'[ \t\r\x0b\x0c]') if anchored else None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pos = start
+            while pos < end:
+                stop = data.find(b'\n', min(pos + block_size, end) - 1, end)
+                stop = end if stop < 0 else stop + 1
+                block = data[pos:stop]
+                pos = stop
+                if not block.endswith(b'\n'):
+                    # The last line of the file, terminated so that it can be searched like the others
+                    block += b'\n'
+                if needle is None:
+                    yield from block.decode(encoding).split('\n')
+                    continue
+                if needle not in block:
+                    if skipped is not None:
+                        skipped(count_lines(block))
+                    continue
+                # Only an estimate: lines ending with '\r\n' or spaces are missed, and are found by _find_lines
+                matching = block.count(needle + b'\n') if anchored else block.count(needle)
+                # The lines without needle of a decoded block go through the whole parsing, which costs several
+                # times more than extracting a line with _find_lines
+                if 5 * matching > 4 * block.count(b'\n'):
+                    yield from block.decode(encoding).split('\n')
+                else:
+                    yield from _find_lines(block, encoding, needle, anchored and not spaced.search(block), skipped)
+
+
+def _find_lines(block, encoding, needle, exact, skipped=None):
+    # With exact, needle is never followed by trailing spaces in the block, so the lines ending with it are searched
+    # for directly, without stopping at needle elsewhere (e.g. the host in a referer)
+    key = needle + b'\n' if exact else needle
+    pos = 0
+    found_lines = 0
+    while True:
+        found = block.find(key, pos)
+        if found < 0:
+            if skipped is not None:
+                # The found lines contain needle, so none of them is blank
+                skipped(count_lines(block) - found_lines)
+            return
+        # pos is always the start of a line, so the match's line starts after the last newline before it
+        line_start = max(block.rfind(b'\n', pos, found) + 1, pos)
+        line_end = block.find(b'\n', found)
+        found_lines += 1
+        line = block[line_start:line_end]
+        pos = line_end + 1
+        yield line.decode(encoding)
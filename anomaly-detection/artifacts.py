@@ -0,0 +1,53 @@
+import platform
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+import sklearn
+
+ARTIFACT_FORMAT = 1
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def save_artifact(artifact_path, model, vectorizer, feature_config, metadata=None):
+    """
+    Saves a fitted model with everything needed to score new logs against it.
+
+    Parameters:
+        artifact_path (str): Destination file.
+        model: The fitted estimator.
+        vectorizer: The transformer turning records into the model input.
+        feature_config (dict): Settings the records must be featurized with (log format, vectorizer parameters...).
+        metadata (dict, optional): Training details, such as the source log and the number of samples.
+    """
+    artifact = {
+        'format': ARTIFACT_FORMAT,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'versions': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'sklearn': sklearn.__version__,
+        },
+        'feature_config': feature_config,
+        'metadata': metadata or {},
+        'vectorizer': vectorizer,
+        'model': model,
+    }
+    # No compression, so the arrays can be memory-mapped back
+    joblib.dump(artifact, artifact_path)
+
+
+def load_artifact(artifact_path, mmap=True):
+    """
+    Loads an artifact written by save_artifact, memory-mapping its arrays unless mmap is False.
+    """
+    artifact = joblib.load(artifact_path, mmap_mode='r' if mmap else None)
+    if not isinstance(artifact, dict) or artifact.get('format') != ARTIFACT_FORMAT:
+        raise ArtifactError(f"{artifact_path} is not a model artifact of format {ARTIFACT_FORMAT}")
+    trained_with = artifact['versions'].get('sklearn')
+    if trained_with != sklearn.__version__:
+        print(f"Warning: model trained with scikit-learn {trained_with}, running {sklearn.__version__}")
+    return artifact
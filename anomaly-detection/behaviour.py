@@ -0,0 +1,200 @@
+from collections import deque
+from itertools import islice
+
+import numpy as np
+
+from schema import BEHAVIOUR_FIELDS, resolve_fields
+from sketches import CountMinSketch, HyperLogLog, combine_hashes, hash_values
+
+# Record fields the behaviour features are computed from
+BEHAVIOUR_INPUTS = ('remote_addr', 'status', 'body_bytes_sent', 'url', 'time_local')
+DEFAULT_WINDOW = 300
+DEFAULT_BUCKETS = 10
+DEFAULT_SKETCH_WIDTH = 2 ** 15
+DEFAULT_SKETCH_DEPTH = 4
+
+
+def uses_behaviour(fields):
+    return any(field in BEHAVIOUR_FIELDS for field in fields)
+
+
+def input_fields(fields):
+    """
+    Returns:
+        tuple: The fields to parse for a model trained on fields, with the behaviour features replaced by their inputs.
+    """
+    if not uses_behaviour(fields):
+        return tuple(fields)
+    return resolve_fields(set(fields).difference(BEHAVIOUR_FIELDS).union(BEHAVIOUR_INPUTS))
+
+
+class BucketSketches:
+    """
+    Per-IP counts of one time bucket, or of the whole window: requests, errors, bytes sent, distinct URLs, plus the
+    (IP, URL) pairs the distinct URLs are counted from.
+    """
+
+    def __init__(self, width, depth):
+        self.requests = CountMinSketch(width, depth)
+        self.errors = CountMinSketch(width, depth)
+        self.bytes = CountMinSketch(width, depth, dtype=np.int64)
+        self.urls = CountMinSketch(width, depth)
+        self.pairs = CountMinSketch(width, depth)
+
+    def sketches(self):
+        return self.requests, self.errors, self.bytes, self.urls, self.pairs
+
+    def clear(self):
+        for sketch in self.sketches():
+            sketch.clear()
+
+    def __iadd__(self, other):
+        for sketch, other_sketch in zip(self.sketches(), other.sketches()):
+            sketch += other_sketch
+        return self
+
+    def __isub__(self, other):
+        for sketch, other_sketch in zip(self.sketches(), other.sketches()):
+            sketch -= other_sketch
+        return self
+
+    @property
+    def nbytes(self):
+        return sum(sketch.table.nbytes for sketch in self.sketches())
+
+
+class BehaviourAggregator:
+    """
+    Windowed per-IP features of every record: request rate, distinct URLs, error ratio and bytes sent by its IP over
+    the last `window` seconds, the record's own time bucket included.
+
+    The window is a ring of time buckets, each holding count-min sketches instead of per-IP dicts, so memory stays
+    the same whatever the number of source IPs. A bucket is subtracted from the window totals once it falls out of
+    the window. Estimates only ever overcount, by about e / width of the requests in the window. A distinct URL is
+    counted in the latest bucket holding its (IP, URL) pair: when the pair shows up in a new bucket, its count moves
+    there from the previous bucket holding it. An expiring bucket thus only takes away the URLs no longer requested
+    in the window. Every bucket also keeps a HyperLogLog of its source IPs, for the number of distinct IPs in the
+    window.
+
+    Records are expected in log order. A record older than the latest bucket is counted in the latest bucket.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, buckets=DEFAULT_BUCKETS, width=DEFAULT_SKETCH_WIDTH,
+                 depth=DEFAULT_SKETCH_DEPTH):
+        if window <= 0 or buckets <= 0:
+            raise ValueError("The behaviour window and its number of buckets must be positive.")
+        self.window = window
+        self.buckets = buckets
+        self.width = width
+        self.depth = depth
+        self.bucket_seconds = -(-window // buckets)
+        self.totals = BucketSketches(width, depth)
+        # (bucket number, sketches, HyperLogLog of the source IPs), oldest first
+        self.ring = deque()
+        self.latest = None
+
+    def config(self):
+        return {'window': self.window, 'buckets': self.buckets, 'width': self.width, 'depth': self.depth}
+
+    @property
+    def nbytes(self):
+        return self.totals.nbytes + sum(sketches.nbytes + ips.registers.nbytes for _, sketches, ips in self.ring)
+
+    def distinct_ips(self):
+        """
+        Returns:
+            int: Estimated number of distinct source IPs in the window.
+        """
+        ips = HyperLogLog()
+        for _, _, bucket_ips in self.ring:
+            ips |= bucket_ips
+        return ips.count()
+
+    def advance(self, bucket):
+        if self.latest is not None and bucket <= self.latest:
+            return
+        self.latest = bucket
+        recycled = None
+        while self.ring and self.ring[0][0] <= bucket - self.buckets:
+            _, sketches, ips = recycled = self.ring.popleft()
+            self.totals -= sketches
+        if recycled is None:
+            sketches, ips = BucketSketches(self.width, self.depth), HyperLogLog()
+        else:
+            # Reuses the tables of an expired bucket rather than allocating new ones
+            sketches.clear()
+            ips.clear()
+        self.ring.append((bucket, sketches, ips))
+
+    def move_urls(self, ip_positions, pair_positions):
+        # The pairs were counted in the latest older bucket holding them, their URL is now counted in the newest one
+        pending = np.ones(pair_positions.shape[1], dtype=bool)
+        for _, sketches, _ in islice(reversed(self.ring), 1, None):
+            if not pending.any():
+                break
+            held = pending.copy()
+            held[pending] = sketches.pairs.estimate(pair_positions[:, pending]) > 0
+            sketches.urls.add(ip_positions[:, held], np.full(np.count_nonzero(held), -1))
+            pending &= ~held
+        self.ring[-1][1].urls.add(ip_positions[:, ~pending])
+
+    def join(self, store):
+        """
+        Adds the behaviour features of every record of a ColumnarStore as numeric columns, and updates the window.
+        The store needs the BEHAVIOUR_INPUTS fields.
+        """
+        size = len(store)
+        features = {
+            'ip_request_rate': np.zeros(size, dtype=np.float32),
+            'ip_distinct_urls': np.zeros(size, dtype=np.int32),
+            'ip_error_ratio': np.zeros(size, dtype=np.float32),
+            'ip_bytes': np.zeros(size, dtype=np.int64),
+        }
+        if size:
+            self.update(store, features)
+        for field, values in features.items():
+            store.add_column(field, values)
+
+    def update(self, store, features):
+        # Hash every distinct value once, MISSING (-1) indexes the trailing 0 of a missing URL
+        ip_hashes = hash_values(store.dictionaries['remote_addr'].values)[store.column('remote_addr')]
+        url_hashes = np.append(hash_values(store.dictionaries['url'].values), np.uint64(0))[store.column('url')]
+        ip_positions = self.totals.requests.positions(ip_hashes)
+        pair_hashes = combine_hashes(ip_hashes, url_hashes)
+        pair_positions = self.totals.pairs.positions(pair_hashes)
+        errors = store.column('status') >= 400
+        sent = store.column('body_bytes_sent').astype(np.int64)
+
+        buckets = store.column('time_local') // self.bucket_seconds
+        if self.latest is not None:
+            buckets = np.maximum(buckets, self.latest)
+        # Non-decreasing, so that every bucket is one contiguous segment of the store
+        buckets = np.maximum.accumulate(buckets)
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1, [len(buckets)]))
+
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            self.advance(buckets[start])
+            _, bucket, ips = self.ring[-1]
+            rows = slice(start, stop)
+            # First occurrence in the segment of every (IP, URL) pair, counted unless the bucket already holds it
+            _, first = np.unique(pair_hashes[rows], return_index=True)
+            first = first[bucket.pairs.estimate(pair_positions[:, start + first]) == 0] + start
+            in_window = self.totals.pairs.estimate(pair_positions[:, first]) > 0
+            new_urls, moved = first[~in_window], first[in_window]
+            bucket.urls.add(ip_positions[:, new_urls])
+            self.totals.urls.add(ip_positions[:, new_urls])
+            if len(moved):
+                self.move_urls(ip_positions[:, moved], pair_positions[:, moved])
+            segment_errors = start + np.flatnonzero(errors[rows])
+            for sketches in (bucket, self.totals):
+                sketches.requests.add(ip_positions[:, rows])
+                sketches.errors.add(ip_positions[:, segment_errors])
+                sketches.bytes.add(ip_positions[:, rows], sent[rows])
+                sketches.pairs.add(pair_positions[:, rows])
+            ips.add(ip_hashes[rows])
+
+            requests = self.totals.requests.estimate(ip_positions[:, rows])
+            features['ip_request_rate'][rows] = requests / self.window
+            features['ip_distinct_urls'][rows] = np.minimum(self.totals.urls.estimate(ip_positions[:, rows]), requests)
+            features['ip_error_ratio'][rows] = np.minimum(self.totals.errors.estimate(ip_positions[:, rows]) / requests, 1)
+            features['ip_bytes'][rows] = self.totals.bytes.estimate(ip_positions[:, rows])
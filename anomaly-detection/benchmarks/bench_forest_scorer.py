@@ -0,0 +1,63 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.ensemble import IsolationForest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from forest_scorer import FlatForest
+
+
+def hashed_like_matrix(rows, rng, n_features=2 ** 20, nnz_per_row=11):
+    # Shaped like the FeatureHasher output of the pipeline: a few +-1 categorical entries and two counters per row
+    vocabulary = rng.randint(0, n_features, size=5000)
+    indices = vocabulary[rng.zipf(1.5, size=(rows, nnz_per_row)) % len(vocabulary)]
+    data = rng.choice([-1.0, 1.0], size=(rows, nnz_per_row))
+    data[:, 0] = rng.choice([200, 301, 404, 500], size=rows)
+    data[:, 1] = rng.randint(0, 50000, size=rows)
+    indices[:, 0], indices[:, 1] = 17, 42
+    matrix = sp.csr_matrix((data.ravel(), indices.ravel(), np.arange(0, rows * nnz_per_row + 1, nnz_per_row)),
+                           shape=(rows, n_features))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def main(rows, train_rows, n_estimators, dense):
+    rng = np.random.RandomState(42)
+    if dense:
+        X = rng.randn(rows, 16).astype(np.float32)
+    else:
+        X = hashed_like_matrix(rows, rng)
+    model = IsolationForest(n_estimators=n_estimators, random_state=42).fit(X[:train_rows])
+
+    forest, export_time = timed(FlatForest.from_isolation_forest, model)
+    expected, sklearn_time = timed(model.decision_function, X)
+    scores, flat_time = timed(forest.decision_function, X)
+
+    print(f"{rows} rows, {n_estimators} trees, {'dense' if dense else 'sparse hashed'} input")
+    print(f"  export          {export_time * 1000:10.1f} ms")
+    print(f"  sklearn         {sklearn_time:10.2f} s  {rows / sklearn_time:>12,.0f} rows/s")
+    print(f"  flat            {flat_time:10.2f} s  {rows / flat_time:>12,.0f} rows/s")
+    print(f"  speedup         {sklearn_time / flat_time:10.2f} x")
+    print(f"  identical       {np.array_equal(expected, scores)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare FlatForest with IsolationForest.decision_function.")
+    parser.add_argument('-n', '--rows', type=int, default=1000000, help="Rows to score (default: 1000000)")
+    parser.add_argument('--train-rows', type=int, default=100000, help="Rows to train on (default: 100000)")
+    parser.add_argument('--estimators', type=int, default=10, help="Number of trees (default: 10)")
+    parser.add_argument('--dense', action='store_true', help="Score a dense matrix instead of a hashed sparse one")
+
+    args = parser.parse_args()
+    main(args.rows, args.train_rows, args.estimators, args.dense)
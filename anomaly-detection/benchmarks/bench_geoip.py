@@ -0,0 +1,79 @@
+import argparse
+import ipaddress
+import random
+import sys
+import time
+import timeit
+from pathlib import Path
+
+import geoip2.database
+from geoip2.errors import AddressNotFoundError
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from geoip_table import NOT_FOUND_CODE, CountryTable
+
+
+def random_addresses(count, v6_ratio, seed):
+    # Distinct addresses, so that neither lookup is helped by the country cache
+    rng = random.Random(seed)
+    addresses = set()
+    while len(addresses) < count:
+        if rng.random() < v6_ratio:
+            addresses.add(str(ipaddress.IPv6Address(rng.getrandbits(128))))
+        else:
+            addresses.add(str(ipaddress.IPv4Address(rng.getrandbits(32))))
+    return list(addresses)
+
+
+def reader_lookup(reader, addresses):
+    # The previous lookup, LogProcessor.lookup_country for every address
+    countries = []
+    for address in addresses:
+        try:
+            countries.append(reader.country(address).country.iso_code)
+        except AddressNotFoundError:
+            countries.append(NOT_FOUND_CODE)
+    return countries
+
+
+def table_lookup(table, addresses):
+    indexes, _ = table.lookup(addresses)
+    return [table.codes[index] for index in indexes]
+
+
+def main(args):
+    with geoip2.database.Reader(args.geoip_db) as reader:
+        started = time.perf_counter()
+        table = CountryTable.from_reader(reader)
+        print(f"Table built in {time.perf_counter() - started:.2f} s")
+
+        for v6_ratio in args.v6_ratios:
+            addresses = random_addresses(args.addresses, v6_ratio, args.seed)
+            lookups = {
+                'reader': lambda: reader_lookup(reader, addresses),
+                'table': lambda: table_lookup(table, addresses),
+            }
+            expected = lookups['reader']()
+            print(f"{v6_ratio:.0%} of IPv6 addresses ({len(addresses)} distinct addresses)")
+            for name, lookup in lookups.items():
+                same = lookup() == expected
+                best = min(timeit.repeat(lookup, number=1, repeat=args.repeat))
+                print(f"  {name:<6} {len(addresses) / best:>12,.0f} addresses/s  "
+                      f"{'same countries' if same else 'DIFFERENT COUNTRIES'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the per-address GeoIP Reader lookup with the vectorized "
+                                                 "CountryTable one.")
+    parser.add_argument('--geoip-db', type=str, required=True, help="GeoLite2 country database")
+    parser.add_argument('-n', '--addresses', type=int, default=100000,
+                        help="Number of distinct addresses looked up (default: 100000)")
+    parser.add_argument('--v6-ratios', type=str, default='0,0.1,0.5',
+                        help="Shares of IPv6 addresses, one run each (default: 0,0.1,0.5)")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the random addresses")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="Timing repetitions, the best one is kept")
+
+    args = parser.parse_args()
+    args.v6_ratios = [float(ratio) for ratio in args.v6_ratios.split(',')]
+    main(args)
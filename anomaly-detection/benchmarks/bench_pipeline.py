@@ -0,0 +1,191 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+from archives import is_compressed, iter_log_lines
+from loggen import LogGenerator, parse_size
+
+
+def load_pipeline():
+    # The pipeline lives in a script whose name is not importable as is
+    spec = importlib.util.spec_from_file_location('isolation_forest', ROOT / 'isolation-forest.py')
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['isolation_forest'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def reset_peak_rss():
+    # Linux only: writing 5 to clear_refs resets the VmHWM high-water mark
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Stages:
+    def __init__(self):
+        self.results = {}
+
+    def run(self, name, lines, function, *args):
+        reset_peak_rss()
+        started, cpu_started = time.perf_counter(), time.process_time()
+        result = function(*args)
+        seconds = time.perf_counter() - started
+        self.results[name] = {
+            'seconds': round(seconds, 4),
+            'cpu_seconds': round(time.process_time() - cpu_started, 4),
+            'lines': lines if isinstance(lines, int) else lines(result),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
+        self.results[name]['lines_per_sec'] = round(self.results[name]['lines'] / seconds, 1) if seconds else None
+        print(f"  {name:<10} {seconds:10.2f} s  {self.results[name]['lines_per_sec'] or 0:>14,.0f} lines/s  "
+              f"peak RSS {self.results[name]['peak_rss_mb']:>9,.1f} MiB")
+        return result
+
+
+def count_lines(log_path):
+    return sum(1 for _ in iter_log_lines(log_path))
+
+
+def tokenize(tokenizer, log_path):
+    parsed = 0
+    for line in iter_log_lines(log_path):
+        line = line.strip()
+        if line and tokenizer.match(line):
+            parsed += 1
+    return parsed
+
+
+def benchmark_log(pipeline, log_path, args):
+    stages = Stages()
+    total = stages.run('unzip' if is_compressed(log_path) else 'read', lambda count: count, count_lines, log_path)
+
+    log_processor = pipeline.LogProcessor(pipeline.LOG_FORMAT, args.geoip_db, tokenizer=args.tokenizer)
+    stages.run('parse', total, tokenize, log_processor.tokenizer, log_path)
+    # Enrichment is measured with the reading and the tokenizing it can't run without
+    data_loader = pipeline.DataLoader(log_processor, log_path, workers=args.workers or None)
+    store = stages.run('enrich', total, data_loader.load_columns)
+
+    detector = pipeline.AnomalyDetector(n_estimators=args.estimators, features=args.features, scorer=args.scorer)
+    X = stages.run('featurize', len(store), detector.transform, store, True)
+    stages.run('fit', len(store), detector.fit_matrix, X)
+    predictions = stages.run('predict', len(store), detector.predict_matrix, X)
+    return {
+        'log': str(log_path),
+        'lines': total,
+        'records': len(store),
+        'anomalies': int((predictions < 0).sum()),
+        'stages': stages.results,
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL)
+        dirty = subprocess.check_output(['git', 'status', '--porcelain'], cwd=ROOT, stderr=subprocess.DEVNULL)
+        return commit.decode().strip(), bool(dirty.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def synthetic_log(size, args):
+    data_dir = Path(args.data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    log_path = data_dir.joinpath(f"synthetic-{size}-seed{args.seed}.log{'.gz' if args.gzip else ''}")
+    if not log_path.exists():
+        print(f"Generating {log_path}...")
+        LogGenerator(seed=args.seed, ips=args.ips, user_agents=args.user_agents).write(str(log_path), parse_size(size))
+    return log_path
+
+
+def compare(record, baseline_path):
+    with open(baseline_path) as fp:
+        baseline = [json.loads(line) for line in fp if line.strip()][-1]
+    print(f"Compared with {baseline['commit']} ({baseline['timestamp']}):")
+    previous = {run['log']: run for run in baseline['runs']}
+    for run in record['runs']:
+        if run['log'] not in previous:
+            continue
+        for name, stage in run['stages'].items():
+            before = previous[run['log']]['stages'].get(name)
+            if before and before['lines_per_sec'] and stage['lines_per_sec']:
+                print(f"  {Path(run['log']).name} {name:<10} {stage['lines_per_sec'] / before['lines_per_sec']:6.2f} x")
+
+
+def main(args):
+    pipeline = load_pipeline()
+    logs = args.log or [synthetic_log(size, args) for size in args.sizes.split(',')]
+    commit, dirty = git_commit()
+    record = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'runs': [],
+    }
+    for log_path in logs:
+        print(f"{log_path}")
+        record['runs'].append(benchmark_log(pipeline, log_path, args))
+
+    with open(args.output, 'a') as fp:
+        fp.write(json.dumps(record) + '\n')
+    print(f"Results appended to {args.output}")
+    if args.compare:
+        compare(record, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the anomaly detection pipeline.")
+    parser.add_argument('--geoip-db', type=str, required=True, help="GeoLite2 country database")
+    parser.add_argument('-l', '--log', type=str, action='append', default=None,
+                        help="Benchmark this log instead of synthetic ones (can be repeated)")
+    parser.add_argument('--sizes', type=str, default='1M', help="Synthetic log sizes, e.g. 1M,10M,50M (default: 1M)")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the synthetic logs (default: 42)")
+    parser.add_argument('--ips', type=int, default=10000, help="Distinct IPs of the synthetic logs (default: 10000)")
+    parser.add_argument('--user-agents', type=int, default=500,
+                        help="Distinct user agents of the synthetic logs (default: 500)")
+    parser.add_argument('--gzip', action='store_true', help="Gzip the synthetic logs, to measure decompression")
+    parser.add_argument('--data-dir', type=str, default=os.path.join(tempfile.gettempdir(), 'sencha-bloom-bench'),
+                        help="Where the synthetic logs are generated and reused")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="Parsing processes, 0 for all the cores")
+    parser.add_argument('-t', '--tokenizer', choices=['legacy', 'regex', 'split'], default='regex')
+    parser.add_argument('--features', choices=['hashed', 'dense'], default='hashed')
+    parser.add_argument('--scorer', choices=['auto', 'flat', 'sklearn'], default='auto')
+    parser.add_argument('--estimators', type=int, default=10, help="Number of trees (default: 10)")
+    parser.add_argument('-o', '--output', type=str, default='bench_results.jsonl',
+                        help="JSON lines file the results are appended to (default: bench_results.jsonl)")
+    parser.add_argument('--compare', type=str, default=None,
+                        help="Print the throughput ratios against the last record of this results file")
+
+    main(parser.parse_args())
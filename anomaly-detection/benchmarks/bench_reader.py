@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from archives import iter_log_lines, iter_mapped_lines
+from loggen import LogGenerator
+from tokenizer import LineTokenizer
+
+LOG_FORMAT = '$remote_addr - $time_local] "$request" $status $body_bytes_sent "$http_referer" "$http_user_agent" "$http_x_forwarded_for" $http_host'
+HOST = 'mydomain.com'
+
+
+def host_lines(lines, tokenizer):
+    # What DataLoader does before the enrichment: strip, tokenize and keep the target host
+    kept = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            item = tokenizer.match(line)
+            if item and item['http_host'] == HOST:
+                kept.append(item)
+    return kept
+
+
+def main(count, ratios, repeat):
+    tokenizer = LineTokenizer(LOG_FORMAT)
+    readers = {
+        'text': lambda path: iter_log_lines(path),
+        'mmap': lambda path: iter_mapped_lines(path, needle=HOST.encode(), anchored=True),
+    }
+    with tempfile.TemporaryDirectory() as data_dir:
+        for ratio in ratios:
+            path = os.path.join(data_dir, f'shared-{ratio}.log')
+            LogGenerator(other_host_ratio=ratio, host=HOST).write(path, count)
+            expected = host_lines(readers['text'](path), tokenizer)
+            print(f"{ratio:.0%} of the lines for other hosts ({count} lines)")
+            for name, reader in readers.items():
+                same = host_lines(reader(path), tokenizer) == expected
+                best = min(timeit.repeat(lambda: host_lines(reader(path), tokenizer), number=1, repeat=repeat))
+                print(f"  {name:<6} {count / best:>12,.0f} lines/s  {'same output' if same else 'DIFFERENT OUTPUT'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the text and the memory-mapped log readers.")
+    parser.add_argument('-n', '--lines', type=int, default=200000, help="Number of lines per log (default: 200000)")
+    parser.add_argument('--ratios', type=str, default='0.1,0.5,0.9,0.99',
+                        help="Shares of lines for other virtual hosts, one log each (default: 0.1,0.5,0.9,0.99)")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="Timing repetitions, the best one is kept")
+
+    args = parser.parse_args()
+    main(args.lines, [float(ratio) for ratio in args.ratios.split(',')], args.repeat)
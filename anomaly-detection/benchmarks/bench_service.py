@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+from loggen import LogGenerator
+
+SCRIPT = ROOT / 'isolation-forest.py'
+
+
+async def request(reader, writer, method, path, body=b'', content_type='text/plain'):
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: {content_type}\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode().partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, json.loads(await reader.readexactly(int(headers['content-length'])))
+
+
+async def client(socket_path, lines, requests, lines_per_request, latencies, rng):
+    # One keep-alive connection sending requests back to back, as an nginx log shipper would
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    try:
+        for _ in range(requests):
+            start = rng.randint(0, len(lines) - lines_per_request)
+            body = '\n'.join(lines[start:start + lines_per_request]).encode()
+            started = time.perf_counter()
+            status, response = await request(reader, writer, 'POST', '/score', body)
+            latencies.append(time.perf_counter() - started)
+            if status != 200 or len(response['results']) != lines_per_request:
+                raise RuntimeError(f"Unexpected response {status}: {response}")
+    finally:
+        writer.close()
+
+
+async def get(socket_path, method, path, body=b''):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    try:
+        return await request(reader, writer, method, path, body, 'application/json')
+    finally:
+        writer.close()
+
+
+async def wait_ready(socket_path, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The service exited before listening")
+        try:
+            return await get(socket_path, 'GET', '/health')
+        except (ConnectionError, FileNotFoundError):
+            await asyncio.sleep(0.1)
+    raise TimeoutError("The service did not start listening")
+
+
+async def drive(socket_path, lines, args):
+    rng = np.random.RandomState(args.seed)
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*(client(socket_path, lines, args.requests, args.lines_per_request, latencies, rng)
+                           for _ in range(args.clients)))
+    seconds = time.perf_counter() - started
+    scored = args.clients * args.requests * args.lines_per_request
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    print(f"  {args.clients} clients x {args.requests} requests of {args.lines_per_request} lines: "
+          f"{scored / seconds:,.0f} lines/s, {len(latencies) / seconds:,.0f} requests/s")
+    print(f"  client latency  p50 {p50:.1f} ms  p95 {p95:.1f} ms  p99 {p99:.1f} ms")
+    _, stats = await get(socket_path, 'GET', '/stats')
+    print(f"  service         {stats['batches']} batches of {stats['mean_batch_lines']:.0f} lines on average, "
+          f"p99 {stats['latency_seconds']['p99'] * 1000:.1f} ms")
+
+    # A reload swaps the model while the clients keep sending
+    reload = asyncio.create_task(get(socket_path, 'POST', '/reload'))
+    await client(socket_path, lines, args.requests, args.lines_per_request, [], rng)
+    status, info = await reload
+    print(f"  reload          {'model ' + str(info['model']) if status == 200 else info}")
+
+
+def main(args):
+    with tempfile.TemporaryDirectory(prefix='bench-service-') as directory:
+        log_path = args.log or os.path.join(directory, 'train.log')
+        if not args.log:
+            LogGenerator(seed=args.seed).write(log_path, args.train_lines)
+        model_path = args.model or os.path.join(directory, 'model.joblib')
+        if not args.model:
+            subprocess.run([sys.executable, SCRIPT, 'detect', '-l', log_path, '--geoip-db', args.geoip_db,
+                            '--features', args.features, '-s', model_path], check=True, stdout=subprocess.DEVNULL)
+        with open(log_path, errors='replace') as fp:
+            lines = [line.rstrip('\n') for line in fp][:args.train_lines]
+
+        socket_path = os.path.join(directory, 'service.sock')
+        process = subprocess.Popen([sys.executable, SCRIPT, 'serve', '-m', model_path, '--geoip-db', args.geoip_db,
+                                    '--unix-socket', socket_path, '-j', str(args.jobs),
+                                    '--batch-size', str(args.batch_size), '--batch-wait', str(args.batch_wait)],
+                                   stdout=subprocess.DEVNULL)
+        try:
+            asyncio.run(wait_ready(socket_path, process))
+            print(f"{model_path}, {args.jobs} scoring processes")
+            asyncio.run(drive(socket_path, lines, args))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the throughput and latency of the scoring service.")
+    parser.add_argument('--geoip-db', type=str, required=True, help="GeoLite2 country database")
+    parser.add_argument('-m', '--model', type=str, default=None,
+                        help="Model artifact to serve (default: one trained on a synthetic log)")
+    parser.add_argument('-l', '--log', type=str, default=None,
+                        help="Plain log the requests are drawn from (default: a synthetic one)")
+    parser.add_argument('--train-lines', type=int, default=100000,
+                        help="Lines of the synthetic log (default: 100000)")
+    parser.add_argument('--features', choices=['hashed', 'dense'], default='hashed')
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the log and of the requests (default: 42)")
+    parser.add_argument('-c', '--clients', type=int, default=32, help="Concurrent connections (default: 32)")
+    parser.add_argument('-r', '--requests', type=int, default=100, help="Requests per connection (default: 100)")
+    parser.add_argument('--lines-per-request', type=int, default=10, help="Log lines per request (default: 10)")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Scoring processes (default: 1)")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Service batch size (default: 1000)")
+    parser.add_argument('--batch-wait', type=float, default=0.005, help="Service batch wait (default: 0.005)")
+
+    main(parser.parse_args())
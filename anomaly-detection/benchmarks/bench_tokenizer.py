@@ -0,0 +1,56 @@
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from tokenizer import LineTokenizer, MODES
+
+LOG_FORMAT = '$remote_addr - $time_local] "$request" $status $body_bytes_sent "$http_referer" "$http_user_agent" "$http_x_forwarded_for" $http_host'
+
+USER_AGENTS = [
+    'Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
+    'curl/7.68.0',
+]
+
+
+def generate_lines(count, kind, seed=42):
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(count):
+        user_agent = rng.choice(USER_AGENTS)
+        if kind == 'long-ua':
+            user_agent = ' '.join([user_agent] * 8)
+        line = (f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)} - '
+                f'{rng.randint(10, 28)}/May/2015:{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:'
+                f'{rng.randint(0, 59):02d} +0000] "GET /page/{rng.randint(1, 500)} HTTP/1.1" '
+                f'{rng.choice([200, 301, 404, 500])} {rng.randint(0, 50000)} "-" "{user_agent}" "-" mydomain.com')
+        if kind == 'malformed':
+            # Unterminated user agent, the greedy groups try every split before giving up
+            line = line[:line.rindex('" "-"')]
+        lines.append(line)
+    return lines
+
+
+def main(count, repeat):
+    tokenizers = {mode: LineTokenizer(LOG_FORMAT, mode) for mode in MODES}
+    for kind in ['well-formed', 'long-ua', 'malformed']:
+        lines = generate_lines(count, kind)
+        expected = [tokenizers['legacy'].match(line) for line in lines]
+        print(f"{kind} ({count} lines)")
+        for mode, tokenizer in tokenizers.items():
+            same = [tokenizer.match(line) for line in lines] == expected
+            best = min(timeit.repeat(lambda: [tokenizer.match(line) for line in lines], number=1, repeat=repeat))
+            print(f"  {mode:<8} {count / best:>12,.0f} lines/s  {'same output' if same else 'DIFFERENT OUTPUT'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the log line tokenizers.")
+    parser.add_argument('-n', '--lines', type=int, default=20000, help="Number of lines per case (default: 20000)")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="Timing repetitions, the best one is kept")
+
+    args = parser.parse_args()
+    main(args.lines, args.repeat)
@@ -0,0 +1,88 @@
+import os
+import pickle
+import time
+
+CHECKPOINT_FORMAT = 2
+DEFAULT_CHECKPOINT_INTERVAL = 60
+
+
+class Checkpoint:
+    """
+    Progress of a run over one log, kept in a directory so that an interrupted run can resume where it stopped.
+
+    The state is pickled to a temporary file then renamed over the previous one, so a crash while saving leaves the
+    previous checkpoint intact. It is only resumed by a run with the same key, i.e. on the same unchanged log with
+    the same settings.
+    """
+
+    def __init__(self, directory, key, interval=DEFAULT_CHECKPOINT_INTERVAL):
+        self.directory = directory
+        self.key = key
+        # Minimum seconds between two periodic saves
+        self.interval = interval
+        self.saved_at = time.monotonic()
+
+    @staticmethod
+    def log_key(log_path, config):
+        """
+        Parameters:
+            config (dict): Settings the results depend on.
+        """
+        stat = os.stat(log_path)
+        return {
+            'format': CHECKPOINT_FORMAT,
+            'log': os.path.abspath(log_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            **config,
+        }
+
+    @property
+    def state_path(self):
+        return os.path.join(self.directory, 'state.pkl')
+
+    def path(self, name):
+        """
+        Returns:
+            str: Path of a file saved along the state, such as a trained model. The directory is created if need be,
+                a file can be saved before the first state.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        """
+        Returns:
+            dict: The saved state, or None when there is none for this key.
+        """
+        try:
+            with open(self.state_path, 'rb') as fp:
+                checkpoint = pickle.load(fp)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if checkpoint.get('key') != self.key:
+            return None
+        return checkpoint['state']
+
+    def due(self):
+        return time.monotonic() - self.saved_at >= self.interval
+
+    def save(self, state):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, 'wb') as fp:
+            pickle.dump({'key': self.key, 'state': state}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temp_path, self.state_path)
+        self.saved_at = time.monotonic()
+
+    def clear(self, *names):
+        """
+        Removes the state and the given files saved along it, once the run is complete.
+        """
+        for path in [self.state_path] + [self.path(name) for name in names]:
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.isdir(self.directory) and not os.listdir(self.directory):
+            os.rmdir(self.directory)
@@ -0,0 +1,322 @@
+import json
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+# Fields stored as plain numbers, with their array dtype
+NUMERIC_FIELDS = {
+    'status': np.int16,
+    'body_bytes_sent': np.int64,
+}
+# Fields stored as integer codes into a per-field dictionary of distinct values
+CATEGORICAL_FIELDS = (
+    'remote_addr', 'http_x_forwarded_for', 'http_host', 'method', 'url', 'ref', 'country', 'browser_family', 'os_family',
+)
+# Fields a model can opt into, see schema.OPTIONAL_FIELDS
+OPTIONAL_NUMERIC_FIELDS = {
+    'time_local': np.int64,
+    'hour': np.int8,
+    'ip_request_rate': np.float32,
+    'ip_distinct_urls': np.int32,
+    'ip_error_ratio': np.float32,
+    'ip_bytes': np.int64,
+}
+OPTIONAL_CATEGORICAL_FIELDS = ('version',)
+# Code of a categorical field missing from a record, e.g. 'ref' when there is no referer
+MISSING = -1
+DEFAULT_BATCH_SIZE = 65536
+# 64-bit FNV-1 prime, mixes the columns into the record hashes of unique_rows
+FNV_PRIME = np.uint64(0x100000001b3)
+
+
+class Dictionary:
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        if value is None:
+            return MISSING
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def decode(self, code):
+        return None if code == MISSING else self.values[code]
+
+    def __getstate__(self):
+        # The codes are rebuilt from the values, which halves what is sent between processes
+        return self.values
+
+    def __setstate__(self, values):
+        self.__init__(values)
+
+
+class ColumnarStore:
+    """
+    Parsed log records kept as numpy columns: numbers as they are, categorical fields as dictionary codes.
+    """
+
+    def __init__(self, numeric_fields=None, categorical_fields=CATEGORICAL_FIELDS, capacity=DEFAULT_BATCH_SIZE):
+        self.numeric_fields = dict(NUMERIC_FIELDS if numeric_fields is None else numeric_fields)
+        self.categorical_fields = tuple(categorical_fields)
+        self.size = 0
+        self.columns = {field: np.empty(capacity, dtype=dtype) for field, dtype in self.numeric_fields.items()}
+        self.columns.update({field: np.empty(capacity, dtype=np.int32) for field in self.categorical_fields})
+        self.dictionaries = {field: Dictionary() for field in self.categorical_fields}
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def for_fields(cls, fields, capacity=DEFAULT_BATCH_SIZE):
+        """
+        Returns an empty store holding the given fields only.
+        """
+        numeric_types = {**NUMERIC_FIELDS, **OPTIONAL_NUMERIC_FIELDS}
+        numeric_fields = {field: numeric_types[field] for field in fields if field in numeric_types}
+        categorical_fields = [field for field in fields if field not in numeric_types]
+        return cls(numeric_fields, categorical_fields, capacity)
+
+    @property
+    def fields(self):
+        return list(self.numeric_fields) + list(self.categorical_fields)
+
+    def reserve(self, capacity):
+        if capacity <= len(next(iter(self.columns.values()))):
+            return
+        for field, column in self.columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[field] = grown
+
+    def append_batch(self, items):
+        """
+        Appends a batch of parsed records (dicts as returned by LogProcessor.parse_log_line).
+        """
+        if not items:
+            return
+        known = set(self.columns)
+        for item in items:
+            if not known.issuperset(item):
+                raise ValueError(f"Fields not in the store schema: {sorted(set(item) - known)}")
+
+        count = len(items)
+        start, end = self.size, self.size + count
+        capacity = len(next(iter(self.columns.values())))
+        if end > capacity:
+            self.reserve(max(end, 2 * capacity))
+
+        for field in self.numeric_fields:
+            self.columns[field][start:end] = [item[field] for item in items]
+        for field in self.categorical_fields:
+            encode = self.dictionaries[field].encode
+            self.columns[field][start:end] = [encode(item.get(field)) for item in items]
+        self.size = end
+
+    @classmethod
+    def concatenate(cls, stores):
+        """
+        Returns a store of the records of every store in turn, with the same codes as appending these records one
+        store after the other.
+        """
+        stores = list(stores)
+        store = cls(stores[0].numeric_fields, stores[0].categorical_fields, capacity=sum(map(len, stores)))
+        for other in stores:
+            store.extend(other)
+        return store
+
+    def extend(self, other):
+        """
+        Appends the records of another store with the same fields, mapping its dictionary codes to the ones of this
+        store.
+        """
+        if set(other.fields) != set(self.fields):
+            raise ValueError(f"Stores with different fields: {sorted(self.fields)} and {sorted(other.fields)}")
+        start, end = self.size, self.size + len(other)
+        capacity = len(next(iter(self.columns.values())))
+        if end > capacity:
+            self.reserve(max(end, 2 * capacity))
+        for field in self.numeric_fields:
+            self.columns[field][start:end] = other.column(field)
+        for field in self.categorical_fields:
+            encode = self.dictionaries[field].encode
+            # MISSING (-1) indexes the trailing MISSING
+            codes = np.array([encode(value) for value in other.dictionaries[field].values] + [MISSING], dtype=np.int32)
+            self.columns[field][start:end] = codes[other.column(field)]
+        self.size = end
+
+    def add_column(self, field, values):
+        """
+        Adds a numeric field computed from the other columns, such as the behaviour features.
+        """
+        dtype = {**NUMERIC_FIELDS, **OPTIONAL_NUMERIC_FIELDS}[field]
+        column = np.empty(len(next(iter(self.columns.values()))), dtype=dtype)
+        column[:self.size] = values
+        self.numeric_fields[field] = dtype
+        self.columns[field] = column
+
+    def select(self, fields):
+        """
+        Drops the columns of the fields not in fields, e.g. the inputs of computed features.
+        """
+        self.numeric_fields = {field: dtype for field, dtype in self.numeric_fields.items() if field in fields}
+        self.categorical_fields = tuple(field for field in self.categorical_fields if field in fields)
+        self.columns = {field: column for field, column in self.columns.items() if field in fields}
+        self.dictionaries = {field: self.dictionaries[field] for field in self.categorical_fields}
+
+    def take(self, indices):
+        """
+        Returns a store of the given rows, sharing the dictionaries of this one.
+        """
+        store = ColumnarStore(self.numeric_fields, self.categorical_fields, capacity=0)
+        store.columns = {field: self.column(field)[indices] for field in self.columns}
+        store.dictionaries = self.dictionaries
+        store.size = len(indices)
+        return store
+
+    def unique_rows(self):
+        """
+        Finds the distinct records, comparing the numbers and the dictionary codes of every field.
+
+        Returns:
+            tuple: A store of the distinct records, the position of every record in it (so that
+                unique.take(inverse) gives this store back), and how many times each distinct record occurs.
+        """
+        if self.size == 0:
+            return self.take(np.arange(0)), np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        # Sorting one 64-bit hash per record is several times faster than sorting whole rows
+        keys = np.zeros(self.size, dtype=np.uint64)
+        for field in self.columns:
+            column = self.column(field)
+            # The raw bits, so that float columns are not truncated to integers
+            keys ^= column.view(np.dtype(f'u{column.dtype.itemsize}')).astype(np.uint64)
+            keys *= FNV_PRIME
+        _, first, inverse, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+        unique = self.take(first)
+        # A hash collision would merge different records
+        if all(np.array_equal(unique.columns[field][inverse], self.column(field)) for field in self.columns):
+            return unique, inverse, counts
+        return self._unique_rows_exact()
+
+    def _unique_rows_exact(self):
+        # One packed record of the column types per row, compared as raw bytes by np.unique
+        rows = np.empty(self.size, dtype=[(field, column.dtype) for field, column in self.columns.items()])
+        for field in self.columns:
+            rows[field] = self.column(field)
+        rows = rows.view(np.dtype((np.void, rows.dtype.itemsize)))
+        _, first, inverse, counts = np.unique(rows, return_index=True, return_inverse=True, return_counts=True)
+        return self.take(first), inverse.ravel(), counts
+
+    def trim(self):
+        # Releases the spare capacity once loading is over
+        for field, column in self.columns.items():
+            self.columns[field] = column[:self.size].copy()
+
+    def save(self, directory):
+        """
+        Writes the store to a directory: one .npy file per column, plus the dictionaries as JSON.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for field in self.columns:
+            np.save(os.path.join(directory, f"{field}.npy"), self.column(field))
+        schema = {
+            'size': self.size,
+            'numeric_fields': {field: np.dtype(dtype).name for field, dtype in self.numeric_fields.items()},
+            'categorical_fields': list(self.categorical_fields),
+            'dictionaries': {field: dictionary.values for field, dictionary in self.dictionaries.items()},
+        }
+        with open(os.path.join(directory, 'store.json'), 'w') as fp:
+            json.dump(schema, fp)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Reads a store written by save, memory-mapping its columns read-only unless mmap is False.
+        """
+        with open(os.path.join(directory, 'store.json')) as fp:
+            schema = json.load(fp)
+        numeric_fields = {field: np.dtype(dtype).type for field, dtype in schema['numeric_fields'].items()}
+        store = cls(numeric_fields, schema['categorical_fields'], capacity=0)
+        store.columns = {field: np.load(os.path.join(directory, f"{field}.npy"), mmap_mode='r' if mmap else None)
+                         for field in store.fields}
+        store.dictionaries = {field: Dictionary(values) for field, values in schema['dictionaries'].items()}
+        store.size = schema['size']
+        return store
+
+    def column(self, field):
+        return self.columns[field][:self.size]
+
+    def values(self, field):
+        """
+        Returns:
+            np.ndarray: The decoded values of a field, None where a categorical field is missing.
+        """
+        if field in self.numeric_fields:
+            return self.column(field)
+        lookup = np.array(self.dictionaries[field].values + [None], dtype=object)
+        # MISSING (-1) indexes the trailing None
+        return lookup[self.column(field)]
+
+    def rows(self, start=0, stop=None):
+        """
+        Yields the records back as dicts, the same ones that were appended.
+        """
+        stop = self.size if stop is None else min(stop, self.size)
+        numeric = [(field, self.columns[field][start:stop].tolist()) for field in self.numeric_fields]
+        categorical = [(field, self.columns[field][start:stop].tolist(), self.dictionaries[field].values)
+                       for field in self.categorical_fields]
+        for pos in range(stop - start):
+            item = {field: values[pos] for field, values in numeric}
+            for field, codes, values in categorical:
+                code = codes[pos]
+                if code != MISSING:
+                    item[field] = values[code]
+            yield item
+
+    def feature_hash(self, hasher):
+        """
+        Builds the same sparse matrix as hasher.transform(self.rows()), hashing every distinct value only once.
+
+        Parameters:
+            hasher (FeatureHasher): A FeatureHasher with input_type='dict'.
+        """
+        if self.size == 0:
+            raise ValueError("Cannot vectorize an empty store.")
+        rows, columns, data = [], [], []
+        row_index = np.arange(self.size)
+        for field in self.numeric_fields:
+            index, sign = self._hash_features(hasher, [{field: 1}])
+            rows.append(row_index)
+            columns.append(np.full(self.size, index[0]))
+            data.append(sign[0] * self.column(field).astype(hasher.dtype))
+        for field in self.categorical_fields:
+            values = self.dictionaries[field].values
+            if not values:
+                continue
+            index, sign = self._hash_features(hasher, [{field: value} for value in values])
+            codes = self.column(field)
+            present = codes != MISSING
+            rows.append(row_index[present])
+            columns.append(index[codes[present]])
+            data.append(sign[codes[present]].astype(hasher.dtype))
+
+        matrix = sp.csr_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(columns))),
+            shape=(self.size, hasher.n_features),
+            dtype=hasher.dtype,
+        )
+        matrix.sum_duplicates()
+        return matrix
+
+    @staticmethod
+    def _hash_features(hasher, features):
+        # One single-feature row per distinct value, so every row holds exactly one stored entry
+        hashed = sp.csr_matrix(hasher.transform(features))
+        return hashed.indices, hashed.data
@@ -0,0 +1,99 @@
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils import murmurhash3_32
+
+from columnar import MISSING, ColumnarStore
+from schema import record_fields
+
+NUMERIC_FEATURES = ('status', 'body_bytes_sent')
+# Fields with too many distinct values for a vocabulary, hashed into a few buckets instead
+HASHED_FEATURES = ('remote_addr', 'http_x_forwarded_for', 'url', 'ref')
+
+
+class DenseFeatureEncoder(TransformerMixin, BaseEstimator):
+    """
+    Encodes parsed records as a small dense float32 matrix, instead of the 2^20 sparse columns of FeatureHasher.
+
+    Numeric fields are kept as they are. Every other field seen at fit time is one-hot encoded when it has at most
+    max_onehot distinct values, and encoded as its frequency rank otherwise (values unseen at fit time get -1).
+    The fields in hashed are one-hot encoded over hash_width hash buckets, without any vocabulary.
+    """
+
+    def __init__(self, numeric=NUMERIC_FEATURES, hashed=HASHED_FEATURES, max_onehot=8, hash_width=8):
+        self.numeric = numeric
+        self.hashed = hashed
+        self.max_onehot = max_onehot
+        self.hash_width = hash_width
+
+    def fit(self, X, y=None, sample_weight=None):
+        # sample_weight counts every record that many times in the frequency ranks, e.g. for deduplicated records
+        store = self.to_store(X)
+        self.vocabularies_ = {}
+        for field in store.categorical_fields:
+            if field in self.hashed or not len(store.dictionaries[field]):
+                continue
+            codes = store.column(field)
+            present = codes != MISSING
+            weights = None if sample_weight is None else np.asarray(sample_weight)[present]
+            counts = np.bincount(codes[present], weights=weights, minlength=len(store.dictionaries[field]))
+            seen = [(value, count) for value, count in zip(store.dictionaries[field].values, counts) if count]
+            # Most frequent first, ties by value so the encoding doesn't depend on the order of the log
+            seen.sort(key=lambda value_count: (-value_count[1], value_count[0]))
+            self.vocabularies_[field] = {value: rank for rank, (value, _) in enumerate(seen)}
+
+        self.columns_ = [(field, 'numeric', None) for field in self.numeric]
+        for field, vocabulary in self.vocabularies_.items():
+            if len(vocabulary) <= self.max_onehot:
+                self.columns_ += [(field, 'onehot', value) for value in vocabulary]
+            else:
+                self.columns_.append((field, 'rank', None))
+        for field in self.hashed:
+            self.columns_ += [(field, 'hash', bucket) for bucket in range(self.hash_width)]
+        return self
+
+    def get_feature_names_out(self, input_features=None):
+        return np.array([field if value is None else f"{field}={value}" for field, _, value in self.columns_],
+                        dtype=object)
+
+    def transform(self, X):
+        store = self.to_store(X)
+        matrix = np.zeros((len(store), len(self.columns_)), dtype=np.float32)
+        rows = np.arange(len(store))
+        pos = 0
+        for field in self.numeric:
+            matrix[:, pos] = store.column(field)
+            pos += 1
+        for field, vocabulary in self.vocabularies_.items():
+            # Encoder rank of every code of the store, with -1 for unseen values and an extra slot for MISSING
+            if field in store.dictionaries:
+                ranks = np.array([vocabulary.get(value, -1) for value in store.dictionaries[field].values] + [-1])
+                field_ranks = ranks[store.column(field)]
+            else:
+                field_ranks = np.full(len(store), -1)
+            if len(vocabulary) <= self.max_onehot:
+                known = field_ranks >= 0
+                matrix[rows[known], pos + field_ranks[known]] = 1
+                pos += len(vocabulary)
+            else:
+                matrix[:, pos] = field_ranks
+                pos += 1
+        for field in self.hashed:
+            if field in store.dictionaries and len(store.dictionaries[field]):
+                buckets = np.array([self.bucket(field, value) for value in store.dictionaries[field].values])
+                codes = store.column(field)
+                present = codes != MISSING
+                matrix[rows[present], pos + buckets[codes[present]]] = 1
+            pos += self.hash_width
+        return matrix
+
+    def bucket(self, field, value):
+        return murmurhash3_32(f"{field}={value}", seed=0, positive=True) % self.hash_width
+
+    @staticmethod
+    def to_store(X):
+        if isinstance(X, ColumnarStore):
+            return X
+        items = list(X)
+        store = ColumnarStore.for_fields(record_fields(items), capacity=len(items))
+        store.append_batch(items)
+        return store
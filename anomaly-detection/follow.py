@@ -0,0 +1,149 @@
+import locale
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class LogFollower:
+    """
+    Tails a log file like `tail -F`: it keeps reading as lines are appended, reopens the file when it is rotated
+    and starts over when it is truncated.
+    """
+
+    def __init__(self, log_file_path, from_start=False, encoding=None):
+        self.log_file_path = log_file_path
+        self.from_start = from_start
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self.file = None
+        self.inode = None
+        self.partial = b''
+        self.open(seek_end=not from_start)
+
+    def open(self, seek_end=False):
+        if self.file:
+            self.file.close()
+            self.file = None
+        try:
+            self.file = open(self.log_file_path, 'rb')
+        except FileNotFoundError:
+            # Rotated away and not created yet, try again at the next poll
+            return
+        stat = os.fstat(self.file.fileno())
+        self.inode = (stat.st_dev, stat.st_ino)
+        self.partial = b''
+        if seek_end:
+            self.file.seek(0, os.SEEK_END)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def check_rotation(self):
+        try:
+            stat = os.stat(self.log_file_path)
+        except FileNotFoundError:
+            return
+        if self.file is None or (stat.st_dev, stat.st_ino) != self.inode:
+            # A new file took the place of the one being read, which has been fully drained by now
+            self.open()
+        elif stat.st_size < self.file.tell():
+            self.file.seek(0)
+            self.partial = b''
+
+    def read_lines(self):
+        """
+        Returns:
+            tuple: The complete lines appended since the last call, and the time of the last write to the file.
+        """
+        data = self.file.read() if self.file else b''
+        if not data:
+            self.check_rotation()
+            data = self.file.read() if self.file else b''
+        if not data:
+            return [], None
+        written_at = os.fstat(self.file.fileno()).st_mtime
+
+        lines = (self.partial + data).split(b'\n')
+        # The last element is an incomplete line, or empty when the data ends with a newline
+        self.partial = lines.pop()
+        return [line.decode(self.encoding, errors='replace') for line in lines], written_at
+
+
+class LatencyTracker:
+    def __init__(self, size=10000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, seconds, count=1):
+        self.samples.append(seconds)
+        self.count += count
+
+    def percentiles(self, quantiles=(50, 95, 99)):
+        if not self.samples:
+            return {}
+        values = np.percentile(np.fromiter(self.samples, dtype=float), quantiles)
+        return {f"p{q}": float(value) for q, value in zip(quantiles, values)}
+
+
+class SlidingWindowTrainer:
+    """
+    Keeps the records seen during the last window_seconds and retrains a model on them in a background thread.
+    The current model is replaced with a single reference assignment, so scoring never waits for training.
+    """
+
+    def __init__(self, detector_factory, window_seconds=3600, retrain_interval=300, min_samples=1000, detector=None):
+        self.detector_factory = detector_factory
+        self.window_seconds = window_seconds
+        self.retrain_interval = retrain_interval
+        self.min_samples = min_samples
+        self.detector = detector
+        self.trained_at = time.time() if detector is not None else None
+        self.window = deque()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.retrain_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="retrain", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.retrain_event.set()
+        self.thread.join()
+
+    def add(self, items, seen_at):
+        with self.lock:
+            self.window.extend((seen_at, item) for item in items)
+            self.expire(seen_at)
+            size = len(self.window)
+        if self.detector is None and size >= self.min_samples:
+            # No model yet, train as soon as there is enough data
+            self.retrain_event.set()
+
+    def expire(self, now):
+        limit = now - self.window_seconds
+        while self.window and self.window[0][0] < limit:
+            self.window.popleft()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.retrain_event.wait(self.retrain_interval)
+            self.retrain_event.clear()
+            if self.stop_event.is_set():
+                break
+            with self.lock:
+                self.expire(time.time())
+                items = [item for _, item in self.window]
+            if len(items) < self.min_samples:
+                continue
+            started = time.perf_counter()
+            detector = self.detector_factory()
+            detector.fit(items)
+            self.detector = detector
+            self.trained_at = time.time()
+            print(f"Model retrained on {len(items)} records in {time.perf_counter() - started:.2f} s")
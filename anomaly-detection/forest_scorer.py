@@ -0,0 +1,142 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.ensemble._iforest import _average_path_length
+
+DEFAULT_BATCH_SIZE = 8192
+
+
+class FlatForest:
+    """
+    A fitted IsolationForest exported to flat numpy arrays, scoring whole batches with a level-by-level traversal.
+
+    The nodes of all the trees are concatenated; leaves point to themselves, so every (tree, row) pair can take the
+    same number of steps. Scores are accumulated tree by tree exactly like IsolationForest, so decision_function
+    returns the same values.
+    """
+
+    def __init__(self, roots, feature, threshold, left, right, missing_left, leaf_value, max_depth, denominator,
+                 offset, n_features):
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.leaf_value = leaf_value
+        self.max_depth = max_depth
+        self.denominator = denominator
+        self.offset = offset
+        self.n_features = n_features
+        self.is_leaf = left == np.arange(len(left))
+        self.has_missing = bool(missing_left.any())
+
+    @classmethod
+    def from_isolation_forest(cls, model):
+        roots, feature, threshold, left, right, missing_left, leaf_value = [], [], [], [], [], [], []
+        start = 0
+        for estimator, features, path_lengths, average_path_lengths in zip(
+                model.estimators_, model.estimators_features_,
+                model._decision_path_lengths, model._average_path_length_per_tree):
+            tree = estimator.tree_
+            nodes = np.arange(start, start + tree.node_count)
+            is_leaf = tree.children_left == -1
+            roots.append(start)
+            # Trees trained on a subset of the features index into that subset
+            feature.append(np.where(is_leaf, 0, np.asarray(features)[np.maximum(tree.feature, 0)]))
+            threshold.append(tree.threshold)
+            left.append(np.where(is_leaf, nodes, tree.children_left + start))
+            right.append(np.where(is_leaf, nodes, tree.children_right + start))
+            missing_left.append(getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count)).astype(bool))
+            # Same expression as IsolationForest, evaluated once per leaf instead of once per sample
+            leaf_value.append(path_lengths + average_path_lengths - 1.0)
+            start += tree.node_count
+
+        return cls(
+            roots=np.array(roots, dtype=np.intp),
+            feature=np.concatenate(feature).astype(np.intp),
+            threshold=np.concatenate(threshold),
+            left=np.concatenate(left).astype(np.intp),
+            right=np.concatenate(right).astype(np.intp),
+            missing_left=np.concatenate(missing_left),
+            leaf_value=np.concatenate(leaf_value),
+            max_depth=max(estimator.tree_.max_depth for estimator in model.estimators_),
+            denominator=len(model.estimators_) * _average_path_length([getattr(model, '_max_samples', model.max_samples_)]),
+            offset=model.offset_,
+            n_features=model.n_features_in_,
+        )
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def leaves(self, X):
+        """
+        Returns:
+            np.ndarray: Leaf index reached by every row in every tree, shape (n_trees, n_rows).
+        """
+        n_rows = X.shape[0]
+        node = np.repeat(self.roots, n_rows)
+        row = np.tile(np.arange(n_rows, dtype=np.intp), self.n_trees)
+        if sp.issparse(X):
+            lookup = self.sparse_lookup(X)
+        else:
+            flat_X = np.ascontiguousarray(X).ravel()
+            row_start = row * X.shape[1]
+
+            def lookup(pairs, feature):
+                return flat_X[row_start[pairs] + feature]
+
+        pairs = np.arange(len(node))
+        for _ in range(self.max_depth):
+            values = lookup(pairs, self.feature[node])
+            go_left = values <= self.threshold[node]
+            if self.has_missing:
+                go_left |= np.isnan(values) & self.missing_left[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return node.reshape(self.n_trees, n_rows)
+
+    def sparse_lookup(self, X):
+        # Every stored entry gets the key row * n_features + column, sorted since the CSR indices are
+        X = sp.csr_matrix(X)
+        X.sort_indices()
+        keys = np.repeat(np.arange(X.shape[0], dtype=np.int64), np.diff(X.indptr)) * X.shape[1] + X.indices
+        # IsolationForest compares float32 values against its thresholds
+        data = X.data.astype(np.float32)
+
+        n_rows = X.shape[0]
+
+        def lookup(pairs, feature):
+            if not len(keys):
+                return np.zeros(len(pairs), dtype=np.float32)
+            wanted = (pairs % n_rows).astype(np.int64) * X.shape[1] + feature
+            pos = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+            return np.where(keys[pos] == wanted, data[pos], np.float32(0))
+
+        return lookup
+
+    def depths(self, X):
+        depths = np.zeros(X.shape[0])
+        for tree_leaves in self.leaf_value[self.leaves(X)]:
+            depths += tree_leaves
+        return depths
+
+    def score_samples(self, X, batch_size=DEFAULT_BATCH_SIZE):
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[1]} features, the forest expects {self.n_features}")
+        if not sp.issparse(X):
+            X = np.asarray(X, dtype=np.float32)
+        scores = np.zeros(X.shape[0])
+        for start in range(0, X.shape[0], batch_size):
+            depths = self.depths(X[start:start + batch_size])
+            scores[start:start + batch_size] = 2 ** (
+                -np.divide(depths, self.denominator, out=np.ones_like(depths), where=self.denominator != 0)
+            )
+        return -scores
+
+    def decision_function(self, X, batch_size=DEFAULT_BATCH_SIZE):
+        return self.score_samples(X, batch_size) - self.offset
+
+    def predict(self, X, batch_size=DEFAULT_BATCH_SIZE):
+        is_inlier = np.ones(X.shape[0], dtype=int)
+        is_inlier[self.decision_function(X, batch_size) < 0] = -1
+        return is_inlier
@@ -0,0 +1,231 @@
+import ipaddress
+import socket
+
+import numpy as np
+
+# Index of the addresses found in no network, after the countries of the table
+NOT_FOUND_CODE = 'NA'
+# IPv6 networks the MaxMind databases alias to the IPv4 tree, with the shift of the embedded IPv4 address
+IPV4_ALIASES = (
+    (ipaddress.ip_network('::ffff:0:0/96'), 0),
+    (ipaddress.ip_network('2002::/16'), 80),
+    (ipaddress.ip_network('2001::/32'), 64),
+)
+IPV4_MAX = 2 ** 32 - 1
+# Code of the /24 blocks of the IPv4 index that span several ranges, searched in the ranges instead
+SPLIT_BLOCK = np.iinfo(np.uint16).max
+
+
+def ipv6_bytes(value):
+    return np.frombuffer(value.to_bytes(16, 'big'), dtype='S16')[0]
+
+
+def parse_ipv4(addresses):
+    """
+    Parses the dotted-quad IPv4 addresses with numpy operations over all their characters at once, instead of one
+    inet_pton call each. Only the addresses inet_pton accepts are parsed: four dot-separated decimal octets up to
+    255, without leading zeros.
+
+    Parameters:
+        addresses (list): IP address strings.
+
+    Returns:
+        tuple: The uint32 value of every address, and whether it was parsed. The others are left to inet_pton.
+    """
+    values = np.zeros(len(addresses), dtype=np.uint32)
+    parsed = np.zeros(len(addresses), dtype=bool)
+    try:
+        text = '\n'.join(addresses).encode('ascii')
+    except (TypeError, UnicodeEncodeError):
+        return values, parsed
+
+    # Padded so that the three characters before the end of every octet can be read
+    chars = np.frombuffer(b'000' + text + b'\n', dtype=np.uint8)
+    is_line_end = chars == ord('\n')
+    is_end = is_line_end | (chars == ord('.'))
+    ends = np.flatnonzero(is_end)
+    last = np.flatnonzero(is_line_end[ends])
+    if len(last) != len(addresses):
+        # An address with a newline, the lines don't match the addresses
+        return values, parsed
+
+    # Every run of characters ending at a dot or a newline is read as an octet
+    digits = chars.astype(np.int16) - ord('0')
+    widths = np.diff(ends, prepend=2) - 1
+    octets = np.zeros(len(ends), dtype=np.int16)
+    for place in range(3):
+        octets += np.where(widths > place, digits[ends - place - 1], 0) * 10 ** place
+    valid = (widths >= 1) & (widths <= 3) & (octets <= 255) & ((widths == 1) | (digits[ends - widths] != 0))
+
+    # The addresses of four octets of digits only, whose octets are all valid
+    candidates = np.diff(last, prepend=-1) == 4
+    candidates[np.searchsorted(ends[last], np.flatnonzero(~is_end & ((digits < 0) | (digits > 9))))] = False
+    rows = np.flatnonzero(candidates)
+    last = last[rows]
+    valid = valid[last] & valid[last - 1] & valid[last - 2] & valid[last - 3]
+    rows, last = rows[valid], last[valid]
+    octets = octets.astype(np.uint32)
+    values[rows] = octets[last - 3] << 24 | octets[last - 2] << 16 | octets[last - 1] << 8 | octets[last]
+    parsed[rows] = True
+    return values, parsed
+
+
+class CountryTable:
+    """
+    Every network of a GeoIP country database as sorted numpy ranges, to resolve many addresses with searchsorted
+    instead of one Reader lookup each.
+
+    lookup() gives the same countries as Reader.country(ip).country.iso_code: None for networks without a country,
+    NOT_FOUND_CODE for addresses in no network. IPv4 addresses, and the IPv6 ones the database maps to IPv4, are
+    searched as uint32; the other IPv6 addresses as 16 big-endian bytes, which sort like the addresses. The gaps
+    between networks are ranges of their own, so the range of an address is always the last one starting at or
+    before it.
+    """
+
+    def __init__(self, codes, v4_starts, v4_codes, v6_starts, v6_codes, aliases=IPV4_ALIASES):
+        # Distinct country codes, None included, followed by NOT_FOUND_CODE
+        self.codes = list(codes)
+        self.v4_starts, self.v4_codes = v4_starts, v4_codes
+        self.v6_starts, self.v6_codes = v6_starts, v6_codes
+        self.aliases = aliases
+        self.v4_blocks = self.index_blocks(v4_starts, v4_codes)
+
+    @property
+    def not_found(self):
+        return len(self.codes) - 1
+
+    @classmethod
+    def from_reader(cls, reader):
+        """
+        Builds the table by walking the search tree of a geoip2.database.Reader once.
+        """
+        codes, code_index = [], {}
+        ranges = {4: [], 6: []}
+        for network, record in reader._db_reader:
+            code = (record.get('country') or {}).get('iso_code')
+            index = code_index.get(code)
+            if index is None:
+                index = code_index[code] = len(codes)
+                codes.append(code)
+            ranges[network.version].append((int(network.network_address), int(network.broadcast_address), index))
+        not_found = len(codes)
+        codes.append(NOT_FOUND_CODE)
+
+        v4_starts, v4_codes = cls.fill_gaps(ranges[4], not_found)
+        v6_starts, v6_codes = cls.fill_gaps(ranges[6], not_found)
+        table = cls(
+            codes,
+            np.array(v4_starts, dtype=np.uint32),
+            np.array(v4_codes, dtype=np.int32),
+            np.array([start.to_bytes(16, 'big') for start in v6_starts], dtype='S16'),
+            np.array(v6_codes, dtype=np.int32),
+        )
+        table.aliases = tuple(alias for alias in IPV4_ALIASES if table.is_aliased(reader, *alias))
+        return table
+
+    @staticmethod
+    def index_blocks(starts, codes):
+        """
+        Returns:
+            np.ndarray: The code of every IPv4 /24 inside a single range (32 MiB of uint16), SPLIT_BLOCK for the
+                others. Most addresses are then resolved with one array read rather than a binary search.
+        """
+        if not len(starts) or len(codes) and codes.max() >= SPLIT_BLOCK:
+            return None
+        blocks = np.empty(2 ** 24, dtype=np.uint16)
+        # A slice of blocks at a time keeps the temporary arrays small
+        for offset in range(0, len(blocks), 2 ** 20):
+            first = np.arange(offset, offset + 2 ** 20, dtype=np.uint32) << np.uint32(8)
+            first_range = np.searchsorted(starts, first, side='right') - 1
+            last_range = np.searchsorted(starts, first | np.uint32(0xff), side='right') - 1
+            blocks[offset:offset + 2 ** 20] = np.where(first_range == last_range, codes[first_range], SPLIT_BLOCK)
+        return blocks
+
+    @staticmethod
+    def fill_gaps(ranges, not_found):
+        # Range starts from address 0 on, with the addresses outside every network mapped to not_found
+        starts, codes = [], []
+        next_start = 0
+        for start, end, index in sorted(ranges):
+            if start > next_start:
+                starts.append(next_start)
+                codes.append(not_found)
+            starts.append(start)
+            codes.append(index)
+            next_start = end + 1
+        starts.append(next_start)
+        codes.append(not_found)
+        return starts, codes
+
+    def is_aliased(self, reader, network, shift):
+        # The tree walk skips the aliased networks, so only the Reader tells whether this database has the alias
+        found = np.flatnonzero(self.v4_codes != self.not_found)
+        if reader.metadata().ip_version != 6 or not len(found) or self.find_v6(network.network_address):
+            return False
+        probe = int(self.v4_starts[found[0]])
+        aliased = ipaddress.IPv6Address(int(network.network_address) | probe << shift)
+        return reader._db_reader.get(str(aliased)) == reader._db_reader.get(str(ipaddress.IPv4Address(probe)))
+
+    def find_v6(self, address):
+        return self.search(self.v6_starts, self.v6_codes, np.array([ipv6_bytes(int(address))]))[0] != self.not_found
+
+    def lookup(self, addresses):
+        """
+        Resolves addresses to indexes into self.codes.
+
+        Parameters:
+            addresses (list): IP address strings.
+
+        Returns:
+            tuple: The int32 code index of every address, and the positions of the addresses that are not valid IP
+                addresses, whose index is meaningless.
+        """
+        v4, is_v4 = parse_ipv4(addresses)
+        v6_positions, v6_values, invalid = [], [], []
+        for pos in np.flatnonzero(~is_v4).tolist():
+            address = addresses[pos]
+            try:
+                if ':' not in address:
+                    v4[pos] = int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+                    is_v4[pos] = True
+                    continue
+                value = int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+            except (OSError, TypeError):
+                invalid.append(pos)
+                continue
+            embedded = self.embedded_v4(value)
+            if embedded is None:
+                v6_positions.append(pos)
+                v6_values.append(value.to_bytes(16, 'big'))
+            else:
+                v4[pos] = embedded
+                is_v4[pos] = True
+
+        result = np.full(len(addresses), self.not_found, dtype=np.int32)
+        result[is_v4] = self.search_v4(v4[is_v4])
+        if v6_positions:
+            result[v6_positions] = self.search(self.v6_starts, self.v6_codes, np.array(v6_values, dtype='S16'))
+        return result, invalid
+
+    def embedded_v4(self, value):
+        # The IPv4 tree starts at ::/96, its addresses are looked up as IPv4 too
+        if value <= IPV4_MAX:
+            return value
+        for network, shift in self.aliases:
+            if int(network.network_address) <= value <= int(network.broadcast_address):
+                return (value >> shift) & IPV4_MAX
+        return None
+
+    def search_v4(self, values):
+        if self.v4_blocks is None:
+            return self.search(self.v4_starts, self.v4_codes, values)
+        result = self.v4_blocks[values >> np.uint32(8)].astype(np.int32)
+        split = result == SPLIT_BLOCK
+        if split.any():
+            result[split] = self.search(self.v4_starts, self.v4_codes, values[split])
+        return result
+
+    @staticmethod
+    def search(starts, codes, values):
+        # starts begins with address 0, so every address has a range
+        return codes[np.searchsorted(starts, values, side='right') - 1]
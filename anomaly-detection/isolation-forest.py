@@ -1,180 +1,1343 @@
+import argparse
+import asyncio
+import json
+import locale
 import os
-import zipfile
+import signal
+import sys
+import tempfile
 
 import numpy as np
+import scipy.sparse as sp
 from geoip2.errors import AddressNotFoundError
 from ua_parser import user_agent_parser
 import re
 from urllib.parse import urlparse
 import geoip2.database
-from datetime import datetime
 import time
 from sklearn.ensemble import IsolationForest
 from sklearn.feature_extraction import FeatureHasher
-from collections import defaultdict, Counter
+from collections import Counter
+from functools import partial
 
+from archives import is_compressed, iter_log_lines, iter_mapped_lines
+from checkpoint import DEFAULT_CHECKPOINT_INTERVAL, Checkpoint
+from behaviour import (
+    DEFAULT_BUCKETS, DEFAULT_SKETCH_DEPTH, DEFAULT_SKETCH_WIDTH, DEFAULT_WINDOW, BehaviourAggregator, input_fields,
+    uses_behaviour,
+)
+from columnar import DEFAULT_BATCH_SIZE, ColumnarStore, Dictionary
+from artifacts import load_artifact, save_artifact
+from follow import LatencyTracker, LogFollower, SlidingWindowTrainer
+from sampling import Reservoir
+from service import DEFAULT_BATCH_SIZE as DEFAULT_SERVICE_BATCH_SIZE, DEFAULT_BATCH_WAIT, ReloadError, ScoringService
+from forest_scorer import FlatForest
+from geoip_table import CountryTable
+from features import DenseFeatureEncoder
+from log_files import DEFAULT_PARTITION_PATTERN, expand_logs, parse_files, partition_of, partition_path
+from sharding import DEFAULT_CHUNK_SIZE, parse_in_parallel, parse_shards, shard_offsets
+from tokenizer import LineTokenizer, build_legacy_pattern
+from lookup_cache import DEFAULT_CACHE_SIZE, LRUCache, load_caches, save_caches, ua_parser_version
+from parse_cache import ParsedLogCache
+from sweep import build_grid, parse_grid_value, parse_grid_values, run_sweep
+from metrics import DEFAULT_SAMPLE_INTERVAL, PROFILERS, Metrics, profiled
+from reporting import DEFAULT_TOP_K, GROUPS, TopAnomalies
+from schema import (
+    DEFAULT_FIELDS, INTEGER_FIELDS, OPTIONAL_FIELDS, RAW_FIELDS, REQUEST_FIELDS, TIME_FIELDS, USER_AGENT_FIELDS,
+    TimestampParser, numeric_fields, resolve_fields,
+)
 
-def unzip_log_file(zip_file_path, output_dir=None):
-    """
-    Unzips a log file from a .zip archive.
-
-    Parameters:
-        zip_file_path (str): Path to the .zip file.
-        output_dir (str, optional): Directory to extract the files. If None, extracts to the same directory as the .zip file.
-
-    Returns:
-        str: Path to the extracted .log file.
-    """
-    if not zipfile.is_zipfile(zip_file_path):
-        raise ValueError(f"The file {zip_file_path} is not a valid .zip file.")
 
-    # Set output directory to the same directory as the .zip file if not provided
-    if output_dir is None:
-        output_dir = os.path.dirname(zip_file_path)
+REQUEST_PATTERN = re.compile(r'^(\w+)\s+(.*?)\s+(.*?)$')
+LOG_FORMAT = '$remote_addr - $time_local] "$request" $status $body_bytes_sent "$http_referer" "$http_user_agent" "$http_x_forwarded_for" $http_host'
+GEOIP_DB_PATH = "GeoLite2-Country.mmdb"
+TARGET_HOST = "mydomain.com"
 
-    with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-        # List all files in the archive
-        files = zip_ref.namelist()
 
-        # Extract all files
-        zip_ref.extractall(output_dir)
-        print(f"Extracted files: {files}")
+class LogProcessor:
+    def __init__(self, log_format, geoip_db_path, tokenizer='regex', cache_size=DEFAULT_CACHE_SIZE, timestamps=False,
+                 metrics=None, fields=DEFAULT_FIELDS, host=TARGET_HOST, geoip='reader'):
+        self.log_format = log_format
+        # 'reader' looks the country up line by line, 'table' resolves whole batches with add_countries
+        self.geoip = geoip
+        # Lines of other virtual hosts are dropped, None keeps every host
+        self.host = host
+        self.metrics = metrics if metrics is not None else Metrics()
+        # Keeps the parsed time_local as 'timestamp', which is not a model feature
+        self.timestamps = timestamps
+        self.parse_timestamp = TimestampParser()
+        self.select_fields(fields)
+        self.geoip_db_path = geoip_db_path
+        self.tokenizer = LineTokenizer(log_format, tokenizer)
+        self.geoip_reader = geoip2.database.Reader(geoip_db_path)
+        self.country_table = None
+        if self.bulk_country:
+            with self.metrics.stage('geoip_table'):
+                self.country_table = CountryTable.from_reader(self.geoip_reader)
+        self.caches = {
+            'country': LRUCache(cache_size),
+            'user_agent': LRUCache(cache_size),
+        }
 
-        # Find the first .log file in the archive
-        log_files = [file for file in files if file.endswith('.log')]
-        if not log_files:
-            raise FileNotFoundError("No .log file found in the archive.")
+    def __getstate__(self):
+        # The GeoIP reader holds an open database handle, worker processes reopen their own
+        state = self.__dict__.copy()
+        del state['geoip_reader']
+        # Countries are added to the batches by the main process
+        state['country_table'] = None
+        return state
 
-        log_file_path = os.path.join(output_dir, log_files[0])
-        print(f"Log file extracted to: {log_file_path}")
-        return log_file_path
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.geoip_reader = geoip2.database.Reader(self.geoip_db_path)
 
+    def build_pattern(self, log_format):
+        return build_legacy_pattern(log_format)
 
-class LogProcessor:
-    REGEX_LOG_FORMAT_VARIABLE = r'\$([a-zA-Z0-9\_]+)'
-    REGEX_SPECIAL_CHARS = r'([\.\*\+\?\|\(\)\{\}\[\]])'
+    def prefilter(self, encoding=None):
+        """
+        Returns:
+            tuple: A substring every line kept by parse_log_line contains (None if there is none), and whether these
+                lines end with it.
+        """
+        if self.host is None:
+            return None, False
+        return self.host.encode(encoding or locale.getpreferredencoding(False)), self.log_format.endswith('$http_host')
 
-    def __init__(self, log_format, geoip_db_path):
-        self.log_format = log_format
-        self.pattern = self.build_pattern(log_format)
-        self.geoip_reader = geoip2.database.Reader(geoip_db_path)
+    def count_skipped(self, count):
+        # Lines the prefilter skipped before decoding them, counted as parse_log_line would have filtered them
+        self.metrics.counters['lines'] += count
+        self.metrics.counters['host_filtered'] += count
 
-    def build_pattern(self, log_format):
-        pattern = re.sub(self.REGEX_SPECIAL_CHARS, r'\\\1', log_format)
-        pattern = re.sub(self.REGEX_LOG_FORMAT_VARIABLE, '(?P<\\1>.*)', pattern)
-        return re.compile(pattern)
+    def select_fields(self, fields):
+        # Only the work needed by the selected fields is done for every line
+        self.fields = resolve_fields(fields)
+        selected = set(self.fields)
+        self.raw_fields = [field for field in RAW_FIELDS if field in selected]
+        self.integer_fields = [field for field in INTEGER_FIELDS if field in selected]
+        self.request_fields = [field for field in REQUEST_FIELDS if field in selected]
+        self.time_fields = [field for field in TIME_FIELDS if field in selected]
+        self.user_agent_fields = [field for field in USER_AGENT_FIELDS if field in selected]
+        self.with_ref = 'ref' in selected
+        self.with_country = 'country' in selected and self.geoip == 'reader'
+        self.bulk_country = 'country' in selected and self.geoip == 'table'
 
     def get_country(self, ip):
+        return self.caches['country'].get(ip, self.lookup_country)
+
+    def lookup_country(self, ip):
         try:
             return self.geoip_reader.country(ip).country.iso_code
         except AddressNotFoundError:
             return 'NA'
 
+    def add_countries(self, items):
+        """
+        Sets the country of a batch of records with one vectorized lookup of their distinct addresses, when the
+        countries come from the interval table.
+        """
+        if not self.bulk_country or not items:
+            return items
+        with self.metrics.stage('geoip', len(items)):
+            positions = {}
+            for item in items:
+                positions.setdefault(item['remote_addr'], len(positions))
+            countries = self.resolve_countries(list(positions))
+            for item in items:
+                item['country'] = countries[positions[item['remote_addr']]]
+        return items
+
+    def add_store_countries(self, store):
+        """
+        Sets the country column of a ColumnarStore parsed without it, with one lookup of its distinct addresses.
+        """
+        if not self.bulk_country or not len(store):
+            return store
+        with self.metrics.stage('geoip', len(store)):
+            countries = self.resolve_countries(store.dictionaries['remote_addr'].values)
+            # Addresses are coded in order of first occurrence, so the countries are too, as with add_countries
+            dictionary = Dictionary()
+            codes = np.array([dictionary.encode(country) for country in countries], dtype=np.int32)
+            store.columns['country'][:len(store)] = codes[store.column('remote_addr')]
+            store.dictionaries['country'] = dictionary
+        return store
+
+    def resolve_countries(self, addresses):
+        indexes, invalid = self.country_table.lookup(addresses)
+        codes = self.country_table.codes
+        countries = [codes[index] or 'N/a' for index in indexes.tolist()]
+        for pos in invalid:
+            # The Reader decides what to do with them, as on the per-line path
+            countries[pos] = self.lookup_country(addresses[pos]) or 'N/a'
+        self.metrics.counters['country_lookups'] += len(addresses)
+        return countries
+
+    def get_user_agent(self, user_agent):
+        return self.caches['user_agent'].get(user_agent, self.lookup_user_agent)
+
+    def lookup_user_agent(self, user_agent):
+        parsed_user_agent = user_agent_parser.Parse(user_agent)
+        return parsed_user_agent['user_agent']['family'] or 'N/a', parsed_user_agent['os']['family'] or 'N/a'
+
+    def cache_key(self):
+        # Cached lookups are only valid for the GeoIP database build and the ua_parser rules they came from
+        return {
+            'geoip_build_epoch': self.geoip_reader.metadata().build_epoch,
+            'ua_parser': ua_parser_version(),
+        }
+
+    def load_cache(self, cache_path):
+        return load_caches(cache_path, self.cache_key(), self.caches)
+
+    def save_cache(self, cache_path):
+        save_caches(cache_path, self.cache_key(), self.caches)
+
+    def cache_stats(self):
+        return {name: cache.stats() for name, cache in self.caches.items()}
+
+    def track_worker_state(self):
+        # Called in pool workers, which only report what they add on top of the copy they received
+        for cache in self.caches.values():
+            cache.reset_stats()
+            cache.additions = []
+        self.metrics.reset()
+
+    def export_worker_state(self):
+        return {
+            'caches': {name: cache.export() for name, cache in self.caches.items()},
+            'metrics': self.metrics.export(),
+        }
+
+    def merge_worker_state(self, state):
+        for name, exported in state['caches'].items():
+            self.caches[name].merge(exported)
+        self.metrics.merge(state['metrics'])
+
     def parse_log_line(self, line):
-        match = self.pattern.match(line)
-        if not match:
+        metrics = self.metrics
+        metrics.counters['lines'] += 1
+        if metrics.timing:
+            return self.parse_log_line_timed(line)
+        item = self.tokenizer.match(line)
+        if not item:
+            metrics.counters['parse_misses'] += 1
+            return None
+        if self.host is not None and item['http_host'] != self.host:
+            metrics.counters['host_filtered'] += 1
+            return None
+        record = self.normalize(item)
+        if self.with_country:
+            record['country'] = self.get_country(item['remote_addr']) or 'N/a'
+        if self.user_agent_fields:
+            self.add_user_agent(record, item['http_user_agent'])
+        metrics.counters['records'] += 1
+        return record
+
+    def parse_log_line_timed(self, line):
+        # Same as parse_log_line, with every step timed on its own
+        metrics = self.metrics
+        started = metrics.clock()
+        item = self.tokenizer.match(line)
+        started = metrics.lap('tokenize', started)
+        if not item:
+            metrics.counters['parse_misses'] += 1
+            return None
+        if self.host is not None and item['http_host'] != self.host:
+            metrics.counters['host_filtered'] += 1
             return None
-        item = match.groupdict()
-        if item['http_host'] == 'mydomain.com':
-            item['status'] = int(item['status'])
-            item['body_bytes_sent'] = int(item['body_bytes_sent'])
-            request_match = re.match(r'^(\w+)\s+(.*?)\s+(.*?)$', item['request'])
+        record = self.normalize(item)
+        started = metrics.lap('normalize', started)
+        if self.with_country:
+            record['country'] = self.get_country(item['remote_addr']) or 'N/a'
+            started = metrics.lap('geoip', started)
+        if self.user_agent_fields:
+            self.add_user_agent(record, item['http_user_agent'])
+            metrics.lap('user_agent', started)
+        metrics.counters['records'] += 1
+        return record
+
+    def normalize(self, item):
+        """
+        Builds the record from the tokenized line, deriving only the selected fields.
+        """
+        record = {field: item[field] for field in self.raw_fields}
+        for field in self.integer_fields:
+            record[field] = int(record[field])
+        if self.request_fields:
+            request_match = REQUEST_PATTERN.match(item['request'])
             if request_match:
-                item['method'], item['url'], item['version'] = request_match.groups()
-            item['time_local'] = int(time.mktime(
-                datetime.strptime(item['time_local'].split()[0], '%d/%b/%Y:%X').timetuple()
-            ))
-            if item['http_referer'] != '-':
-                item['ref'] = urlparse(item['http_referer']).netloc
-            item['country'] = self.get_country(item['remote_addr']) or 'N/a'
-            parsed_user_agent = user_agent_parser.Parse(item['http_user_agent'])
-            item['browser_family'] = parsed_user_agent['user_agent']['family'] or 'N/a'
-            item['os_family'] = parsed_user_agent['os']['family'] or 'N/a'
-
-            # Remove unused fields
-            del item['http_user_agent']
-            del item['http_referer']
-            del item['time_local']
-            del item['request']
-            del item['version']
-            return item
-        return None
+                request = dict(zip(REQUEST_FIELDS, request_match.groups()))
+                for field in self.request_fields:
+                    record[field] = request[field]
+        if self.time_fields or self.timestamps:
+            timestamp = self.parse_timestamp(item['time_local'])
+            if self.timestamps:
+                record['timestamp'] = timestamp
+            if 'time_local' in self.time_fields:
+                record['time_local'] = timestamp
+            if 'hour' in self.time_fields:
+                record['hour'] = self.parse_timestamp.hour(item['time_local'])
+        if self.with_ref and item['http_referer'] != '-':
+            record['ref'] = urlparse(item['http_referer']).netloc
+        return record
+
+    def add_user_agent(self, record, user_agent):
+        browser_family, os_family = self.get_user_agent(user_agent)
+        if 'browser_family' in self.user_agent_fields:
+            record['browser_family'] = browser_family
+        if 'os_family' in self.user_agent_fields:
+            record['os_family'] = os_family
 
 
 class DataLoader:
-    def __init__(self, log_processor, log_file_path):
+    def __init__(self, log_processor, log_file_path, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, encoding=None,
+                 reader='mmap'):
         self.log_processor = log_processor
         self.log_file_path = log_file_path
+        # None means one worker per core, 1 keeps the parsing in the current process
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        # 'mmap' skips the lines without the target host before decoding them, 'text' decodes every line
+        self.reader = reader
 
     def load_data(self):
-        with open(self.log_file_path, 'r') as file:
-            for line in file:
-                line = line.strip()
-                if line:
-                    item = self.log_processor.parse_log_line(line)
-                    if item:
-                        yield item
+        # Compressed logs can't be split at byte offsets, they are streamed by the current process
+        if self.workers == 1 or is_compressed(self.log_file_path):
+            return self.load_data_serial()
+        return parse_in_parallel(self.log_processor, self.log_file_path, self.workers, self.chunk_size, self.encoding,
+                                 self.reader)
+
+    def iter_lines(self):
+        if self.reader == 'mmap' and not is_compressed(self.log_file_path):
+            needle, anchored = self.log_processor.prefilter(self.encoding)
+            return iter_mapped_lines(self.log_file_path, self.encoding, needle, anchored=anchored,
+                                     skipped=self.log_processor.count_skipped)
+        return iter_log_lines(self.log_file_path, self.encoding)
+
+    def load_data_serial(self):
+        for line in self.iter_lines():
+            line = line.strip()
+            if line:
+                item = self.log_processor.parse_log_line(line)
+                if item:
+                    yield item
+
+    def load_chunks(self, chunk_size=DEFAULT_BATCH_SIZE):
+        # Each chunk is a store of its own, so only one chunk is held in memory at a time
+        for _, batch in self.load_batches(chunk_size):
+            yield self.to_store(batch, self.log_processor.fields)
+
+    def load_batches(self, chunk_size=DEFAULT_BATCH_SIZE, start=None):
+        """
+        Yields the parsed records in (offset, records) batches.
+
+        Without start, batches hold chunk_size records and offset is None. With a byte offset, every batch is a shard
+        of the log from that offset on, and offset is where the next shard starts, i.e. where to resume after it. Only
+        uncompressed logs can be read from an offset.
+        """
+        if start is not None:
+            shards = [(begin, end) for begin, end in shard_offsets(self.log_file_path, self.chunk_size) if begin >= start]
+            for _, end, items in parse_shards(self.log_processor, self.log_file_path, shards, self.workers,
+                                              self.encoding, self.reader):
+                yield end, self.log_processor.add_countries(items)
+            return
+        batch = []
+        for item in self.load_data():
+            batch.append(item)
+            if len(batch) >= chunk_size:
+                yield None, self.log_processor.add_countries(batch)
+                batch = []
+        if batch:
+            yield None, self.log_processor.add_countries(batch)
+
+    @staticmethod
+    def to_store(items, fields=DEFAULT_FIELDS):
+        store = ColumnarStore.for_fields(fields, capacity=len(items))
+        store.append_batch(items)
+        return store
+
+    def load_columns(self, batch_size=DEFAULT_BATCH_SIZE):
+        # Only one batch of dicts is alive at any time, the rest is already encoded in the store
+        metrics = self.log_processor.metrics
+        with metrics.stage('load'):
+            store = ColumnarStore.for_fields(self.log_processor.fields, capacity=batch_size)
+            batch = []
+            for item in self.load_data():
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    self.log_processor.add_countries(batch)
+                    with metrics.stage('columnar', len(batch)):
+                        store.append_batch(batch)
+                    batch = []
+            self.log_processor.add_countries(batch)
+            with metrics.stage('columnar', len(batch)):
+                store.append_batch(batch)
+                store.trim()
+        metrics.add('load', 0.0, 0.0, calls=0, items=len(store))
+        return store
 
 
 class AnomalyDetector:
-    def __init__(self, n_estimators=10, random_state=42):
-        self.vectorizer = FeatureHasher()
-        self.model = IsolationForest(n_estimators=n_estimators, random_state=np.random.RandomState(random_state))
+    def __init__(self, n_estimators=10, random_state=42, scorer='auto', features='hashed', hash_width=8, metrics=None,
+                 fields=DEFAULT_FIELDS, dedup=False, behaviour=None, max_samples='auto', contamination='auto'):
+        # Record fields the model is trained on, the log has to be parsed with the same ones
+        self.fields = tuple(fields)
+        # BehaviourAggregator settings the behaviour fields were computed with, None without behaviour fields
+        self.behaviour = behaviour if uses_behaviour(self.fields) else None
+        # 'hashed' hashes every field into 2^20 sparse columns, 'dense' keeps a few float32 columns per field
+        if features == 'dense':
+            self.vectorizer = DenseFeatureEncoder(numeric=numeric_fields(self.fields), hash_width=hash_width)
+        else:
+            self.vectorizer = FeatureHasher()
+        self.model = IsolationForest(n_estimators=n_estimators, max_samples=max_samples, contamination=contamination,
+                                     random_state=np.random.RandomState(random_state))
+        self.metadata = {}
+        # 'flat' scores with the vectorized export of the fitted forest, 'sklearn' with IsolationForest itself,
+        # 'auto' picks the flat forest for sparse matrices only
+        self.scorer = scorer
+        self.flat_forest = None
+        self.metrics = metrics if metrics is not None else Metrics()
+        # Featurize and score every distinct record once, training with the number of occurrences as sample weight
+        self.dedup = dedup
+
+    @classmethod
+    def load(cls, artifact_path, mmap=True, scorer='auto', metrics=None, dedup=False):
+        artifact = load_artifact(artifact_path, mmap)
+        feature_config = artifact['feature_config']
+        detector = cls(scorer=scorer, metrics=metrics, fields=feature_config.get('fields', DEFAULT_FIELDS), dedup=dedup,
+                       behaviour=feature_config.get('behaviour', {}))
+        detector.vectorizer = artifact['vectorizer']
+        detector.model = artifact['model']
+        detector.metadata = artifact['metadata']
+        detector.export_forest()
+        return detector
+
+    def save(self, artifact_path, metadata=None):
+        self.metadata = metadata or {}
+        save_artifact(artifact_path, self.model, self.vectorizer, self.feature_config(), self.metadata)
+
+    def feature_config(self):
+        config = {'vectorizer': type(self.vectorizer).__name__, 'fields': list(self.fields), **self.vectorizer.get_params()}
+        if self.behaviour is not None:
+            config['behaviour'] = self.behaviour
+        return config
+
+    def behaviour_aggregator(self):
+        """
+        Returns:
+            BehaviourAggregator: A new window to compute the behaviour fields of the records to score, or None.
+        """
+        return None if self.behaviour is None else BehaviourAggregator(**self.behaviour)
+
+    def export_forest(self):
+        self.flat_forest = FlatForest.from_isolation_forest(self.model) if self.scorer != 'sklearn' else None
+
+    def use_flat_forest(self, X):
+        return self.flat_forest is not None and (self.scorer == 'flat' or sp.issparse(X))
+
+    def transform(self, data, fit=False, sample_weight=None):
+        with self.metrics.stage('featurize', len(data)):
+            if isinstance(self.vectorizer, DenseFeatureEncoder):
+                if fit:
+                    return self.vectorizer.fit_transform(data, sample_weight=sample_weight)
+                return self.vectorizer.transform(data)
+            if isinstance(data, ColumnarStore):
+                return data.feature_hash(self.vectorizer)
+            return self.vectorizer.transform(data)
+
+    def deduplicate(self, data):
+        """
+        Returns:
+            tuple: The distinct records of data, the position of every record among them and their counts, or None
+                when deduplication is off or data is not a ColumnarStore.
+        """
+        if not self.dedup or not isinstance(data, ColumnarStore):
+            return None
+        with self.metrics.stage('dedup', len(data)):
+            unique, inverse, counts = data.unique_rows()
+        self.metrics.counters['dedup_records'] += len(data)
+        self.metrics.counters['dedup_unique_records'] += len(unique)
+        return unique, inverse, counts
 
     def fit(self, data):
-        X_train = self.vectorizer.fit_transform(data)
-        self.model.fit(X_train)
+        deduplicated = self.deduplicate(data)
+        if deduplicated is None:
+            X_train = self.transform(data, fit=True)
+            self.fit_matrix(X_train)
+            return X_train
+        unique, _, counts = deduplicated
+        X_train = self.transform(unique, fit=True, sample_weight=counts)
+        self.fit_matrix(X_train, counts)
         return X_train
 
+    def fit_matrix(self, X_train, sample_weight=None):
+        with self.metrics.stage('fit', X_train.shape[0]):
+            self.model.fit(X_train, sample_weight=sample_weight)
+            if sample_weight is not None and self.model.contamination != 'auto':
+                # IsolationForest sets the threshold to a percentile of the training scores, where every record counts
+                scores = self.model.score_samples(X_train)
+                self.model.offset_ = np.percentile(np.repeat(scores, sample_weight), 100.0 * self.model.contamination)
+            self.export_forest()
+
+    def decision_function(self, data):
+        return self.score_records(data, self.decision_function_matrix)
+
+    def decision_function_matrix(self, X_test):
+        with self.metrics.stage('predict', X_test.shape[0]):
+            if self.use_flat_forest(X_test):
+                return self.flat_forest.decision_function(X_test)
+            return self.model.decision_function(X_test)
+
     def predict(self, data):
-        X_test = self.vectorizer.transform(data)
-        return self.model.predict(X_test)
+        return self.score_records(data, self.predict_matrix)
+
+    def predict_matrix(self, X_test):
+        with self.metrics.stage('predict', X_test.shape[0]):
+            if self.use_flat_forest(X_test):
+                return self.flat_forest.predict(X_test)
+            return self.model.predict(X_test)
+
+    def score_records(self, data, score_matrix):
+        deduplicated = self.deduplicate(data)
+        if deduplicated is None:
+            return score_matrix(self.transform(data))
+        unique, inverse, _ = deduplicated
+        # Identical records get identical scores, copy them back to every occurrence
+        return score_matrix(self.transform(unique))[inverse]
+
+
+def count_anomalies_by(store, predictions, field, most_common=True):
+    """
+    Counts the anomalous records per value of a categorical field.
+
+    Returns:
+        list: (value, count) pairs in order of first anomalous occurrence. With most_common, sorted by count first,
+            ties staying in order of first occurrence like Counter.most_common().
+    """
+    codes = store.column(field)[predictions < 0]
+    if not len(codes):
+        return []
+    unique_codes, first_seen, counts = np.unique(codes, return_index=True, return_counts=True)
+    order = np.argsort(first_seen, kind='stable')
+    if most_common:
+        order = order[np.argsort(-counts[order], kind='stable')]
+    dictionary = store.dictionaries[field]
+    return [(dictionary.decode(code), int(count)) for code, count in zip(unique_codes[order], counts[order])]
+
+
+def target_host(args):
+    return None if args.all_hosts else args.host
+
+
+def resolve_log_path(args):
+    if args.log is None:
+        # The archive is read in place, there is no need to extract it first
+        args.log = "access.log" if os.path.isfile("access.log") else "access.log.zip"
+    return args.log
+
+
+def log_paths(args):
+    return expand_logs(resolve_log_path(args))
+
+
+def single_log_path(args):
+    paths = log_paths(args)
+    if len(paths) > 1:
+        raise ValueError(f"{args.log} holds {len(paths)} logs, this mode reads a single one")
+    args.log = paths[0]
+    return args.log
+
+
+def build_log_processor(args, metrics, fields, timestamps=False):
+    log_processor = LogProcessor(LOG_FORMAT, args.geoip_db, tokenizer=args.tokenizer, cache_size=args.cache_size,
+                                 timestamps=timestamps, metrics=metrics, fields=fields, host=target_host(args),
+                                 geoip=args.geoip)
+    if args.cache_file and log_processor.load_cache(args.cache_file):
+        print(f"Lookup cache loaded from: {args.cache_file}")
+    return log_processor
+
 
+def build_data_loader(args, metrics, fields, timestamps=False):
+    log_path = single_log_path(args)
+    log_processor = build_log_processor(args, metrics, fields, timestamps)
+    return DataLoader(log_processor, log_path, workers=args.workers or None, chunk_size=args.chunk_size * 1024 * 1024,
+                      reader=args.reader)
 
-def main():
-    # Configuration
-    log_format = '$remote_addr - $time_local] "$request" $status $body_bytes_sent "$http_referer" "$http_user_agent" "$http_x_forwarded_for" $http_host'
 
-    # Paths to required resources
-    geoip_db_path = "GeoLite2-Country.mmdb"
-    zip_log_file_path = "access.log.zip"
-    log_file_path = "access.log"
+def finish_loading(args, log_processor):
+    counters = log_processor.metrics.counters
+    print(f"Lines parsed: {counters['lines']}, parse misses: {counters['parse_misses']}, "
+          f"other hosts: {counters['host_filtered']}")
+    cache_stats = log_processor.cache_stats()
+    log_processor.metrics.info['caches'] = cache_stats
+    for name, stats in cache_stats.items():
+        print(f"{name} cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions, "
+              f"{stats['hit_rate']:.1%} hit rate")
+    if args.cache_file:
+        log_processor.save_cache(args.cache_file)
 
-    if not os.path.isfile(log_file_path):
-        unzip_log_file(zip_log_file_path, ".")
 
-    # Initialize components
-    log_processor = LogProcessor(log_format, geoip_db_path)
-    data_loader = DataLoader(log_processor, log_file_path)
-    anomaly_detector = AnomalyDetector()
+# Counters of the parsing saved along a cached log, and added back when it is reused
+CACHED_COUNTERS = ('lines', 'parse_misses', 'host_filtered', 'records')
 
-    # Load and preprocess data
+
+def parse_cache_key(args, log_path, fields):
+    return ParsedLogCache.key(log_path, LOG_FORMAT, args.geoip_db, {
+        'fields': list(fields),
+        'host': target_host(args),
+        'ua_parser': ua_parser_version(),
+    })
+
+
+def load_logs(args, metrics, fields):
+    cache = ParsedLogCache(args.parse_cache) if args.parse_cache else None
+    if cache is not None:
+        with metrics.stage('parse_cache'):
+            key = parse_cache_key(args, single_log_path(args), fields)
+            cached = cache.load(key)
+        if cached is not None:
+            items, counters = cached
+            metrics.counters.update(counters)
+            print(f"Parsed log loaded from: {cache.entry_path(key)}")
+            print(f"Total logs loaded: {len(items)}")
+            return items
+
+    data_loader = build_data_loader(args, metrics, fields)
     print("Loading data...")
-    items = list(data_loader.load_data())
+    items = data_loader.load_columns()
     print(f"Total logs loaded: {len(items)}")
+    finish_loading(args, data_loader.log_processor)
+    if cache is not None:
+        counters = {name: metrics.counters[name] for name in CACHED_COUNTERS}
+        print(f"Parsed log cached in: {cache.save(key, items, counters)}")
+    return items
+
+
+def load_log_files(args, metrics, fields, paths):
+    """
+    Parses several logs in a process pool, one file per task, reusing the ones found in the parse cache.
+
+    Returns:
+        dict: The store of every log, in the order of paths.
+    """
+    cache = ParsedLogCache(args.parse_cache) if args.parse_cache else None
+    stores, keys = {}, {}
+    if cache is not None:
+        with metrics.stage('parse_cache'):
+            for path in paths:
+                keys[path] = parse_cache_key(args, path, fields)
+                cached = cache.load(keys[path])
+                if cached is not None:
+                    stores[path], counters = cached
+                    metrics.counters.update(counters)
+        print(f"Parsed logs loaded from the cache: {len(stores)} of {len(paths)}")
+
+    missing = [path for path in paths if path not in stores]
+    if missing:
+        log_processor = build_log_processor(args, metrics, fields)
+        print(f"Loading data from {len(missing)} logs...")
+        with metrics.stage('load'):
+            for path, store, counters in parse_files(log_processor, missing, args.workers or None,
+                                                     reader=args.reader):
+                stores[path] = log_processor.add_store_countries(store)
+                if cache is not None:
+                    cache.save(keys[path], store, {name: counters.get(name, 0) for name in CACHED_COUNTERS})
+        metrics.add('load', 0.0, 0.0, calls=0, items=sum(len(stores[path]) for path in missing))
+        finish_loading(args, log_processor)
+    return {path: stores[path] for path in paths}
+
+
+def load_partitions(args, metrics, fields):
+    """
+    Loads the log, directory or glob pattern of --log, one store per host partition.
+
+    Returns:
+        dict: The store of every partition, sorted by partition name. The records of a partition follow the order of
+            its file names, i.e. the order of the days for dated rotations.
+    """
+    paths = log_paths(args)
+    if len(paths) == 1:
+        return {partition_of(paths[0], args.partition_pattern): load_logs(args, metrics, fields)}
+    partitions = {}
+    for path, store in load_log_files(args, metrics, fields, paths).items():
+        partitions.setdefault(partition_of(path, args.partition_pattern), []).append(store)
+    with metrics.stage('merge'):
+        partitions = {name: ColumnarStore.concatenate(partitions[name]) for name in sorted(partitions)}
+    print(f"Total logs loaded: {sum(map(len, partitions.values()))} from {len(paths)} files, "
+          f"{len(partitions)} partitions")
+    return partitions
+
+
+def join_partitions(anomaly_detector, partitions, fields, metrics):
+    # Every partition is in log order on its own, so each one gets its own behaviour window
+    for store in partitions.values():
+        join_behaviour(anomaly_detector.behaviour_aggregator(), store, fields, metrics)
+    return partitions
+
+
+def merge_partitions(partitions, metrics):
+    if len(partitions) == 1:
+        return next(iter(partitions.values()))
+    with metrics.stage('merge'):
+        return ColumnarStore.concatenate(partitions.values())
+
+
+def behaviour_config(args):
+    return {'window': args.behaviour_window, 'buckets': args.behaviour_buckets, 'width': args.sketch_width,
+            'depth': args.sketch_depth}
+
 
+def join_behaviour(aggregator, store, fields, metrics):
+    """
+    Adds the behaviour fields to a store parsed with input_fields(fields), then drops the inputs not in fields.
+    """
+    if aggregator is None:
+        return store
+    with metrics.stage('behaviour', len(store)):
+        aggregator.join(store)
+        store.select(fields)
+    metrics.info['behaviour'] = {'sketch_bytes': aggregator.nbytes, 'window_distinct_ips': aggregator.distinct_ips()}
+    return store
+
+
+def stratify_fields(args):
+    # Fields the host stratification reads, parsed even when the model is not trained on them
+    return ['http_host'] if args.stratify == 'host' else []
+
+
+def stratum_of(item, stratify, fields):
+    if stratify == 'hour':
+        # The timestamp is only parsed for the stratification, it is not a feature
+        if 'timestamp' in item:
+            return item.pop('timestamp') // 3600
+        return item['time_local'] // 3600
+    if stratify == 'host':
+        return item['http_host'] if 'http_host' in fields else item.pop('http_host')
+    return None
+
+
+def report_anomalies(anomaly_count, anomalies):
+    print(f"Total anomalies detected: {anomaly_count}")
+    for ip, count in anomalies:
+        print(f"IP: {ip}, Count: {count}")
+
+
+def top_anomalies(args):
+    return TopAnomalies(args.top_k, args.top_by or ('ip',)) if args.top_k else None
+
+
+def report_top_anomalies(args, top, partition=None):
+    print(f"Total anomalies detected: {top.anomalies}")
+    top_output = partition_path(args.top_output, partition)
+    top.write(top_output)
+    if top_output not in (None, '-'):
+        print(f"Top anomalies written to: {top_output}")
+
+
+def report_predictions(args, store, predictions, partition=None):
+    top = top_anomalies(args)
+    if top is None:
+        report_anomalies(int(np.count_nonzero(predictions < 0)), count_anomalies_by(store, predictions, 'remote_addr'))
+    else:
+        top.update(store, predictions)
+        report_top_anomalies(args, top, partition)
+
+
+def save_model(args, anomaly_detector, samples, partition=None):
+    metadata = {
+        'log_file': os.path.abspath(args.log),
+        'log_format': LOG_FORMAT,
+        'samples': samples,
+    }
+    if partition is not None:
+        metadata['partition'] = partition
+    model_path = partition_path(args.save_model, partition)
+    anomaly_detector.save(model_path, metadata)
+    print(f"Model saved to: {model_path}")
+
+
+def forest_config(args):
+    return {'n_estimators': args.n_estimators, 'max_samples': args.max_samples, 'contamination': args.contamination}
+
+
+def new_detector(args, metrics):
+    return AnomalyDetector(scorer=args.scorer, features=args.features, hash_width=args.hash_width, metrics=metrics,
+                           fields=args.fields, dedup=args.dedup, behaviour=behaviour_config(args),
+                           **forest_config(args))
+
+
+def detect(args, metrics):
+    if args.reservoir_size:
+        return detect_streaming(args, metrics)
+
+    anomaly_detector = new_detector(args, metrics)
+    partitions = load_partitions(args, metrics, input_fields(args.fields))
+    join_partitions(anomaly_detector, partitions, args.fields, metrics)
+    if not args.per_host:
+        partitions = {None: merge_partitions(partitions, metrics)}
+    for partition, items in partitions.items():
+        if partition is not None:
+            print(f"Host: {partition}")
+            anomaly_detector = new_detector(args, metrics)
+        detect_partition(args, anomaly_detector, items, partition)
+    print("Processing complete.")
+
+
+def detect_partition(args, anomaly_detector, items, partition=None):
     # Train the model
     print("Training anomaly detection model...")
-    X_train = anomaly_detector.fit(items)
+    anomaly_detector.fit(items)
     print("Model training complete.")
+    if args.save_model:
+        save_model(args, anomaly_detector, len(items), partition)
 
     # Detect anomalies
     print("Detecting anomalies...")
     predictions = anomaly_detector.predict(items)
-    anomalies = defaultdict(int)
-    anomaly_count = 0
+    report_predictions(args, items, predictions, partition)
 
-    for pos, prediction in enumerate(predictions):
-        if prediction < 0:
-            anomaly_count += 1
-            anomalies[items[pos]['remote_addr']] += 1
 
-    # Output results
-    print(f"Total anomalies detected: {anomaly_count}")
-    for ip, count in Counter(anomalies).most_common():
-        print(f"IP: {ip}, Count: {count}")
+CHECKPOINT_SETTINGS = (
+    'fields', 'host', 'all_hosts', 'geoip_db', 'tokenizer', 'reader', 'chunk_size', 'reservoir_size', 'stratify',
+    'features', 'hash_width', 'dedup', 'behaviour_window', 'behaviour_buckets', 'sketch_width', 'sketch_depth', 'top_k',
+    'top_by', 'n_estimators', 'max_samples', 'contamination',
+)
+CHECKPOINT_MODEL = 'model.joblib'
+
+
+def open_checkpoint(args):
+    if not args.checkpoint:
+        return None
+    if is_compressed(args.log):
+        print("Warning: compressed logs can't be resumed from a byte offset, checkpointing is off")
+        return None
+    key = Checkpoint.log_key(args.log, {name: getattr(args, name) for name in CHECKPOINT_SETTINGS})
+    return Checkpoint(args.checkpoint, key, args.checkpoint_interval)
+
+
+def detect_streaming(args, metrics):
+    anomaly_detector = new_detector(args, metrics)
+    data_loader = build_data_loader(args, metrics, input_fields(list(args.fields) + stratify_fields(args)),
+                                    timestamps=args.stratify == 'hour' and not uses_behaviour(args.fields))
+    # With a checkpoint, the log is processed one shard at a time, and the progress saved between shards
+    checkpoint = open_checkpoint(args)
+    state = checkpoint.load() if checkpoint is not None else None
+    if state is not None:
+        print(f"Resuming the {state['phase']} pass at byte {state['offset']}, from the checkpoint in {args.checkpoint}")
+        metrics.counters.update(state['counters'])
+
+    if state is None or state['phase'] == 'sample':
+        sample_and_train(args, metrics, anomaly_detector, data_loader, checkpoint, state)
+        state = None
+    else:
+        anomaly_detector = AnomalyDetector.load(checkpoint.path(CHECKPOINT_MODEL), scorer=args.scorer, metrics=metrics,
+                                                dedup=args.dedup)
+
+    # Pass two: score the whole log one chunk at a time
+    print("Detecting anomalies...")
+    data_loader.log_processor.timestamps = False
+    data_loader.log_processor.select_fields(input_fields(args.fields))
+    if state is None:
+        state = score_state(args, anomaly_detector)
+    aggregator, top, anomalies = state['aggregator'], state['top'], state['anomalies']
+    offset = state['offset'] if checkpoint is not None else None
+    for offset, batch in data_loader.load_batches(args.score_chunk_size, offset):
+        chunk = join_behaviour(aggregator, DataLoader.to_store(batch, data_loader.log_processor.fields), args.fields,
+                               metrics)
+        predictions = anomaly_detector.predict(chunk)
+        if top is not None:
+            top.update(chunk, predictions)
+        else:
+            state['anomaly_count'] += int(np.count_nonzero(predictions < 0))
+            # Counting in order of first occurrence keeps the ties in the same order as a single pass
+            for ip, count in count_anomalies_by(chunk, predictions, 'remote_addr', most_common=False):
+                anomalies[ip] += count
+        if checkpoint is not None and checkpoint.due():
+            checkpoint.save({**state, 'offset': offset, 'counters': dict(metrics.counters)})
+    if top is not None:
+        report_top_anomalies(args, top)
+    else:
+        report_anomalies(state['anomaly_count'], anomalies.most_common())
+    if checkpoint is not None:
+        checkpoint.clear(CHECKPOINT_MODEL)
     print("Processing complete.")
 
 
+def sample_and_train(args, metrics, anomaly_detector, data_loader, checkpoint, state):
+    # Pass one: train on a fixed-size sample of the log
+    print("Sampling training data...")
+    if state is None:
+        state = {'phase': 'sample', 'offset': 0, 'aggregator': anomaly_detector.behaviour_aggregator(),
+                 'reservoir': Reservoir(args.reservoir_size)}
+    aggregator, reservoir = state['aggregator'], state['reservoir']
+    # time_local is kept for the hour stratification, and removed before sampling
+    sampled_fields = set(args.fields).union(['time_local'], stratify_fields(args))
+    offset = state['offset'] if checkpoint is not None else None
+    with metrics.stage('sample'):
+        for offset, batch in data_loader.load_batches(args.score_chunk_size, offset):
+            if aggregator is not None:
+                store = DataLoader.to_store(batch, data_loader.log_processor.fields)
+                batch = join_behaviour(aggregator, store, sampled_fields, metrics).rows()
+            for item in batch:
+                stratum = stratum_of(item, args.stratify, args.fields)
+                if aggregator is not None and 'time_local' not in args.fields:
+                    del item['time_local']
+                reservoir.add(item, stratum)
+            if checkpoint is not None and checkpoint.due():
+                checkpoint.save({**state, 'offset': offset, 'counters': dict(metrics.counters)})
+    print(f"Total logs loaded: {reservoir.seen}, sampled for training: {len(reservoir)}")
+    finish_loading(args, data_loader.log_processor)
+
+    print("Training anomaly detection model...")
+    training = DataLoader.to_store(reservoir.items(), args.fields)
+    anomaly_detector.fit(training)
+    samples = len(training)
+    del training, reservoir, state
+    print("Model training complete.")
+    if args.save_model:
+        save_model(args, anomaly_detector, samples)
+    if checkpoint is not None:
+        # Scoring resumes with the trained model, the sample is no longer needed
+        anomaly_detector.save(checkpoint.path(CHECKPOINT_MODEL), {'samples': samples})
+        checkpoint.save({**score_state(args, anomaly_detector), 'counters': dict(metrics.counters)})
+
+
+def score_state(args, anomaly_detector):
+    # The exact per-IP counts grow with the number of anomalous IPs, the top k summaries do not
+    return {'phase': 'score', 'offset': 0, 'aggregator': anomaly_detector.behaviour_aggregator(),
+            'top': top_anomalies(args), 'anomalies': Counter(), 'anomaly_count': 0}
+
+
+def score(args, metrics):
+    started = time.perf_counter()
+    anomaly_detector = AnomalyDetector.load(args.model, scorer=args.scorer, metrics=metrics, dedup=args.dedup)
+    print(f"Model loaded from {args.model} in {(time.perf_counter() - started) * 1000:.1f} ms")
+    if anomaly_detector.metadata.get('log_format', LOG_FORMAT) != LOG_FORMAT:
+        print("Warning: the model was trained on a different log format")
+
+    partitions = load_partitions(args, metrics, input_fields(anomaly_detector.fields))
+    items = merge_partitions(join_partitions(anomaly_detector, partitions, anomaly_detector.fields, metrics), metrics)
+    print("Detecting anomalies...")
+    predictions = anomaly_detector.predict(items)
+    report_predictions(args, items, predictions)
+    print("Processing complete.")
+
+
+def sweep(args, metrics):
+    # The vectorizer is fitted once, every configuration is trained on the same matrix
+    anomaly_detector = AnomalyDetector(features=args.features, hash_width=args.hash_width, metrics=metrics,
+                                       fields=args.fields, behaviour=behaviour_config(args))
+    partitions = load_partitions(args, metrics, input_fields(args.fields))
+    items = merge_partitions(join_partitions(anomaly_detector, partitions, args.fields, metrics), metrics)
+    X = anomaly_detector.transform(items, fit=True)
+    del items
+
+    grid = build_grid(args.n_estimators, args.max_samples, args.contamination)
+    seeds = list(range(args.random_state, args.random_state + args.seeds))
+    print(f"Fitting {len(grid)} configurations with {len(seeds)} seeds each on a {X.shape[0]}x{X.shape[1]} matrix...")
+    results = []
+    with tempfile.TemporaryDirectory(prefix='sweep-') as directory:
+        with metrics.stage('sweep', len(grid) * len(seeds)):
+            for config, result in run_sweep(X, grid, seeds, directory, workers=args.jobs or None):
+                results.append({**config, **result})
+                print_sweep_result(results[-1])
+
+    # Completion order depends on the pool, the summary follows the grid
+    results.sort(key=lambda result: grid.index({name: result[name] for name in grid[0]}))
+    metrics.info['sweep'] = results
+    if args.sweep_output:
+        with open(args.sweep_output, 'w') as fp:
+            for result in results:
+                fp.write(json.dumps(result) + '\n')
+        print(f"Sweep results written to: {args.sweep_output}")
+
+
+def print_sweep_result(result):
+    stability = "n/a"
+    if result['rank_correlation'] is not None:
+        stability = (f"rank correlation {result['rank_correlation']:.3f}, "
+                     f"anomaly overlap {result['anomaly_overlap']:.3f}")
+    print(f"n_estimators={result['n_estimators']} max_samples={result['max_samples']} "
+          f"contamination={result['contamination']}: fit {result['fit_seconds']:.2f} s, "
+          f"score {result['score_seconds']:.2f} s, {result['anomaly_rate']:.2%} anomalies, {stability}")
+
+
+def score_batch(detector, items, written_at, latency, store=None):
+    predictions = detector.predict(DataLoader.to_store(items, detector.fields) if store is None else store)
+    for pos in np.flatnonzero(predictions < 0):
+        item = items[pos]
+        print(f"Anomaly: IP: {item['remote_addr']}, URL: {item.get('url')}, Status: {item.get('status')}")
+    latency.add(time.time() - written_at, len(items))
+
+
+def print_latency(latency):
+    percentiles = ", ".join(f"{name}: {value * 1000:.0f} ms" for name, value in latency.percentiles().items())
+    print(f"Scored {latency.count} records, write to alert latency {percentiles or 'n/a'}")
+
+
+def follow(args, metrics):
+    detector = None
+    if args.model:
+        detector = AnomalyDetector.load(args.model, scorer=args.scorer, metrics=metrics, dedup=args.dedup)
+    # The retrained models keep the fields of the initial one
+    fields = detector.fields if detector else args.fields
+    behaviour = detector.behaviour if detector else behaviour_config(args)
+    aggregator = BehaviourAggregator(**behaviour) if uses_behaviour(fields) else None
+    log_processor = LogProcessor(LOG_FORMAT, args.geoip_db, tokenizer=args.tokenizer, cache_size=args.cache_size,
+                                 metrics=metrics, fields=input_fields(fields), host=target_host(args), geoip=args.geoip)
+    if args.cache_file and log_processor.load_cache(args.cache_file):
+        print(f"Lookup cache loaded from: {args.cache_file}")
+    detector_factory = partial(AnomalyDetector, scorer=args.scorer, features=args.features, hash_width=args.hash_width,
+                               metrics=metrics, fields=fields, dedup=args.dedup, behaviour=behaviour,
+                               **forest_config(args))
+    trainer = SlidingWindowTrainer(detector_factory, args.window, args.retrain_interval, args.min_samples, detector)
+    follower = LogFollower(args.log or "access.log", from_start=args.from_start)
+    latency = LatencyTracker()
+
+    trainer.start()
+    print(f"Following {follower.log_file_path}...")
+    batch, written_at = [], None
+    batch_started = last_report = time.time()
+    try:
+        while True:
+            lines, last_write = follower.read_lines()
+            for line in lines:
+                line = line.strip()
+                item = log_processor.parse_log_line(line) if line else None
+                if item:
+                    if not batch:
+                        batch_started, written_at = time.time(), last_write
+                    batch.append(item)
+
+            now = time.time()
+            if batch and (len(batch) >= args.batch_size or now - batch_started >= args.batch_wait):
+                log_processor.add_countries(batch)
+                store = None
+                if aggregator is not None:
+                    # The behaviour fields are computed once, for scoring and for the retraining window alike
+                    store = join_behaviour(aggregator, DataLoader.to_store(batch, log_processor.fields), fields,
+                                           metrics)
+                    batch = list(store.rows())
+                # Take the reference once, a retrained model may replace it at any time
+                detector = trainer.detector
+                if detector is not None:
+                    score_batch(detector, batch, written_at, latency, store)
+                trainer.add(batch, now)
+                batch = []
+            if now - last_report >= args.report_interval:
+                print_latency(latency)
+                last_report = now
+            if not lines:
+                time.sleep(args.poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        trainer.stop()
+        follower.close()
+        print_latency(latency)
+        metrics.info['caches'] = log_processor.cache_stats()
+        metrics.info['latency'] = latency.percentiles()
+        if args.cache_file:
+            log_processor.save_cache(args.cache_file)
+
+
+class LineScorer:
+    """
+    Parses and scores raw log lines against a saved model, in a worker process of the scoring service.
+    """
+
+    def __init__(self, model_path, geoip_db_path, tokenizer='regex', cache_size=DEFAULT_CACHE_SIZE, host=TARGET_HOST,
+                 geoip='reader', scorer='auto', dedup=False):
+        self.detector = AnomalyDetector.load(model_path, scorer=scorer, dedup=dedup)
+        self.log_processor = LogProcessor(LOG_FORMAT, geoip_db_path, tokenizer=tokenizer, cache_size=cache_size,
+                                          fields=input_fields(self.detector.fields), host=host, geoip=geoip)
+        # The behaviour window spans every batch this worker scores
+        self.aggregator = self.detector.behaviour_aggregator()
+
+    def __call__(self, lines):
+        """
+        Returns:
+            list: {'score', 'anomaly'} for every line, None for the lines that are not parsed.
+        """
+        results = [None] * len(lines)
+        positions, items = [], []
+        for pos, line in enumerate(lines):
+            line = line.strip()
+            item = self.log_processor.parse_log_line(line) if line else None
+            if item:
+                positions.append(pos)
+                items.append(item)
+        if not items:
+            return results
+        self.log_processor.add_countries(items)
+        store = join_behaviour(self.aggregator, DataLoader.to_store(items, self.log_processor.fields),
+                               self.detector.fields, self.detector.metrics)
+        for pos, score in zip(positions, self.detector.decision_function(store).tolist()):
+            results[pos] = {'score': score, 'anomaly': score < 0}
+        return results
+
+
+def listen_address(value):
+    host, _, port = value.rpartition(':')
+    try:
+        return host.strip('[]') or '127.0.0.1', int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected host:port, got {value}")
+
+
+def serve(args, metrics):
+    detector = AnomalyDetector.load(args.model, scorer=args.scorer, metrics=metrics, dedup=args.dedup)
+    jobs = args.jobs or os.cpu_count()
+    if detector.behaviour_aggregator() is not None and jobs > 1:
+        print("Warning: every scoring process would keep its own behaviour window, using a single one")
+        jobs = 1
+    del detector
+    service = ScoringService(partial(line_scorer_factory, args), workers=jobs, batch_size=args.batch_size,
+                             batch_wait=args.batch_wait)
+    try:
+        asyncio.run(run_service(args, service))
+    finally:
+        metrics.info['service'] = service.stats()
+        percentiles = ", ".join(f"{name}: {value * 1000:.1f} ms"
+                                for name, value in service.latency.percentiles().items())
+        print(f"Served {service.requests} requests, request latency {percentiles or 'n/a'}")
+
+
+def line_scorer_factory(args, model_path):
+    # Sent to the scoring processes, which build their LineScorer from it
+    return partial(LineScorer, model_path, args.geoip_db, tokenizer=args.tokenizer, cache_size=args.cache_size,
+                   host=target_host(args), geoip=args.geoip, scorer=args.scorer, dedup=args.dedup)
+
+
+async def run_service(args, service):
+    host, port = args.listen
+    await service.start(args.model, host, port, unix_path=args.unix_socket, reload_interval=args.reload_interval)
+    print(f"Scoring on {args.unix_socket or f'http://{host}:{port}'} with {service.pool.workers} processes")
+
+    async def reload():
+        try:
+            await service.reload()
+        except ReloadError as error:
+            print(f"Model reload failed: {error}")
+
+    loop = asyncio.get_running_loop()
+    # SIGHUP reloads the model file, like nginx reloads its configuration
+    loop.add_signal_handler(signal.SIGHUP, lambda: service.tasks.append(asyncio.create_task(reload())))
+    # The scoring processes are shut down too, rather than left orphaned
+    stopped = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+    try:
+        await stopped.wait()
+    finally:
+        await service.close()
+
+
+def field_list(value):
+    try:
+        return resolve_fields(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def run(args, metrics):
+    if args.command == 'score':
+        score(args, metrics)
+    elif args.command == 'follow':
+        follow(args, metrics)
+    elif args.command == 'sweep':
+        sweep(args, metrics)
+    elif args.command == 'serve':
+        serve(args, metrics)
+    else:
+        detect(args, metrics)
+
+
+def main(args):
+    # Timing every line only pays off when the report is asked for
+    metrics = Metrics(timing=args.metrics is not None)
+    profile_output = args.profile_output or f"{args.command}.{'prof' if args.profile == 'cprofile' else 'folded'}"
+    started = metrics.clock()
+    try:
+        with profiled(args.profile, profile_output, args.sample_interval):
+            run(args, metrics)
+    finally:
+        if args.metrics:
+            wall, cpu = metrics.clock()
+            metrics.add('total', wall - started[0], cpu - started[1])
+            metrics.write(args.metrics, command=args.command, log=args.log)
+            print(f"Metrics written to: {args.metrics}")
+
+
 if __name__ == "__main__":
-    main()
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-l', '--log', type=str, default=None,
+                        help="Log to analyze: plain, .zip or .gz, or a directory or glob pattern of logs, parsed one "
+                             "file per worker and merged in file name order (default: access.log, else "
+                             "access.log.zip)")
+    common.add_argument('--partition-pattern', type=str, default=DEFAULT_PARTITION_PATTERN,
+                        help="Regular expression finding the host of a log in its file name, as its 'host' group or "
+                             f"whole match (default: {DEFAULT_PARTITION_PATTERN.replace('%', '%%')})")
+    common.add_argument('--geoip-db', type=str, default=GEOIP_DB_PATH,
+                        help=f"GeoLite2 country database (default: {GEOIP_DB_PATH})")
+    common.add_argument('-w', '--workers', type=int, default=1,
+                        help="Number of parsing processes, 0 to use all the available cores (default: 1)")
+    common.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE // (1024 * 1024),
+                        help="Size in MiB of the log shards handed to each parsing process (default: 32)")
+    common.add_argument('--geoip', choices=['reader', 'table'], default='reader',
+                        help="Look countries up one line at a time with the GeoIP reader, or load the database into "
+                             "a sorted interval table once and resolve whole batches with numpy (default: reader)")
+    common.add_argument('--host', type=str, default=TARGET_HOST,
+                        help=f"Virtual host whose requests are analyzed (default: {TARGET_HOST})")
+    common.add_argument('--all-hosts', action='store_true', help="Analyze the requests of every virtual host")
+    common.add_argument('--reader', choices=['mmap', 'text'], default='mmap',
+                        help="Memory-map plain logs and skip the lines without the host before decoding them, or "
+                             "decode every line (default: mmap)")
+    common.add_argument('-t', '--tokenizer', choices=['legacy', 'regex', 'split'], default='regex',
+                        help="Line tokenizer: greedy legacy regex, delimiter-aware regex or regex-free split "
+                             "(default: regex)")
+    common.add_argument('--scorer', choices=['auto', 'flat', 'sklearn'], default='auto',
+                        help="Score with the vectorized export of the forest, with IsolationForest, or with the "
+                             "export for sparse features only (default: auto)")
+    common.add_argument('--dedup', action='store_true',
+                        help="Featurize and score every distinct record once, and train on the distinct records "
+                             "weighted by their number of occurrences")
+    common.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help=f"Entries kept in each GeoIP/user agent lookup cache, 0 to disable (default: {DEFAULT_CACHE_SIZE})")
+    common.add_argument('--cache-file', type=str, default=None,
+                        help="Persist the lookup caches to this file so the next runs start warm")
+    common.add_argument('--parse-cache', type=str, default=None,
+                        help="Directory caching the parsed log, reused as long as the log, the GeoIP database and the "
+                             "parsed fields are the same (not used by the two-pass and follow modes)")
+    common.add_argument('--metrics', type=str, default=None,
+                        help="Write a JSON report of the time spent in every stage, the line counts and the cache "
+                             "hit rates to this file")
+    common.add_argument('--profile', choices=PROFILERS, default=None,
+                        help="Profile the run with cProfile, or with a low-overhead sampling profiler")
+    common.add_argument('--profile-output', type=str, default=None,
+                        help="cProfile stats or folded stacks file (default: <command>.prof or <command>.folded)")
+    common.add_argument('--sample-interval', type=float, default=DEFAULT_SAMPLE_INTERVAL,
+                        help=f"Seconds between two samples of the sampling profiler (default: {DEFAULT_SAMPLE_INTERVAL})")
+
+    training = argparse.ArgumentParser(add_help=False)
+    training.add_argument('--features', choices=['hashed', 'dense'], default='hashed',
+                          help="Hash every field into 2^20 sparse columns, or encode a few dense float32 columns per "
+                               "field (default: hashed)")
+    training.add_argument('--fields', type=field_list, default=DEFAULT_FIELDS,
+                          help=f"Comma-separated record fields the model is trained on, only these are parsed "
+                               f"(default: {','.join(DEFAULT_FIELDS)}; can also include {','.join(OPTIONAL_FIELDS)})")
+    training.add_argument('--hash-width', type=int, default=8,
+                          help="Hash buckets of each high-cardinality field with --features dense (default: 8)")
+    training.add_argument('--behaviour-window', type=int, default=DEFAULT_WINDOW,
+                          help=f"Seconds of traffic the ip_* behaviour fields are computed over (default: {DEFAULT_WINDOW})")
+    training.add_argument('--behaviour-buckets', type=int, default=DEFAULT_BUCKETS,
+                          help=f"Time buckets the behaviour window slides by (default: {DEFAULT_BUCKETS})")
+    training.add_argument('--sketch-width', type=int, default=DEFAULT_SKETCH_WIDTH,
+                          help=f"Counters per row of the count-min sketches of the behaviour fields, more is more "
+                               f"accurate (default: {DEFAULT_SKETCH_WIDTH})")
+    training.add_argument('--sketch-depth', type=int, default=DEFAULT_SKETCH_DEPTH,
+                          help=f"Rows of the count-min sketches of the behaviour fields (default: {DEFAULT_SKETCH_DEPTH})")
+
+    # IsolationForest settings, as compared by sweep
+    forest = argparse.ArgumentParser(add_help=False)
+    forest.add_argument('--n-estimators', type=int, default=10, help="Number of trees (default: 10)")
+    forest.add_argument('--max-samples', type=parse_grid_value, default='auto',
+                        help="Samples per tree: a count, a fraction of the records or auto (default: auto)")
+    forest.add_argument('--contamination', type=parse_grid_value, default='auto',
+                        help="Expected anomaly rate, which sets the decision threshold, or auto (default: auto)")
+
+    reporting = argparse.ArgumentParser(add_help=False)
+    reporting.add_argument('--top-k', type=int, default=0,
+                           help=f"Report only the k heavy hitters among the anomalies, counted in bounded memory, as "
+                                f"JSON lines (e.g. {DEFAULT_TOP_K}; default: 0, every anomalous IP)")
+    reporting.add_argument('--top-by', choices=GROUPS, action='append', default=None,
+                           help="Count the top anomalies by IP, by /24 or /48 network prefix, or by country; can be "
+                                "repeated (default: ip)")
+    reporting.add_argument('--top-output', type=str, default=None,
+                           help="JSON lines file of the top anomalies (default: stdout)")
+
+    parser = argparse.ArgumentParser(description="Detect anomalous clients in an nginx access log.")
+    subparsers = parser.add_subparsers(dest='command')
+    detect_parser = subparsers.add_parser('detect', parents=[common, training, forest, reporting],
+                                          help="Train a model on the log and report its anomalies (default)")
+    detect_parser.add_argument('-s', '--save-model', type=str, default=None,
+                               help="Save the trained model to this artifact file")
+    detect_parser.add_argument('--per-host', action='store_true',
+                               help="Train and report one model per host partition of the logs, saved and written "
+                                    "with the host in the file names, rather than one model over every log")
+    detect_parser.add_argument('--reservoir-size', type=int, default=0,
+                               help="Read the log twice: train on a uniform sample of this many records, then score "
+                                    "it in chunks, so memory no longer grows with the log (default: 0, single pass)")
+    detect_parser.add_argument('--stratify', choices=['host', 'hour'], default=None,
+                               help="Split the reservoir evenly between http hosts or hours of traffic")
+    detect_parser.add_argument('--score-chunk-size', type=int, default=DEFAULT_BATCH_SIZE,
+                               help=f"Records scored at once in the two-pass mode (default: {DEFAULT_BATCH_SIZE})")
+    detect_parser.add_argument('--checkpoint', type=str, default=None,
+                               help="Directory where the two-pass mode saves its progress, and resumes from after an "
+                                    "interruption (plain logs only)")
+    detect_parser.add_argument('--checkpoint-interval', type=float, default=DEFAULT_CHECKPOINT_INTERVAL,
+                               help=f"Minimum seconds between two checkpoints (default: {DEFAULT_CHECKPOINT_INTERVAL})")
+    score_parser = subparsers.add_parser('score', parents=[common, reporting],
+                                         help="Report the anomalies of the log against a saved model")
+    score_parser.add_argument('-m', '--model', type=str, required=True, help="Model artifact saved by detect")
+    follow_parser = subparsers.add_parser('follow', parents=[common, training, forest],
+                                          help="Score the log as it grows, retraining on a sliding time window")
+    follow_parser.add_argument('-m', '--model', type=str, default=None,
+                               help="Initial model artifact, otherwise the first window of records trains one")
+    follow_parser.add_argument('--from-start', action='store_true',
+                               help="Read the log from its beginning instead of its current end")
+    follow_parser.add_argument('--window', type=int, default=3600,
+                               help="Seconds of records the model is retrained on (default: 3600)")
+    follow_parser.add_argument('--retrain-interval', type=int, default=300,
+                               help="Seconds between background retrainings (default: 300)")
+    follow_parser.add_argument('--min-samples', type=int, default=1000,
+                               help="Records needed in the window before training (default: 1000)")
+    follow_parser.add_argument('--batch-size', type=int, default=1000,
+                               help="Maximum records per scoring micro-batch (default: 1000)")
+    follow_parser.add_argument('--batch-wait', type=float, default=1.0,
+                               help="Maximum seconds a record waits for its micro-batch to fill (default: 1)")
+    follow_parser.add_argument('--poll-interval', type=float, default=0.2,
+                               help="Seconds to sleep when no new line is available (default: 0.2)")
+    follow_parser.add_argument('--report-interval', type=float, default=60,
+                               help="Seconds between latency reports (default: 60)")
+    sweep_parser = subparsers.add_parser('sweep', parents=[common, training],
+                                         help="Featurize the log once and compare a grid of IsolationForest settings")
+    sweep_parser.add_argument('--n-estimators', type=parse_grid_values, default=[10, 50, 100],
+                              help="Comma-separated numbers of trees (default: 10,50,100)")
+    sweep_parser.add_argument('--max-samples', type=parse_grid_values, default=['auto'],
+                              help="Comma-separated samples per tree: counts, fractions or auto (default: auto)")
+    sweep_parser.add_argument('--contamination', type=parse_grid_values, default=['auto'],
+                              help="Comma-separated expected anomaly rates or auto (default: auto)")
+    sweep_parser.add_argument('--seeds', type=int, default=3,
+                              help="Fits per configuration with consecutive seeds, their agreement measures the "
+                                   "stability (default: 3)")
+    sweep_parser.add_argument('--random-state', type=int, default=42, help="First seed (default: 42)")
+    sweep_parser.add_argument('-j', '--jobs', type=int, default=0,
+                              help="Fitting processes, 0 to use all the available cores (default: 0)")
+    sweep_parser.add_argument('--sweep-output', type=str, default=None,
+                              help="Also write the results as JSON lines to this file")
+    serve_parser = subparsers.add_parser('serve', parents=[common],
+                                         help="Score log lines sent over HTTP, on a TCP port or a Unix socket")
+    serve_parser.add_argument('-m', '--model', type=str, required=True, help="Model artifact saved by detect")
+    serve_parser.add_argument('--listen', type=listen_address, default=('127.0.0.1', 8080),
+                              help="host:port to listen on (default: 127.0.0.1:8080)")
+    serve_parser.add_argument('--unix-socket', type=str, default=None,
+                              help="Listen on this Unix socket instead of a TCP port")
+    serve_parser.add_argument('-j', '--jobs', type=int, default=1,
+                              help="Scoring processes, 0 to use all the available cores (default: 1)")
+    serve_parser.add_argument('--batch-size', type=int, default=DEFAULT_SERVICE_BATCH_SIZE,
+                              help=f"Maximum lines of concurrent requests scored together "
+                                   f"(default: {DEFAULT_SERVICE_BATCH_SIZE})")
+    serve_parser.add_argument('--batch-wait', type=float, default=DEFAULT_BATCH_WAIT,
+                              help=f"Maximum seconds a request waits for others to join its batch "
+                                   f"(default: {DEFAULT_BATCH_WAIT})")
+    serve_parser.add_argument('--reload-interval', type=float, default=2.0,
+                              help="Seconds between two checks of the model file, reloaded when it changes; 0 to only "
+                                   "reload on SIGHUP or POST /reload (default: 2)")
+
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in subparsers.choices and argv[0] not in ('-h', '--help'):
+        # Without a command the script keeps its original behaviour
+        argv = ['detect'] + argv
+    main(parser.parse_args(argv))
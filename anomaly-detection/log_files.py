@@ -0,0 +1,124 @@
+import glob
+import os
+import re
+from collections import Counter
+from multiprocessing import Pool
+
+from archives import is_compressed, iter_log_lines, iter_mapped_lines
+from columnar import DEFAULT_BATCH_SIZE, ColumnarStore
+
+# Host part of a rotated log name, such as web01 in web01.access.log-20240101.gz
+DEFAULT_PARTITION_PATTERN = r'^(?P<host>[^._-]+)'
+
+# Per-process LogProcessor, set by the pool initializer
+_log_processor = None
+
+
+def expand_logs(spec):
+    """
+    Lists the log files designated by a path: the file itself, the files of a directory, or the files matching a glob
+    pattern.
+
+    Returns:
+        list: File paths sorted by name, the order their records are merged in.
+    """
+    if os.path.isfile(spec):
+        return [spec]
+    if os.path.isdir(spec):
+        paths = [os.path.join(spec, name) for name in os.listdir(spec) if not name.startswith('.')]
+    else:
+        paths = glob.glob(spec)
+    paths = sorted(path for path in paths if os.path.isfile(path))
+    if not paths:
+        raise FileNotFoundError(f"No log file found at {spec}")
+    return paths
+
+
+def partition_of(path, pattern=DEFAULT_PARTITION_PATTERN):
+    """
+    Returns:
+        str: The partition of a log file: the 'host' group of the pattern searched in the file name, the whole match
+            without that group, or the file name when the pattern does not match.
+    """
+    name = os.path.basename(path)
+    match = re.search(pattern, name)
+    if match is None:
+        return name
+    return match.group('host') if 'host' in match.re.groupindex else match.group(0)
+
+
+def partition_path(path, partition):
+    """
+    Returns:
+        str: The output path of a partition, e.g. model.web01.joblib for model.joblib.
+    """
+    if partition is None or path in (None, '-'):
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{partition}{extension}"
+
+
+def parse_file(log_processor, path, encoding=None, reader='mmap', batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Returns:
+        ColumnarStore: The parsed records of a whole log file, plain or compressed.
+    """
+    if reader == 'mmap' and not is_compressed(path):
+        needle, anchored = log_processor.prefilter(encoding)
+        lines = iter_mapped_lines(path, encoding, needle, anchored=anchored, skipped=log_processor.count_skipped)
+    else:
+        lines = iter_log_lines(path, encoding)
+    store = ColumnarStore.for_fields(log_processor.fields, capacity=batch_size)
+    batch = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            item = log_processor.parse_log_line(line)
+            if item:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    store.append_batch(batch)
+                    batch = []
+    store.append_batch(batch)
+    store.trim()
+    return store
+
+
+def _init_worker(log_processor):
+    global _log_processor
+    _log_processor = log_processor
+    _log_processor.track_worker_state()
+
+
+def _parse_file(task):
+    path, encoding, reader = task
+    store = parse_file(_log_processor, path, encoding, reader)
+    return path, store, _log_processor.export_worker_state()
+
+
+def parse_files(log_processor, paths, workers=1, encoding=None, reader='mmap'):
+    """
+    Parses whole log files, one file per task. In a process pool, an idle worker takes the next file from the shared
+    queue, largest files first so that a big one does not start last and keep a single worker busy at the end.
+
+    Parameters:
+        log_processor (LogProcessor): Processor copied into every worker.
+        paths (list): Log files, plain or compressed.
+        workers (int, optional): Number of worker processes. If None, uses all the available cores.
+
+    Yields:
+        tuple: (path, store, counters) of every file, in completion order; counters are the ones of that file only.
+    """
+    if workers == 1:
+        for path in paths:
+            before = Counter(log_processor.metrics.counters)
+            store = parse_file(log_processor, path, encoding, reader)
+            yield path, store, dict(log_processor.metrics.counters - before)
+        return
+    workers = min(workers or os.cpu_count(), len(paths))
+    tasks = [(path, encoding, reader) for path in sorted(paths, key=os.path.getsize, reverse=True)]
+    with Pool(workers, initializer=_init_worker, initargs=(log_processor,)) as pool:
+        for path, store, state in pool.imap_unordered(_parse_file, tasks):
+            # Bring back what the worker learned, such as new lookup cache entries
+            log_processor.merge_worker_state(state)
+            yield path, store, state['metrics']['counters']
@@ -0,0 +1,149 @@
+import argparse
+import calendar
+import gzip
+import json
+import random
+import time
+
+SIZES = {'1M': 1000000, '10M': 10000000, '50M': 50000000}
+
+BROWSERS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{major}.0.{build}.{patch} Safari/537.36',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:{major}.0) Gecko/20100101 Firefox/{major}.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_{patch}) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/{major}.1 Safari/605.1.15',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS {major}_{patch} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148',
+    'Mozilla/5.0 (Linux; Android {major}; SM-G99{patch}B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{build}.0.0.0 Mobile Safari/537.36',
+]
+SCANNERS = ['sqlmap/1.{patch}#stable', 'Nikto/2.1.{patch}', 'python-requests/2.{major}.0', 'masscan/1.{patch}', '-']
+PAGES = ['/', '/index.html', '/login', '/logout', '/rooms', '/rooms/{id}', '/api/rooms/{id}/messages', '/api/verify',
+         '/static/js/main.{id}.js', '/static/css/main.{id}.css', '/assets/logo.webp', '/favicon.ico']
+PROBES = ['/wp-login.php', '/.env', '/.git/config', '/admin', '/phpmyadmin/index.php', '/cgi-bin/test.cgi',
+          '/api/rooms/{id}/messages?q=1%27%20OR%201=1', '/../../etc/passwd', '/server-status', '/actuator/health']
+REFERERS = ['-', '-', '-', 'https://mydomain.com/', 'https://mydomain.com/rooms', 'https://www.google.com/']
+NORMAL_STATUS = [200] * 40 + [304] * 6 + [301, 302, 404, 500]
+PROBE_STATUS = [404] * 6 + [403, 400, 401, 500]
+
+
+class LogGenerator:
+    """
+    Seeded generator of nginx access log lines in the log_format used by isolation-forest.py, with anomalous bursts
+    (scanners probing unusual URLs) injected into the regular traffic.
+    """
+
+    def __init__(self, seed=42, ips=10000, user_agents=500, bursts=20, burst_size=500, other_host_ratio=0.1,
+                 rate=200, start=None, host='mydomain.com'):
+        self.rng = random.Random(seed)
+        self.rate = rate
+        self.start = int(start if start is not None else calendar.timegm((2024, 5, 1, 0, 0, 0)))
+        self.host = host
+        self.other_host_ratio = other_host_ratio
+        self.bursts = bursts
+        self.burst_size = burst_size
+        self.ips = [self.random_ip() for _ in range(ips)]
+        self.user_agents = [self.rng.choice(BROWSERS).format(major=self.rng.randint(90, 125),
+                                                             build=self.rng.randint(1000, 6999),
+                                                             patch=self.rng.randint(0, 9))
+                            for _ in range(user_agents)]
+        # Client popularity follows a power law, a few IPs produce most of the traffic
+        self.ip_weights = self.cumulative([1 / (rank + 1) for rank in range(len(self.ips))])
+        self.user_agent_weights = self.cumulative([1 / (rank + 1) for rank in range(len(self.user_agents))])
+        self.attackers = []
+        self.time_cache = (None, None)
+
+    @staticmethod
+    def cumulative(weights):
+        total, cumulative = 0, []
+        for weight in weights:
+            total += weight
+            cumulative.append(total)
+        return cumulative
+
+    def random_ip(self):
+        if self.rng.random() < 0.05:
+            return f"2001:db8:{self.rng.randint(0, 0xffff):x}::{self.rng.randint(1, 0xffff):x}"
+        return f"{self.rng.randint(1, 223)}.{self.rng.randint(0, 255)}.{self.rng.randint(0, 255)}.{self.rng.randint(1, 254)}"
+
+    def time_local(self, line_number):
+        second = self.start + line_number // self.rate
+        if self.time_cache[0] != second:
+            self.time_cache = (second, time.strftime('%d/%b/%Y:%H:%M:%S +0000', time.gmtime(second)))
+        return self.time_cache[1]
+
+    def normal_line(self, line_number):
+        rng = self.rng
+        ip = rng.choices(self.ips, cum_weights=self.ip_weights)[0]
+        user_agent = rng.choices(self.user_agents, cum_weights=self.user_agent_weights)[0]
+        method = 'POST' if rng.random() < 0.1 else 'GET'
+        url = rng.choice(PAGES).format(id=rng.randint(1, 200))
+        status = rng.choice(NORMAL_STATUS)
+        size = 0 if status == 304 else rng.randint(200, 60000)
+        host = self.host if rng.random() >= self.other_host_ratio else f"other{rng.randint(1, 5)}.example.com"
+        return (f'{ip} - {self.time_local(line_number)}] "{method} {url} HTTP/1.1" {status} {size} '
+                f'"{rng.choice(REFERERS)}" "{user_agent}" "-" {host}')
+
+    def burst_line(self, attacker, user_agent, line_number):
+        rng = self.rng
+        method = rng.choice(['GET', 'GET', 'POST', 'HEAD', 'PUT'])
+        url = rng.choice(PROBES).format(id=rng.randint(1, 10000))
+        return (f'{attacker} - {self.time_local(line_number)}] "{method} {url} HTTP/1.1" {rng.choice(PROBE_STATUS)} '
+                f'{rng.randint(0, 600)} "-" "{user_agent}" "-" {self.host}')
+
+    def lines(self, count):
+        # Bursts start at random points and interleave with the regular traffic until they are over
+        starts = sorted(self.rng.sample(range(count), min(self.bursts, count)))
+        active = []
+        next_start = 0
+        for line_number in range(count):
+            while next_start < len(starts) and starts[next_start] == line_number:
+                attacker = self.random_ip()
+                self.attackers.append(attacker)
+                user_agent = self.rng.choice(SCANNERS).format(major=self.rng.randint(20, 31), patch=self.rng.randint(0, 9))
+                active.append([attacker, user_agent, self.burst_size])
+                next_start += 1
+            if active and self.rng.random() < 0.5:
+                burst = self.rng.choice(active)
+                burst[2] -= 1
+                if burst[2] <= 0:
+                    active.remove(burst)
+                yield self.burst_line(burst[0], burst[1], line_number)
+            else:
+                yield self.normal_line(line_number)
+
+    def write(self, output_path, count):
+        opener = gzip.open if output_path.endswith('.gz') else open
+        with opener(output_path, 'wt') as file:
+            batch = []
+            for line in self.lines(count):
+                batch.append(line)
+                if len(batch) >= 10000:
+                    file.write('\n'.join(batch) + '\n')
+                    batch = []
+            if batch:
+                file.write('\n'.join(batch) + '\n')
+
+
+def parse_size(size):
+    return SIZES[size] if size in SIZES else int(size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic nginx access log with anomalous bursts.")
+    parser.add_argument('output', type=str, help="Log to write, gzip compressed if it ends with .gz")
+    parser.add_argument('-n', '--lines', type=str, default='1M', help="Number of lines, or 1M/10M/50M (default: 1M)")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed (default: 42)")
+    parser.add_argument('--ips', type=int, default=10000, help="Distinct client IPs (default: 10000)")
+    parser.add_argument('--user-agents', type=int, default=500, help="Distinct user agents (default: 500)")
+    parser.add_argument('--bursts', type=int, default=20, help="Anomalous bursts to inject (default: 20)")
+    parser.add_argument('--burst-size', type=int, default=500, help="Lines per anomalous burst (default: 500)")
+    parser.add_argument('--other-host-ratio', type=float, default=0.1,
+                        help="Share of lines for other virtual hosts (default: 0.1)")
+    parser.add_argument('--rate', type=int, default=200, help="Lines per second of log time (default: 200)")
+    parser.add_argument('--labels', type=str, default=None, help="Write the IPs of the injected bursts to this JSON file")
+
+    args = parser.parse_args()
+    generator = LogGenerator(args.seed, args.ips, args.user_agents, args.bursts, args.burst_size,
+                             args.other_host_ratio, args.rate)
+    generator.write(args.output, parse_size(args.lines))
+    if args.labels:
+        with open(args.labels, 'w') as fp:
+            json.dump({'attackers': generator.attackers}, fp, indent=2)
@@ -0,0 +1,134 @@
+import json
+import os
+from collections import OrderedDict
+from importlib import metadata
+
+DEFAULT_CACHE_SIZE = 65536
+CACHE_FILE_VERSION = 1
+
+
+class LRUCache:
+    """
+    Bounded memoization of a lookup function, with hit/miss/eviction counters.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Entries computed since the last export, only recorded inside pool workers
+        self.additions = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, compute):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            value = compute(key)
+            self.put(key, value)
+            if self.additions is not None:
+                self.additions.append((key, value))
+            return value
+        self.hits += 1
+        self.data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def reset_stats(self):
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def export(self):
+        """
+        Returns the counters and the new entries since the previous export, and resets them.
+        """
+        exported = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'additions': self.additions or [],
+        }
+        self.reset_stats()
+        self.additions = []
+        return exported
+
+    def merge(self, exported):
+        self.hits += exported['hits']
+        self.misses += exported['misses']
+        self.evictions += exported['evictions']
+        # Entries pushed out to make room for the merged ones were not evicted by a lookup, they are not counted
+        evictions = self.evictions
+        for key, value in exported['additions']:
+            self.put(key, value)
+        self.evictions = evictions
+
+
+def ua_parser_version():
+    try:
+        return metadata.version('ua-parser')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def load_caches(cache_path, key, caches):
+    """
+    Fills the caches from a cache file, unless it is missing or was written for a different key.
+
+    Parameters:
+        cache_path (str): Path to the cache file.
+        key (dict): Versions of the lookup sources the entries are valid for.
+        caches (dict): LRUCache instances by name.
+
+    Returns:
+        bool: True if the file was loaded.
+    """
+    if not os.path.isfile(cache_path):
+        return False
+    try:
+        with open(cache_path, 'r') as file:
+            content = json.load(file)
+    except (OSError, ValueError):
+        return False
+    if content.get('version') != CACHE_FILE_VERSION or content.get('key') != key:
+        return False
+
+    for name, cache in caches.items():
+        # Entries are stored from the least to the most recently used
+        for entry_key, value in content.get('caches', {}).get(name, []):
+            cache.put(entry_key, tuple(value) if isinstance(value, list) else value)
+    return True
+
+
+def save_caches(cache_path, key, caches):
+    content = {
+        'version': CACHE_FILE_VERSION,
+        'key': key,
+        'caches': {name: list(cache.data.items()) for name, cache in caches.items()},
+    }
+    temp_path = f"{cache_path}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(content, file)
+    os.replace(temp_path, cache_path)
@@ -0,0 +1,191 @@
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILERS = ('cprofile', 'sample')
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+
+class Metrics:
+    """
+    Wall and CPU time per pipeline stage, plus plain event counters.
+
+    Coarse stages, such as loading or fitting, are always timed. Per-line stages, such as tokenizing or the GeoIP
+    lookups, are only timed when `timing` is set, as the clock calls cost a few microseconds per line.
+    """
+
+    def __init__(self, timing=False):
+        self.timing = timing
+        self.stages = {}
+        self.counters = Counter()
+        # Context of the run added to the report, such as the lookup cache statistics
+        self.info = {}
+        # The sliding window trainer fits in a background thread
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def clock():
+        return time.perf_counter(), time.process_time()
+
+    def add(self, name, wall, cpu, calls=1, items=0):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0, 'items': 0}
+            stage['wall_seconds'] += wall
+            stage['cpu_seconds'] += cpu
+            stage['calls'] += calls
+            stage['items'] += items
+
+    def lap(self, name, started):
+        """
+        Adds the time elapsed since `started` to a stage, and returns the clock to time the next one from.
+        """
+        now = self.clock()
+        self.add(name, now[0] - started[0], now[1] - started[1])
+        return now
+
+    @contextmanager
+    def stage(self, name, items=0):
+        started = self.clock()
+        try:
+            yield
+        finally:
+            wall, cpu = self.clock()
+            self.add(name, wall - started[0], cpu - started[1], items=items)
+
+    def reset(self):
+        self.stages = {}
+        self.counters = Counter()
+
+    def export(self):
+        """
+        Returns the stages and counters recorded since the previous export, and resets them.
+        """
+        exported = {'stages': self.stages, 'counters': dict(self.counters)}
+        self.reset()
+        return exported
+
+    def merge(self, exported):
+        for name, stage in exported['stages'].items():
+            self.add(name, stage['wall_seconds'], stage['cpu_seconds'], stage['calls'], stage['items'])
+        self.counters.update(exported['counters'])
+
+    def report(self, **extra):
+        with self.lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+        for stage in stages.values():
+            if stage['items'] and stage['wall_seconds']:
+                stage['items_per_second'] = stage['items'] / stage['wall_seconds']
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        # Pool workers are children, their CPU time is only known once they have exited
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return {
+            **extra,
+            **self.info,
+            'cpu_seconds': own.ru_utime + own.ru_stime,
+            'children_cpu_seconds': children.ru_utime + children.ru_stime,
+            'stages': stages,
+            'counters': dict(self.counters),
+        }
+
+    def write(self, path, **extra):
+        with open(path, 'w') as fp:
+            json.dump(self.report(**extra), fp, indent=2)
+            fp.write('\n')
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: a thread records the stack of the profiled thread every `interval` seconds.
+
+    It slows the profiled code down far less than cProfile, at the cost of missing short functions. The samples are
+    written as folded stacks, the input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.thread_id = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as fp:
+            for stack, count in self.samples.most_common():
+                fp.write(f"{stack} {count}\n")
+
+    def print_top(self, limit=20):
+        total = sum(self.samples.values())
+        if not total:
+            return
+        own = Counter()
+        for stack, count in self.samples.items():
+            own[stack.rsplit(';', 1)[-1]] += count
+        print(f"{total} samples, functions with the most samples on top of the stack:")
+        for function, count in own.most_common(limit):
+            print(f"{count / total:8.1%}  {function}")
+
+
+@contextmanager
+def profiled(profiler, output_path, interval=DEFAULT_SAMPLE_INTERVAL):
+    """
+    Profiles the current thread for the duration of the block.
+
+    Parameters:
+        profiler (str): 'cprofile', 'sample' or None to run without profiling.
+        output_path (str): pstats file for cprofile, folded stacks file for sample.
+        interval (float): Seconds between two samples of the sampling profiler.
+    """
+    if profiler is None:
+        yield
+        return
+    if profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler: {profiler}")
+
+    if profiler == 'cprofile':
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(output_path)
+            pstats.Stats(profile).sort_stats('cumulative').print_stats(20)
+            print(f"Profile written to: {output_path}")
+    else:
+        sampler = SamplingProfiler(interval)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.write(output_path)
+            sampler.print_top()
+            print(f"Folded stacks written to: {output_path}")
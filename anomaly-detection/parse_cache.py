@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from columnar import ColumnarStore
+
+PARSE_CACHE_FORMAT = 1
+
+
+def file_digest(path):
+    with open(path, 'rb') as fp:
+        return hashlib.file_digest(fp, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+
+
+class ParsedLogCache:
+    """
+    Parsed logs saved as ColumnarStore directories, so that rerunning on an unchanged log skips parsing entirely.
+
+    Entries are keyed by the content of the log and of the GeoIP database, plus everything else the parsed records
+    depend on (log format, fields, host...). A changed input gives a new key, and its entry is parsed again.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @staticmethod
+    def key(log_path, log_format, geoip_db_path, config):
+        """
+        Parameters:
+            config (dict): The other settings the records depend on, JSON-serializable.
+        """
+        return {
+            'format': PARSE_CACHE_FORMAT,
+            'log': file_digest(log_path),
+            'log_format': log_format,
+            'geoip_db': file_digest(geoip_db_path),
+            **config,
+        }
+
+    def entry_path(self, key):
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:32]
+        return os.path.join(self.directory, digest)
+
+    def load(self, key, mmap=True):
+        """
+        Returns:
+            tuple: The cached store, with its columns memory-mapped unless mmap is False, and the metadata saved with
+                it; None when there is no entry for the key.
+        """
+        path = self.entry_path(key)
+        try:
+            with open(os.path.join(path, 'entry.json')) as fp:
+                entry = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if entry.get('key') != key:
+            return None
+        return ColumnarStore.load(path, mmap), entry.get('metadata', {})
+
+    def save(self, key, store, metadata=None):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.entry_path(key)
+        # Written next to its final place then renamed, so a reader never sees half an entry
+        temp_path = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        try:
+            store.save(temp_path)
+            with open(os.path.join(temp_path, 'entry.json'), 'w') as fp:
+                json.dump({'key': key, 'metadata': metadata or {}}, fp)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(temp_path, path)
+        except BaseException:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+        return path
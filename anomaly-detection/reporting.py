@@ -0,0 +1,96 @@
+import ipaddress
+import json
+import sys
+
+import numpy as np
+
+from columnar import MISSING
+from sketches import SpaceSaving
+
+# Keys anomalies can be counted by: the client address, its /24 (IPv4) or /48 (IPv6) network, or its country
+GROUPS = ('ip', 'prefix', 'country')
+DEFAULT_TOP_K = 100
+
+
+def network_prefix(address):
+    """
+    Returns:
+        str: The /24 network of an IPv4 address or the /48 of an IPv6 one, the address itself when it is not valid.
+    """
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return address
+    return str(ipaddress.ip_network(f"{ip}/{24 if ip.version == 4 else 48}", strict=False))
+
+
+class TopAnomalies:
+    """
+    Keeps the heavy hitters among the anomalous records, per group, in bounded memory.
+
+    Predictions are added a chunk at a time. Every group keeps a SpaceSaving summary of `capacity` counters, several
+    times k so that the top k are exact or nearly so, even with millions of distinct keys.
+    """
+
+    def __init__(self, k=DEFAULT_TOP_K, groups=('ip',), capacity=None):
+        unknown = set(groups).difference(GROUPS)
+        if unknown:
+            raise ValueError(f"Unknown groups: {sorted(unknown)}, choose from {GROUPS}")
+        self.k = k
+        self.groups = tuple(groups)
+        self.summaries = {group: SpaceSaving(capacity or 10 * k) for group in self.groups}
+        self.anomalies = 0
+        self.records = 0
+
+    def update(self, store, predictions):
+        anomalous = predictions < 0
+        self.records += len(predictions)
+        self.anomalies += int(np.count_nonzero(anomalous))
+        for group in self.groups:
+            summary = self.summaries[group]
+            counts = self.count_by(store, anomalous, group)
+            # The heaviest keys of the chunk take the free counters first, and are evicted last
+            for key in sorted(counts, key=counts.get, reverse=True):
+                summary.update(key, counts[key])
+
+    @staticmethod
+    def count_by(store, anomalous, group):
+        # Counts per dictionary code first, so that every distinct value is grouped once per chunk
+        field = 'country' if group == 'country' else 'remote_addr'
+        if field not in store.dictionaries:
+            return {'N/a': int(np.count_nonzero(anomalous))} if anomalous.any() else {}
+        codes, counts = np.unique(store.column(field)[anomalous], return_counts=True)
+        dictionary = store.dictionaries[field]
+        grouped = {}
+        for code, count in zip(codes.tolist(), counts.tolist()):
+            value = dictionary.decode(code) if code != MISSING else None
+            if group == 'prefix':
+                key = network_prefix(value)
+            else:
+                key = value if value is not None else 'N/a'
+            grouped[key] = grouped.get(key, 0) + count
+        return grouped
+
+    def lines(self):
+        """
+        Yields the report as dicts: one summary per group, followed by its top k keys.
+        """
+        for group in self.groups:
+            summary = self.summaries[group]
+            yield {'type': 'summary', 'group': group, 'records': self.records, 'anomalies': self.anomalies,
+                   'tracked': len(summary.counters), 'max_error': summary.min_count()}
+            for rank, (key, count, error, guaranteed) in enumerate(summary.top(self.k), 1):
+                yield {'type': 'top', 'group': group, 'rank': rank, 'key': key, 'count': count, 'error': error,
+                       'guaranteed': guaranteed}
+
+    def write(self, path=None):
+        """
+        Writes the report as JSON lines to path, or to stdout without one.
+        """
+        fp = sys.stdout if path in (None, '-') else open(path, 'w')
+        try:
+            for line in self.lines():
+                fp.write(json.dumps(line) + '\n')
+        finally:
+            if fp is not sys.stdout:
+                fp.close()
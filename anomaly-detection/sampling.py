@@ -0,0 +1,72 @@
+import random
+
+
+class Reservoir:
+    """
+    Fixed-size uniform sample of a stream of records (Algorithm R).
+
+    When records are added with a stratum, each stratum keeps its own uniform sample of at most `level` records, so a
+    busy stratum can't crowd the others out. The level is the largest one that fits in the size: the strata with
+    fewer records keep them all and the others share what they leave, so the reservoir fills up whenever the stream
+    has enough records. Up to one record per stratum may be left unused by the rounding. The level only ever drops
+    as records come, so the samples are only ever shrunk, by dropping random records.
+    """
+
+    def __init__(self, size, seed=42):
+        if size <= 0:
+            raise ValueError(f"Invalid reservoir size: {size}")
+        self.size = size
+        self.rng = random.Random(seed)
+        # stratum -> [records seen, sampled records]
+        self.strata = {}
+        self.total = 0
+        # Maximum sampled records per stratum, None while every record fits
+        self.level = None
+
+    def __len__(self):
+        return sum(len(sample) for _, sample in self.strata.values())
+
+    @property
+    def seen(self):
+        return self.total
+
+    def water_level(self):
+        counts = sorted(seen for seen, _ in self.strata.values())
+        remaining = self.size
+        for pos, seen in enumerate(counts):
+            share = remaining // (len(counts) - pos)
+            if seen > share:
+                return max(1, share)
+            remaining -= seen
+        return None
+
+    def add(self, item, stratum=None):
+        stratum_state = self.strata.get(stratum)
+        if stratum_state is None:
+            stratum_state = self.strata[stratum] = [0, []]
+        stratum_state[0] += 1
+        self.total += 1
+        seen, sample = stratum_state
+        if self.total > self.size and (self.level is None or seen <= self.level):
+            # The stratum kept all its records so far, the others make room for this one
+            self.rebalance()
+        if self.level is None or seen <= self.level:
+            sample.append(item)
+        else:
+            pos = self.rng.randrange(seen)
+            if pos < self.level:
+                sample[pos] = item
+
+    def rebalance(self):
+        self.level = self.water_level()
+        if self.level is None:
+            return
+        for _, sample in self.strata.values():
+            while len(sample) > self.level:
+                # A random subset of a uniform sample is still a uniform sample
+                pos = self.rng.randrange(len(sample))
+                sample[pos] = sample[-1]
+                sample.pop()
+
+    def items(self):
+        return [item for _, sample in self.strata.values() for item in sample]
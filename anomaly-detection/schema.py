@@ -0,0 +1,87 @@
+import time
+from datetime import datetime
+
+from columnar import NUMERIC_FIELDS, OPTIONAL_NUMERIC_FIELDS
+
+# Fields of a parsed record, in the order LogProcessor has always produced them
+DEFAULT_FIELDS = (
+    'remote_addr', 'status', 'body_bytes_sent', 'http_x_forwarded_for', 'http_host', 'method', 'url', 'ref', 'country',
+    'browser_family', 'os_family',
+)
+# Per-IP features over a sliding time window, computed by behaviour.BehaviourAggregator after parsing
+BEHAVIOUR_FIELDS = ('ip_request_rate', 'ip_distinct_urls', 'ip_error_ratio', 'ip_bytes')
+# Fields a model has to opt into, they are not parsed otherwise
+OPTIONAL_FIELDS = ('version', 'time_local', 'hour') + BEHAVIOUR_FIELDS
+# Anomalies are reported per client address
+REQUIRED_FIELDS = ('remote_addr',)
+
+# Fields copied from the tokenized line, and the ones derived from another log variable
+RAW_FIELDS = ('remote_addr', 'status', 'body_bytes_sent', 'http_x_forwarded_for', 'http_host')
+INTEGER_FIELDS = ('status', 'body_bytes_sent')
+REQUEST_FIELDS = ('method', 'url', 'version')
+TIME_FIELDS = ('time_local', 'hour')
+USER_AGENT_FIELDS = ('browser_family', 'os_family')
+
+
+def resolve_fields(fields):
+    """
+    Validates a field selection, given as a sequence or a comma-separated string.
+
+    Returns:
+        tuple: The selected fields, in record order.
+    """
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    selected = set(fields)
+    unknown = selected.difference(DEFAULT_FIELDS, OPTIONAL_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {sorted(unknown)}, choose from {DEFAULT_FIELDS + OPTIONAL_FIELDS}")
+    missing = [field for field in REQUIRED_FIELDS if field not in selected]
+    if missing:
+        raise ValueError(f"Required fields missing from the selection: {missing}")
+    return tuple(field for field in DEFAULT_FIELDS + OPTIONAL_FIELDS if field in selected)
+
+
+def numeric_fields(fields):
+    return tuple(field for field in fields if field in NUMERIC_FIELDS or field in OPTIONAL_NUMERIC_FIELDS)
+
+
+def record_fields(items):
+    """
+    Returns:
+        tuple: The fields present in at least one of the records, in record order.
+    """
+    present = set().union(*items)
+    return tuple(field for field in DEFAULT_FIELDS + OPTIONAL_FIELDS if field in present)
+
+
+class TimestampParser:
+    """
+    Converts $time_local values, such as '10/Oct/2023:13:55:36 +0000', to epoch seconds the way
+    time.mktime(datetime.strptime(...).timetuple()) does, but only parses every distinct minute once.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.minutes = {}
+
+    def __call__(self, time_local):
+        # Everything up to the minute is in the first 17 characters, the seconds follow the next colon
+        seconds = time_local[18:20]
+        if time_local[17:18] != ':' or not seconds.isdigit() or time_local[20:21] not in ('', ' '):
+            return self.parse(time_local)
+        minute = time_local[:17]
+        start = self.minutes.get(minute)
+        if start is None:
+            if len(self.minutes) >= self.maxsize:
+                self.minutes.clear()
+            start = self.minutes[minute] = int(time.mktime(datetime.strptime(minute, '%d/%b/%Y:%H:%M').timetuple()))
+        return start + int(seconds)
+
+    @staticmethod
+    def parse(time_local):
+        return int(time.mktime(datetime.strptime(time_local.split()[0], '%d/%b/%Y:%X').timetuple()))
+
+    @staticmethod
+    def hour(time_local):
+        return int(time_local[12:14])
@@ -0,0 +1,391 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from urllib.parse import urlsplit
+
+from follow import LatencyTracker
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_BATCH_WAIT = 0.005
+DEFAULT_MAX_BODY = 16 * 1024 * 1024
+
+# Per-process scorer, set by the pool initializer
+_scorer = None
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ReloadError(Exception):
+    pass
+
+
+def _init_worker(scorer_factory):
+    global _scorer
+    _scorer = scorer_factory()
+
+
+def _score(lines):
+    return _scorer(lines)
+
+
+def _ready():
+    return os.getpid()
+
+
+class ScoringPool:
+    """
+    Worker processes scoring batches of log lines, each with the scorer built once by the factory of the pool, e.g.
+    a parser and a loaded model.
+
+    A reload starts a whole new pool and swaps it in once every worker has built its scorer. The batches already
+    submitted to the previous pool finish there, so scoring never waits for a model to load.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.executor = None
+        # Number of the scorer in use, incremented by every reload
+        self.generation = 0
+        self.loaded_at = None
+
+    async def start(self, scorer_factory):
+        loop = asyncio.get_running_loop()
+        executor = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(scorer_factory,))
+        try:
+            await asyncio.gather(*(loop.run_in_executor(executor, _ready) for _ in range(self.workers)))
+        except BrokenProcessPool:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise ReloadError("The scorer could not be built, see the worker error above") from None
+        previous, self.executor = self.executor, executor
+        self.generation += 1
+        self.loaded_at = time.time()
+        if previous is not None:
+            previous.shutdown(wait=False)
+
+    async def score(self, lines):
+        """
+        Returns:
+            tuple: The result of every line, and the generation of the scorer that computed them.
+        """
+        # Take the references once, a reload may swap the pool while the batch is scored
+        executor, generation = self.executor, self.generation
+        results = await asyncio.get_running_loop().run_in_executor(executor, _score, lines)
+        return results, generation
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class MicroBatcher:
+    """
+    Coalesces the lines of concurrent requests into batches scored with a single call.
+
+    A batch is sent once it holds batch_size lines, or batch_wait seconds after its first request. At most `slots`
+    batches are scored at once, one per worker: while they are all busy the next batch keeps growing, so the batches
+    get larger as the load increases.
+    """
+
+    def __init__(self, score_batch, batch_size=DEFAULT_BATCH_SIZE, batch_wait=DEFAULT_BATCH_WAIT, slots=1):
+        # Coroutine function scoring a list of lines, as ScoringPool.score
+        self.score_batch = score_batch
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(slots)
+        # Batches being scored, referenced until they are done
+        self.pending = set()
+        self.batches = 0
+        self.lines = 0
+        # Seconds spent scoring each batch, waiting for it to fill not included
+        self.batch_latency = LatencyTracker()
+
+    async def submit(self, lines):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((lines, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.batch_wait
+            while size < self.batch_size:
+                try:
+                    request = await asyncio.wait_for(self.queue.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                size += len(request[0])
+            await self.slots.acquire()
+            # The requests that came in while every worker was busy join this batch
+            while size < self.batch_size and not self.queue.empty():
+                request = self.queue.get_nowait()
+                batch.append(request)
+                size += len(request[0])
+            task = asyncio.create_task(self.flush(batch))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def flush(self, batch):
+        try:
+            lines = [line for request_lines, _ in batch for line in request_lines]
+            started = time.perf_counter()
+            try:
+                results, generation = await self.score_batch(lines)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                return
+            self.batch_latency.add(time.perf_counter() - started, len(lines))
+            self.batches += 1
+            self.lines += len(lines)
+            start = 0
+            for request_lines, future in batch:
+                end = start + len(request_lines)
+                # The future is cancelled when its client went away
+                if not future.done():
+                    future.set_result((results[start:end], generation))
+                start = end
+        finally:
+            self.slots.release()
+
+
+async def read_request(reader, max_body=DEFAULT_MAX_BODY):
+    """
+    Reads one HTTP/1.x request.
+
+    Returns:
+        tuple: (method, path, version, headers, body), or None when the client closed the connection.
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, target, version = request_line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'transfer-encoding' in headers:
+        raise HTTPError(HTTPStatus.LENGTH_REQUIRED, "Chunked bodies are not supported, send a Content-Length")
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+    if length > max_body:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Bodies are limited to {max_body} bytes")
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), urlsplit(target).path, version, headers, body
+
+
+def write_response(writer, status, payload, keep_alive=True):
+    status = HTTPStatus(status)
+    body = json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode('latin-1') + body)
+
+
+def request_lines(headers, body):
+    """
+    Returns:
+        list: The log lines of a /score body: a JSON object with a "line" or a "lines" list, or plain text with one
+            line per line.
+    """
+    if headers.get('content-type', '').startswith('application/json'):
+        try:
+            document = json.loads(body)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid JSON body")
+        lines = [document['line']] if isinstance(document, dict) and 'line' in document else None
+        if lines is None and isinstance(document, dict):
+            lines = document.get('lines')
+        if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'Expected {"line": "..."} or {"lines": ["...", ...]}')
+        return lines
+    try:
+        return body.decode('utf-8').splitlines()
+    except UnicodeDecodeError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "The body is not UTF-8 text")
+
+
+class ScoringService:
+    """
+    Scores raw log lines over HTTP, on a TCP port or a Unix socket:
+
+        POST /score   Log lines as plain text, or JSON {"line": ...} / {"lines": [...]}. Returns the score and
+                      verdict of every line, null for the lines that are not parsed (other hosts, malformed).
+        GET /stats    Request and batch counts, latency percentiles, and the model in use.
+        GET /health   Liveness, with the model generation.
+        POST /reload  Loads the model file given at startup again. Its body must be empty: the model is unpickled,
+                      so clients can't choose the file it is loaded from.
+
+    Parameters:
+        make_scorer (callable): Takes a model path and returns the picklable factory of the worker scorers. A scorer
+            maps a list of lines to a list of results.
+    """
+
+    def __init__(self, make_scorer, workers=1, batch_size=DEFAULT_BATCH_SIZE, batch_wait=DEFAULT_BATCH_WAIT,
+                 max_body=DEFAULT_MAX_BODY):
+        self.make_scorer = make_scorer
+        self.pool = ScoringPool(workers)
+        self.batcher = MicroBatcher(self.pool.score, batch_size, batch_wait, slots=workers)
+        self.max_body = max_body
+        self.reload_lock = asyncio.Lock()
+        self.model_path = None
+        self.model_mtime = None
+        self.requests = 0
+        self.errors = 0
+        # Seconds from a /score request read to its response, the lines it carried as the count
+        self.latency = LatencyTracker()
+        self.server = None
+        self.unix_path = None
+        self.tasks = []
+
+    async def reload(self):
+        async with self.reload_lock:
+            try:
+                mtime = os.stat(self.model_path).st_mtime_ns
+            except OSError as error:
+                raise ReloadError(f"Cannot read the model: {error}") from None
+            await self.pool.start(self.make_scorer(self.model_path))
+            self.model_mtime = mtime
+        print(f"Model {self.pool.generation} loaded from {self.model_path}")
+
+    async def watch(self, interval):
+        # Reloads the model when its file changes, e.g. after a retraining saved over it
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtime = os.stat(self.model_path).st_mtime_ns
+            except OSError:
+                continue
+            if mtime == self.model_mtime:
+                continue
+            try:
+                await self.reload()
+            except ReloadError as error:
+                # Keeps the current model, until the file changes again
+                self.model_mtime = mtime
+                print(f"Model reload failed: {error}")
+
+    async def start(self, model_path, host='127.0.0.1', port=8080, unix_path=None, reload_interval=0):
+        self.model_path = model_path
+        await self.reload()
+        self.tasks.append(asyncio.create_task(self.batcher.run()))
+        if reload_interval:
+            self.tasks.append(asyncio.create_task(self.watch(reload_interval)))
+        if unix_path:
+            self.server = await asyncio.start_unix_server(self.handle, path=unix_path)
+            self.unix_path = unix_path
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for task in self.tasks:
+            task.cancel()
+        self.pool.close()
+        if self.unix_path and os.path.exists(self.unix_path):
+            os.remove(self.unix_path)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.max_body)
+                except HTTPError as error:
+                    write_response(writer, error.status, {'error': str(error)}, keep_alive=False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, version, headers, body = request
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+                try:
+                    status, payload = await self.route(method, path, headers, body)
+                except HTTPError as error:
+                    self.errors += 1
+                    status, payload = error.status, {'error': str(error)}
+                write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, headers, body):
+        if path == '/score' and method == 'POST':
+            return HTTPStatus.OK, await self.score(headers, body)
+        if path == '/stats' and method == 'GET':
+            return HTTPStatus.OK, self.stats()
+        if path == '/health' and method == 'GET':
+            return HTTPStatus.OK, {'status': 'ok', 'model': self.pool.generation}
+        if path == '/reload' and method == 'POST':
+            if body.strip():
+                raise HTTPError(HTTPStatus.FORBIDDEN, "Only the model file the service was started with is reloaded, "
+                                                      "restart the service to serve another one")
+            try:
+                await self.reload()
+            except ReloadError as error:
+                raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, str(error))
+            return HTTPStatus.OK, self.model_info()
+        if path in ('/score', '/stats', '/health', '/reload'):
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not allowed on {path}")
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"No such endpoint: {path}")
+
+    async def score(self, headers, body):
+        started = time.perf_counter()
+        lines = request_lines(headers, body)
+        self.requests += 1
+        if not lines:
+            return {'results': [], 'anomalies': 0, 'model': self.pool.generation}
+        try:
+            results, generation = await self.batcher.submit(lines)
+        except Exception as error:
+            raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, f"Scoring failed: {error!r}")
+        self.latency.add(time.perf_counter() - started, len(lines))
+        anomalies = sum(1 for result in results if result is not None and result['anomaly'])
+        return {'results': results, 'anomalies': anomalies, 'model': generation}
+
+    def model_info(self):
+        return {'model': self.pool.generation, 'path': self.model_path, 'loaded_at': self.pool.loaded_at}
+
+    def stats(self):
+        batcher = self.batcher
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'lines': self.latency.count,
+            'batches': batcher.batches,
+            'mean_batch_lines': batcher.lines / batcher.batches if batcher.batches else None,
+            'queued_requests': batcher.queue.qsize(),
+            'latency_seconds': self.latency.percentiles(),
+            'batch_latency_seconds': batcher.batch_latency.percentiles(),
+            'workers': self.pool.workers,
+            **self.model_info(),
+        }
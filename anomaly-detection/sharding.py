@@ -0,0 +1,122 @@
+import io
+import os
+from multiprocessing import Pool
+
+from archives import iter_mapped_lines
+
+DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
+
+# Per-process LogProcessor, set by the pool initializer
+_log_processor = None
+
+
+def shard_offsets(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Splits a file into byte ranges of roughly chunk_size bytes, each one ending on a line boundary.
+
+    Parameters:
+        file_path (str): Path to the log file.
+        chunk_size (int): Target size of each shard in bytes.
+
+    Returns:
+        list: (start, end) byte offsets, in file order.
+    """
+    if chunk_size <= 0:
+        raise ValueError(f"Invalid chunk size: {chunk_size}")
+
+    size = os.path.getsize(file_path)
+    shards = []
+    with open(file_path, 'rb') as file:
+        start = 0
+        while start < size:
+            end = start + chunk_size
+            if end < size:
+                # Move the boundary past the end of the line it falls into
+                file.seek(end)
+                file.readline()
+                end = file.tell()
+            else:
+                end = size
+            shards.append((start, end))
+            start = end
+    return shards
+
+
+def read_shard(file_path, start, end, encoding=None):
+    """
+    Yields the lines of a byte range, decoded the same way as a file opened in text mode.
+    """
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    yield from io.TextIOWrapper(io.BytesIO(data), encoding=encoding)
+
+
+def _init_worker(log_processor):
+    global _log_processor
+    _log_processor = log_processor
+    _log_processor.track_worker_state()
+
+
+def parse_shard(log_processor, file_path, start, end, encoding=None, reader='text'):
+    """
+    Returns:
+        list: The parsed records of a byte range of the log.
+    """
+    if reader == 'mmap':
+        needle, anchored = log_processor.prefilter(encoding)
+        lines = iter_mapped_lines(file_path, encoding, needle, start, end, anchored,
+                                  skipped=log_processor.count_skipped)
+    else:
+        lines = read_shard(file_path, start, end, encoding)
+    items = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            item = log_processor.parse_log_line(line)
+            if item:
+                items.append(item)
+    return items
+
+
+def _parse_shard(task):
+    file_path, start, end, encoding, reader = task
+    items = parse_shard(_log_processor, file_path, start, end, encoding, reader)
+    return items, _log_processor.export_worker_state()
+
+
+def parse_shards(log_processor, file_path, shards, workers=1, encoding=None, reader='text'):
+    """
+    Parses the given byte ranges of a log, in the current process or in a process pool.
+
+    Yields:
+        tuple: (start, end, records) of every shard, in the order of shards.
+    """
+    if workers == 1:
+        for start, end in shards:
+            yield start, end, parse_shard(log_processor, file_path, start, end, encoding, reader)
+        return
+    tasks = [(file_path, start, end, encoding, reader) for start, end in shards]
+    with Pool(workers, initializer=_init_worker, initargs=(log_processor,)) as pool:
+        for (start, end), (items, state) in zip(shards, pool.imap(_parse_shard, tasks)):
+            # Bring back what the worker learned, such as new lookup cache entries
+            log_processor.merge_worker_state(state)
+            yield start, end, items
+
+
+def parse_in_parallel(log_processor, file_path, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, encoding=None,
+                      reader='text'):
+    """
+    Parses a log file in a process pool, one shard per task, yielding the items in file order.
+
+    Parameters:
+        log_processor (LogProcessor): Processor copied into every worker.
+        file_path (str): Path to the log file.
+        workers (int, optional): Number of worker processes. If None, uses all the available cores.
+        chunk_size (int): Target size of each shard in bytes.
+        encoding (str, optional): Text encoding of the log file.
+        reader (str): 'text' decodes every line of a shard, 'mmap' only the lines passing the processor's prefilter.
+    """
+    shards = shard_offsets(file_path, chunk_size)
+    for _, _, items in parse_shards(log_processor, file_path, shards, workers, encoding, reader):
+        yield from items
@@ -0,0 +1,176 @@
+import hashlib
+import heapq
+
+import numpy as np
+
+# Multiplier of splitmix64, spreads the bits of combined hashes
+MIX_MULTIPLIER = np.uint64(0x9e3779b97f4a7c15)
+
+
+def hash64(value):
+    """
+    Stable 64-bit hash of a string, the same in every process (unlike hash()).
+    """
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'little')
+
+
+def hash_values(values):
+    """
+    Returns:
+        np.ndarray: The uint64 hash64 of every value, e.g. of the values of a store dictionary.
+    """
+    return np.fromiter((hash64(value) for value in values), dtype=np.uint64, count=len(values))
+
+
+def combine_hashes(left, right):
+    """
+    Hashes pairs, such as (IP, URL), from the hashes of their members.
+    """
+    combined = left * MIX_MULTIPLIER ^ right
+    combined ^= combined >> np.uint64(31)
+    return combined * MIX_MULTIPLIER
+
+
+class CountMinSketch:
+    """
+    Approximate counts per key in depth x width counters: estimates never undercount, and overcount by at most
+    about e / width of the total count with high probability.
+
+    Keys are given as uint64 hashes, a whole batch at a time. Counts can be subtracted, which keeps sliding windows
+    exact up to the sketch error.
+    """
+
+    def __init__(self, width=2 ** 15, depth=4, dtype=np.int32):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=dtype)
+
+    def positions(self, hashes):
+        # Double hashing: row i uses low + i * high, from the two halves of the 64-bit hash
+        low = (hashes & np.uint64(0xffffffff)).astype(np.int64)
+        high = (hashes >> np.uint64(32)).astype(np.int64) | 1
+        rows = np.arange(self.depth, dtype=np.int64)[:, None]
+        return (low + rows * high) % self.width
+
+    def add(self, positions, values=None):
+        for row in range(self.depth):
+            if positions.shape[1] > self.width // 8:
+                # Counting a large batch over the whole row is faster than scattered additions
+                self.table[row] += np.bincount(positions[row], values, self.width).astype(self.table.dtype)
+            else:
+                np.add.at(self.table[row], positions[row], 1 if values is None else values)
+
+    def estimate(self, positions):
+        return self.table[np.arange(self.depth)[:, None], positions].min(axis=0)
+
+    def clear(self):
+        self.table[:] = 0
+
+    def __iadd__(self, other):
+        self.table += other.table
+        return self
+
+    def __isub__(self, other):
+        self.table -= other.table
+        return self
+
+
+class HyperLogLog:
+    """
+    Approximate number of distinct keys in 2^precision one-byte registers, with a standard error of about
+    1.04 / sqrt(2^precision).
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = np.zeros(2 ** precision, dtype=np.uint8)
+
+    def add(self, hashes):
+        if not len(hashes):
+            return
+        shift = np.uint64(64 - self.precision)
+        index = (hashes >> shift).astype(np.int64)
+        rest = hashes << np.uint64(self.precision)
+        # Rank of the first set bit of the remaining bits, 64 - precision + 1 when they are all zero
+        high = (rest >> np.uint64(32)).astype(np.float64)
+        low = (rest & np.uint64(0xffffffff)).astype(np.float64)
+        bit_length = np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+        rank = np.minimum(64 - bit_length + 1, 64 - self.precision + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def count(self):
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * size and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = size * np.log(size / zeros)
+        return int(round(estimate))
+
+    def clear(self):
+        self.registers[:] = 0
+
+    def __ior__(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+
+class SpaceSaving:
+    """
+    Streaming top-k of weighted keys (Metwally et al.) in at most `capacity` counters.
+
+    When a new key arrives with every counter in use, it takes over the smallest counter, whose count becomes its
+    overestimation error. The true count of every reported key lies in [count - error, count], and any key whose
+    true count is above the smallest counter is always among the reported ones.
+    """
+
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError("The capacity must be positive.")
+        self.capacity = capacity
+        self.counters = {}
+        # (count, key) entries, stale once the count of their key has changed
+        self.heap = []
+        self.total = 0
+
+    def update(self, key, count=1):
+        self.total += count
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += count
+        elif len(self.counters) < self.capacity:
+            counter = self.counters[key] = [count, 0]
+        else:
+            smallest, smallest_key = self.pop_smallest()
+            del self.counters[smallest_key]
+            counter = self.counters[key] = [smallest + count, smallest]
+        heapq.heappush(self.heap, (counter[0], key))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(counter[0], key) for key, counter in self.counters.items()]
+            heapq.heapify(self.heap)
+
+    def pop_smallest(self):
+        while True:
+            count, key = heapq.heappop(self.heap)
+            counter = self.counters.get(key)
+            if counter is not None and counter[0] == count:
+                return count, key
+
+    def min_count(self):
+        """
+        Returns:
+            int: The largest true count a key missing from the summary can have.
+        """
+        return min(counter[0] for counter in self.counters.values()) if len(self.counters) >= self.capacity else 0
+
+    def top(self, k=None):
+        """
+        Returns:
+            list: (key, count, error, guaranteed) tuples, largest count first, where guaranteed tells that the key is
+                certainly among the k most frequent ones.
+        """
+        ranked = sorted(self.counters.items(), key=lambda item: -item[1][0])
+        k = len(ranked) if k is None else k
+        threshold = ranked[k][1][0] if k < len(ranked) else self.min_count()
+        return [(key, count, error, count - error >= threshold) for key, (count, error) in ranked[:k]]
@@ -0,0 +1,129 @@
+import itertools
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.stats import spearmanr
+from sklearn.ensemble import IsolationForest
+
+from forest_scorer import FlatForest
+
+# Feature matrix of the pool workers, memory-mapped by the pool initializer
+_matrix = None
+
+
+def save_matrix(X, directory):
+    """
+    Writes a dense or CSR feature matrix as .npy files, which every process can memory-map without a copy.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if sp.issparse(X):
+        X = sp.csr_matrix(X)
+        for name in ('data', 'indices', 'indptr'):
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(X, name))
+        with open(os.path.join(directory, 'shape.json'), 'w') as fp:
+            json.dump(list(X.shape), fp)
+    else:
+        np.save(os.path.join(directory, 'dense.npy'), np.ascontiguousarray(X))
+
+
+def load_matrix(directory):
+    dense_path = os.path.join(directory, 'dense.npy')
+    if os.path.isfile(dense_path):
+        return np.load(dense_path, mmap_mode='r')
+    with open(os.path.join(directory, 'shape.json')) as fp:
+        shape = tuple(json.load(fp))
+    data, indices, indptr = (np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+                             for name in ('data', 'indices', 'indptr'))
+    return sp.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+
+def parse_grid_value(token):
+    """
+    Parses one grid value: 'auto', an integer or a float.
+    """
+    token = token.strip()
+    if token == 'auto':
+        return token
+    return float(token) if '.' in token or 'e' in token else int(token)
+
+
+def parse_grid_values(value):
+    """
+    Parses a comma-separated list of grid values: 'auto', integers and floats.
+    """
+    return [parse_grid_value(token) for token in value.split(',') if token.strip()]
+
+
+def build_grid(n_estimators, max_samples, contamination):
+    return [{'n_estimators': n, 'max_samples': samples, 'contamination': rate}
+            for n, samples, rate in itertools.product(n_estimators, max_samples, contamination)]
+
+
+def _init_worker(directory):
+    global _matrix
+    _matrix = load_matrix(directory)
+
+
+def _fit_config(task):
+    config, seeds = task
+    scores, flagged, fit_seconds, score_seconds = [], [], [], []
+    for seed in seeds:
+        model = IsolationForest(random_state=np.random.RandomState(seed), **config)
+        started = time.perf_counter()
+        model.fit(_matrix)
+        fitted = time.perf_counter()
+        # The vectorized export is the faster scorer for sparse matrices, see AnomalyDetector.use_flat_forest
+        if sp.issparse(_matrix):
+            decision = FlatForest.from_isolation_forest(model).decision_function(_matrix)
+        else:
+            decision = model.decision_function(_matrix)
+        scores.append(decision)
+        flagged.append(decision < 0)
+        fit_seconds.append(fitted - started)
+        score_seconds.append(time.perf_counter() - fitted)
+    return config, summarize(scores, flagged, fit_seconds, score_seconds)
+
+
+def summarize(scores, flagged, fit_seconds, score_seconds):
+    """
+    Returns:
+        dict: Runtimes, the share of records flagged, and how much the seeds agree on the scores (Spearman rank
+            correlation) and on the flagged records (Jaccard index), averaged over every pair of seeds.
+    """
+    correlations, overlaps = [], []
+    for first, second in itertools.combinations(range(len(scores)), 2):
+        correlations.append(spearmanr(scores[first], scores[second]).statistic)
+        union = np.count_nonzero(flagged[first] | flagged[second])
+        overlaps.append(np.count_nonzero(flagged[first] & flagged[second]) / union if union else 1.0)
+    return {
+        'fit_seconds': float(np.mean(fit_seconds)),
+        'score_seconds': float(np.mean(score_seconds)),
+        'anomaly_rate': float(np.mean([np.mean(mask) for mask in flagged])),
+        'rank_correlation': float(np.mean(correlations)) if correlations else None,
+        'anomaly_overlap': float(np.mean(overlaps)) if overlaps else None,
+    }
+
+
+def run_sweep(X, grid, seeds, directory, workers=None):
+    """
+    Fits and scores every configuration of the grid once per seed, in a process pool sharing a memory-mapped copy
+    of X.
+
+    Parameters:
+        X: Dense or sparse feature matrix.
+        grid (list): IsolationForest keyword arguments of each configuration.
+        seeds (list): Random seeds each configuration is fitted with, the stability is measured across them.
+        directory (str): Where the matrix is written, such as a temporary directory.
+        workers (int, optional): Number of worker processes. If None, uses all the available cores.
+
+    Yields:
+        tuple: (configuration, results), in completion order.
+    """
+    save_matrix(X, directory)
+    tasks = [(config, list(seeds)) for config in grid]
+    with Pool(workers, initializer=_init_worker, initargs=(directory,)) as pool:
+        yield from pool.imap_unordered(_fit_config, tasks)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The modules of the anomaly detection script are flat siblings, imported the way the script itself does
+sys.path.append(str(Path(__file__).resolve().parent.parent))
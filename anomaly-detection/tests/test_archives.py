@@ -0,0 +1,43 @@
+import pytest
+
+from archives import count_lines, iter_log_lines, iter_mapped_lines
+
+HOST = 'mydomain.com'
+
+
+def write_log(path):
+    lines = []
+    for i in range(400):
+        host = HOST if i % 7 == 0 else f'other{i % 3}.example.com'
+        lines.append(f'10.0.0.{i % 50} - "GET /{i} HTTP/1.1" 200 {i} "https://{HOST}/" {host}')
+        if i % 53 == 0:
+            lines.append('   ')
+        if i % 61 == 0:
+            lines.append('')
+    path.write_text('\n'.join(lines) + '\n')
+
+
+def text_counts(path):
+    lines = [line.strip() for line in iter_log_lines(str(path))]
+    lines = [line for line in lines if line]
+    return len(lines), len([line for line in lines if line.endswith(HOST)])
+
+
+@pytest.mark.parametrize('block_size', [64, 1024, 1024 * 1024])
+@pytest.mark.parametrize('anchored', [False, True])
+def test_mapped_reader_counts_the_lines_it_skips(tmp_path, block_size, anchored):
+    path = tmp_path / 'access.log'
+    write_log(path)
+    skipped = []
+    lines = [line.strip() for line in iter_mapped_lines(str(path), needle=HOST.encode(), anchored=anchored,
+                                                         block_size=block_size, skipped=skipped.append)]
+    lines = [line for line in lines if line]
+    total, kept = text_counts(path)
+    assert len(lines) + sum(skipped) == total
+    assert len([line for line in lines if line.endswith(HOST)]) == kept
+
+
+def test_count_lines_skips_blank_lines():
+    data = b' \nfirst\n\n\t\nsecond\nthird\n'
+    assert count_lines(data) == 3
+    assert count_lines(data, data.index(b'second')) == 2
@@ -0,0 +1,43 @@
+from behaviour import BEHAVIOUR_INPUTS, BehaviourAggregator
+from columnar import ColumnarStore
+
+
+def minute_of_requests(minute, urls, per_minute=12):
+    store = ColumnarStore.for_fields(BEHAVIOUR_INPUTS)
+    store.append_batch([
+        {'remote_addr': '1.1.1.1', 'status': 200, 'body_bytes_sent': 10, 'url': urls[i % len(urls)],
+         'time_local': minute * 60 + i * 60 // per_minute}
+        for i in range(per_minute)
+    ])
+    return store
+
+
+def test_steady_client_keeps_its_url_across_the_window():
+    aggregator = BehaviourAggregator(window=300)
+    for minute in range(12):
+        store = minute_of_requests(minute, ['/a'])
+        aggregator.join(store)
+        assert list(store.column('ip_distinct_urls')) == [1] * len(store)
+    assert store.column('ip_request_rate')[-1] * 300 == 60
+
+
+def test_url_leaves_the_window():
+    aggregator = BehaviourAggregator(window=300)
+    for minute in range(3):
+        aggregator.join(minute_of_requests(minute, ['/a', '/b']))
+    for minute in range(3, 12):
+        store = minute_of_requests(minute, ['/a'])
+        aggregator.join(store)
+    # /b was last requested more than a window ago
+    assert store.column('ip_distinct_urls')[-1] == 1
+
+
+def test_memory_stays_flat_under_a_flood_of_distinct_urls():
+    aggregator = BehaviourAggregator(window=300)
+    for minute in range(6):
+        aggregator.join(minute_of_requests(minute, ['/a']))
+    # Every bucket of the window is allocated by now
+    nbytes = aggregator.nbytes
+    for minute in range(6, 9):
+        aggregator.join(minute_of_requests(minute, [f'/scan/{minute}/{i}' for i in range(20000)], per_minute=20000))
+    assert aggregator.nbytes == nbytes
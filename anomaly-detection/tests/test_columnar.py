@@ -0,0 +1,25 @@
+import numpy as np
+
+from columnar import ColumnarStore
+
+
+def behaviour_store(error_ratios):
+    store = ColumnarStore.for_fields(['status', 'url'])
+    store.append_batch([{'status': 200, 'url': '/a'} for _ in error_ratios])
+    store.add_column('ip_error_ratio', np.array(error_ratios, dtype=np.float32))
+    return store
+
+
+def test_unique_rows_tells_float_columns_apart():
+    store = behaviour_store([0.2, 0.7, 0.2])
+    unique, inverse, counts = store.unique_rows()
+    assert len(unique) == 2
+    np.testing.assert_array_equal(unique.take(inverse).column('ip_error_ratio'), store.column('ip_error_ratio'))
+    assert sorted(counts) == [1, 2]
+
+
+def test_unique_rows_exact_tells_float_columns_apart():
+    store = behaviour_store([0.2, 0.7, 0.2])
+    unique, inverse, counts = store._unique_rows_exact()
+    np.testing.assert_array_equal(unique.take(inverse).column('ip_error_ratio'), store.column('ip_error_ratio'))
+    assert sorted(counts) == [1, 2]
@@ -0,0 +1,10 @@
+import numpy as np
+
+from features import DenseFeatureEncoder
+
+
+def test_dense_encoder_leaves_a_missing_field_unset():
+    encoder = DenseFeatureEncoder(numeric=('status',), hashed=())
+    encoder.fit([{'status': 200, 'url': '/a'}, {'status': 404, 'url': '/b'}])
+    matrix = encoder.transform([{'status': 200}, {'status': 500}])
+    np.testing.assert_array_equal(matrix, [[200, 0, 0], [500, 0, 0]])
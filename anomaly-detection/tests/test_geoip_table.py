@@ -0,0 +1,30 @@
+import random
+import socket
+
+import pytest
+
+from geoip_table import parse_ipv4
+
+
+def inet_pton_value(address):
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+    except (OSError, ValueError):
+        return None
+
+
+def test_parse_ipv4_accepts_what_inet_pton_accepts():
+    rng = random.Random(3)
+    addresses = ['0.0.0.0', '255.255.255.255', '01.2.3.4', '1.2.3.04', '256.1.1.1', '1.2.3', '1.2.3.4.', '1..2.3',
+                 ' 1.2.3.4', '1.2.3.4 ', '1.2.3.4\x00', '1a.2.3.4', '::1', '::ffff:1.2.3.4', '', '.' * 300 + '1.2.3.4']
+    addresses += ['.'.join(str(rng.randint(0, 255)) for _ in range(4)) for _ in range(1000)]
+    addresses += [''.join(rng.choice('0123456789...:a') for _ in range(rng.randint(0, 17))) for _ in range(20000)]
+    values, parsed = parse_ipv4(addresses)
+    for address, value, is_parsed in zip(addresses, values, parsed):
+        assert (int(value) if is_parsed else None) == inet_pton_value(address), address
+
+
+@pytest.mark.parametrize('addresses', [[], ['1.2.3.4', None], ['1.2.3.4', 'é'], ['1.2.3.4', '5.6.7.8\n']])
+def test_parse_ipv4_leaves_unusual_batches_to_inet_pton(addresses):
+    values, parsed = parse_ipv4(addresses)
+    assert len(values) == len(addresses) and not parsed.any()
@@ -0,0 +1,43 @@
+import random
+from collections import Counter
+
+from sampling import Reservoir
+
+
+def test_unstratified_sample_is_algorithm_r():
+    reservoir = Reservoir(100, seed=7)
+    for item in range(10000):
+        reservoir.add(item)
+    rng, expected = random.Random(7), []
+    for item in range(10000):
+        if len(expected) < 100:
+            expected.append(item)
+        else:
+            pos = rng.randrange(item + 1)
+            if pos < 100:
+                expected[pos] = item
+    assert reservoir.items() == expected
+
+
+def test_small_strata_leave_their_share_to_the_others():
+    reservoir = Reservoir(1000)
+    rng = random.Random(1)
+    for item in range(20000):
+        # One busy stratum and five that see 50 records each
+        stratum = 'busy' if item % 80 else f'small{item % 400 // 80}'
+        reservoir.add((stratum, rng.random()), stratum)
+    strata = Counter(stratum for stratum, _ in reservoir.items())
+    assert len(reservoir) >= 1000 - len(strata)
+    assert all(strata[f'small{i}'] == 50 for i in range(5))
+    assert strata['busy'] >= 745
+
+
+def test_stratum_samples_stay_uniform():
+    counts = Counter()
+    for seed in range(200):
+        reservoir = Reservoir(20, seed=seed)
+        for item in range(200):
+            reservoir.add(item, item % 2 if item < 100 else 0)
+        counts.update(item // 50 for item in reservoir.items() if item % 2 == 0)
+    # The even records are all in stratum 0, each quarter of the stream is sampled alike
+    assert max(counts.values()) < 1.3 * min(counts.values())
@@ -0,0 +1,25 @@
+import pytest
+
+from tokenizer import LineTokenizer
+
+LOG_FORMAT = ('$remote_addr - $time_local] "$request" $status $body_bytes_sent "$http_referer" "$http_user_agent" '
+              '"$http_x_forwarded_for" $http_host')
+LINE = ('1.2.3.4 - 01/Jan/2024:00:00:00 +0000] "GET / HTTP/1.1" 200 612 "-" "curl/8.0" "-" mydomain.com')
+
+
+def test_modes_agree_on_well_formed_lines():
+    items = [LineTokenizer(LOG_FORMAT, mode).match(LINE) for mode in ('legacy', 'regex', 'split')]
+    assert items[0] == items[1] == items[2]
+    assert items[1]['http_host'] == 'mydomain.com'
+
+
+@pytest.mark.parametrize('mode', ['regex', 'split'])
+def test_trailing_garbage_is_rejected(mode):
+    assert LineTokenizer(LOG_FORMAT, mode).match(LINE + ' garbage') is None
+
+
+@pytest.mark.parametrize('mode', ['regex', 'split'])
+def test_trailing_garbage_after_a_closing_literal_is_rejected(mode):
+    tokenizer = LineTokenizer('$remote_addr "$request"', mode)
+    assert tokenizer.match('1.2.3.4 "GET / HTTP/1.1"')['request'] == 'GET / HTTP/1.1'
+    assert tokenizer.match('1.2.3.4 "GET / HTTP/1.1" garbage') is None
@@ -0,0 +1,126 @@
+import re
+
+REGEX_LOG_FORMAT_VARIABLE = r'\$([a-zA-Z0-9\_]+)'
+REGEX_SPECIAL_CHARS = r'([\.\*\+\?\|\(\)\{\}\[\]])'
+
+# nginx variables that always hold an unsigned integer
+DIGIT_FIELDS = {
+    'status', 'body_bytes_sent', 'bytes_sent', 'request_length', 'connection', 'connection_requests', 'remote_port',
+    'server_port', 'msec_int',
+}
+# nginx variables that never contain a space
+TOKEN_FIELDS = {
+    'remote_addr', 'binary_remote_addr', 'realip_remote_addr', 'server_addr', 'request_method', 'scheme',
+    'server_protocol', 'http_host', 'host', 'request_time', 'upstream_response_time', 'msec', 'pipe',
+}
+
+MODES = ('legacy', 'regex', 'split')
+
+
+def is_token(value):
+    return value != '' and ' ' not in value
+
+
+def split_log_format(log_format):
+    """
+    Splits an nginx log_format into its literal separators and variable names.
+
+    Returns:
+        tuple: The literal before the first variable, and a list of (variable, following literal) pairs.
+    """
+    parts = re.split(REGEX_LOG_FORMAT_VARIABLE, log_format)
+    return parts[0], list(zip(parts[1::2], parts[2::2]))
+
+
+def build_legacy_pattern(log_format):
+    pattern = re.sub(REGEX_SPECIAL_CHARS, r'\\\1', log_format)
+    pattern = re.sub(REGEX_LOG_FORMAT_VARIABLE, '(?P<\\1>.*)', pattern)
+    return re.compile(pattern)
+
+
+def field_pattern(name, separator):
+    if name in DIGIT_FIELDS:
+        return r'\d+'
+    if name in TOKEN_FIELDS:
+        return r'[^ ]+'
+    if separator:
+        # Everything up to the next delimiter, which leaves the engine nothing to backtrack into
+        return f'[^{re.escape(separator[0])}]*'
+    return '.*'
+
+
+def build_pattern(log_format):
+    prefix, fields = split_log_format(log_format)
+    pattern = re.escape(prefix)
+    for name, separator in fields:
+        pattern += f'(?P<{name}>{field_pattern(name, separator)})' + re.escape(separator)
+    # Anchored at the end, so that a line with trailing garbage is rejected as by the split mode
+    return re.compile(pattern + r'\Z')
+
+
+class LineTokenizer:
+    """
+    Splits log lines into the fields of an nginx log_format.
+
+    Modes:
+        legacy: one greedy (.*) group per variable.
+        regex: one delimiter-aware group per variable, without backtracking on well-formed lines.
+        split: str.find on the literal separators, without any regex.
+    On well-formed lines all the modes return the same fields.
+    """
+
+    def __init__(self, log_format, mode='regex'):
+        if mode not in MODES:
+            raise ValueError(f"Unknown tokenizer mode: {mode}")
+        self.log_format = log_format
+        self.mode = mode
+        self.prefix, self.fields = split_log_format(log_format)
+        if mode == 'legacy':
+            self.pattern = build_legacy_pattern(log_format)
+        elif mode == 'regex':
+            self.pattern = build_pattern(log_format)
+        else:
+            if any(not separator for _, separator in self.fields[:-1]):
+                raise ValueError("The split tokenizer needs a separator between consecutive variables")
+            self.pattern = None
+            self.checks = [self.field_check(name) for name, _ in self.fields]
+
+    @staticmethod
+    def field_check(name):
+        if name in DIGIT_FIELDS:
+            return str.isdecimal
+        if name in TOKEN_FIELDS:
+            return is_token
+        return None
+
+    def match(self, line):
+        """
+        Returns:
+            dict: The fields of the line, or None if the line does not follow the log_format.
+        """
+        if self.pattern is not None:
+            match = self.pattern.match(line)
+            return match.groupdict() if match else None
+        return self.split(line)
+
+    def split(self, line):
+        if not line.startswith(self.prefix):
+            return None
+        item = {}
+        position = len(self.prefix)
+        for (name, separator), check in zip(self.fields, self.checks):
+            if separator:
+                end = line.find(separator, position)
+                if end < 0:
+                    return None
+                value = line[position:end]
+                position = end + len(separator)
+            else:
+                value = line[position:]
+                position = len(line)
+            if check is not None and not check(value):
+                return None
+            item[name] = value
+        if position < len(line):
+            return None
+        return item
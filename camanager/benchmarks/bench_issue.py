@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, NoEncryption
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+from bench_keys import KEYS, issuer
+from generators.native import _init_worker, _issue_certificate
+
+
+def tasks(directory, algorithm, size, count):
+    # The tasks NativeCertificateGenerator.generate_certificates hands to its workers
+    for number in range(count):
+        output_dir = Path(directory) / f'server{number}'
+        output_dir.mkdir()
+        yield (f'server{number}', [('common_name', f'server{number}.local')], f'server{number}.local',
+               str(output_dir), True, (algorithm, size), None)
+
+
+def serial(issuer_certificate, issuer_private_key, algorithm, size, count):
+    with tempfile.TemporaryDirectory(prefix='bench-issue-') as directory:
+        started = time.perf_counter()
+        for task in tasks(directory, algorithm, size, count):
+            _issue_certificate(task, (issuer_certificate, issuer_private_key))
+        return time.perf_counter() - started
+
+
+def parallel(issuer_certificate, issuer_private_key, algorithm, size, count, jobs):
+    # Timed as in the generator, starting the workers included
+    signing_material = (
+        issuer_certificate.public_bytes(Encoding.PEM),
+        issuer_private_key.private_bytes(Encoding.DER, PrivateFormat.PKCS8, NoEncryption()),
+    )
+    with tempfile.TemporaryDirectory(prefix='bench-issue-') as directory:
+        started = time.perf_counter()
+        with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=signing_material) as pool:
+            cpu_time = sum(duration for _, duration in
+                           pool.map(_issue_certificate, tasks(directory, algorithm, size, count)))
+        return time.perf_counter() - started, cpu_time
+
+
+def main(args):
+    issuer_certificate, issuer_private_key = issuer(*KEYS[args.issuer])
+
+    print(f"Issuer {args.issuer}, {args.count} certificates, {args.jobs} processes")
+    print(f"{'key':>8}  {'serial s':>9}  {'parallel s':>11}  {'speedup':>8}  {'estimated':>10}")
+    for name in args.keys:
+        algorithm, size = KEYS[name]
+        alone = serial(issuer_certificate, issuer_private_key, algorithm, size, args.count)
+        elapsed, cpu_time = parallel(issuer_certificate, issuer_private_key, algorithm, size, args.count, args.jobs)
+        # The estimate is the one the generator prints, from the CPU time of the workers
+        print(f"{name:>8}  {alone:9.2f}  {elapsed:11.2f}  {alone / elapsed:7.1f}x  {cpu_time / elapsed:9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the wall-clock time of issuing server certificates one at "
+                                                 "a time and with a pool of processes, as ca-manager -j does.")
+    parser.add_argument('-k', '--keys', nargs='+', choices=list(KEYS), default=['rsa2048', 'p256'],
+                        help="Leaf keys to compare (default: rsa2048 p256)")
+    parser.add_argument('--issuer', choices=list(KEYS), default='rsa2048',
+                        help="Key of the issuing CA, which signs every leaf (default: rsa2048)")
+    parser.add_argument('-n', '--count', type=int, default=16, help="Certificates issued (default: 16)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help="Number of processes (default: the available cores)")
+
+    main(parser.parse_args())
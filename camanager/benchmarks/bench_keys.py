@@ -0,0 +1,138 @@
+import argparse
+import ssl
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding
+from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, NoEncryption
+from cryptography.x509.oid import NameOID
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+from generators.native import generate_private_key, issue_certificate, signature_hash
+
+# Leaf key options compared, as KEY_ALGORITHM and KEY_SIZE of a config.ini section
+KEYS = {
+    'rsa2048': ('RSA', 2048),
+    'rsa3072': ('RSA', 3072),
+    'rsa4096': ('RSA', 4096),
+    'p256': ('ECDSA', 256),
+    'p384': ('ECDSA', 384),
+    'ed25519': ('ED25519', None),
+}
+
+
+def timed(function, seconds):
+    # Runs the function for about the given time, at least once
+    runs, started = 0, time.perf_counter()
+    while True:
+        result = function()
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return result, elapsed / runs
+
+
+def sign(private_key, data):
+    # The signature a TLS server makes with its key at every full handshake
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return private_key.sign(data)
+    if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        return private_key.sign(data, ec.ECDSA(signature_hash(private_key)))
+    return private_key.sign(data, padding.PSS(padding.MGF1(hashes.SHA256()), padding.PSS.DIGEST_LENGTH),
+                            hashes.SHA256())
+
+
+def issuer(algorithm, size):
+    private_key = generate_private_key(algorithm, size)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'bench-issuer')])
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.today() - timedelta(days=1))
+        .not_valid_after(datetime.today() + timedelta(days=30))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(private_key, signature_hash(private_key))
+    )
+    return certificate, private_key
+
+
+def handshake(server_context, client_context):
+    # A full handshake between two in-memory TLS endpoints, without sockets nor session resumption
+    server_in, server_out, client_in, client_out = (ssl.MemoryBIO() for _ in range(4))
+    server = server_context.wrap_bio(server_in, server_out, server_side=True)
+    client = client_context.wrap_bio(client_in, client_out, server_hostname='bench.local')
+    done = {server: False, client: False}
+    while not all(done.values()):
+        for endpoint in (client, server):
+            if not done[endpoint]:
+                try:
+                    endpoint.do_handshake()
+                    done[endpoint] = True
+                except ssl.SSLWantReadError:
+                    pass
+        server_in.write(client_out.read())
+        client_in.write(server_out.read())
+
+
+def contexts(directory, certificate, private_key, issuer_certificate, tls_version):
+    directory = Path(directory)
+    (directory / 'privkey.pem').write_bytes(private_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8,
+                                                                      NoEncryption()))
+    (directory / 'fullchain.pem').write_bytes(certificate.public_bytes(Encoding.PEM) +
+                                              issuer_certificate.public_bytes(Encoding.PEM))
+    (directory / 'ca.pem').write_bytes(issuer_certificate.public_bytes(Encoding.PEM))
+
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(directory / 'fullchain.pem', directory / 'privkey.pem')
+    client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    client_context.load_verify_locations(directory / 'ca.pem')
+    for context in (server_context, client_context):
+        context.minimum_version = context.maximum_version = tls_version
+        context.options |= ssl.OP_NO_TICKET
+    return server_context, client_context
+
+
+def main(args):
+    issuer_certificate, issuer_private_key = issuer(*KEYS[args.issuer])
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'bench.local')])
+    tls_version = ssl.TLSVersion.TLSv1_3 if args.tls == '1.3' else ssl.TLSVersion.TLSv1_2
+
+    print(f"Issuer {args.issuer}, TLS {args.tls}")
+    print(f"{'key':>8}  {'keygen ms':>10}  {'issue ms':>9}  {'sign ms':>8}  {'handshakes/s':>13}")
+    for name in args.keys:
+        algorithm, size = KEYS[name]
+        _, keygen = timed(lambda: generate_private_key(algorithm, size), args.seconds)
+        # Issuing includes the leaf keygen, as in the generator; the signature is the issuer's
+        (private_key, certificate), issue = timed(
+            lambda: issue_certificate(subject, 'bench.local', issuer_certificate, issuer_private_key, algorithm, size),
+            args.seconds)
+        _, signing = timed(lambda: sign(private_key, bytes(64)), args.seconds)
+        with tempfile.TemporaryDirectory(prefix='bench-keys-') as directory:
+            server_context, client_context = contexts(directory, certificate, private_key, issuer_certificate,
+                                                      tls_version)
+            _, shake = timed(lambda: handshake(server_context, client_context), args.seconds)
+        print(f"{name:>8}  {keygen * 1000:10.2f}  {issue * 1000:9.2f}  {signing * 1000:8.3f}  {1 / shake:13,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the key generation, signing and TLS handshake costs of the "
+                                                 "key algorithms of the native generator.")
+    parser.add_argument('-k', '--keys', nargs='+', choices=list(KEYS), default=list(KEYS),
+                        help="Leaf keys to compare (default: all)")
+    parser.add_argument('--issuer', choices=list(KEYS), default='rsa2048',
+                        help="Key of the issuing CA, which signs every leaf (default: rsa2048)")
+    parser.add_argument('--tls', choices=['1.2', '1.3'], default='1.3', help="TLS version (default: 1.3)")
+    parser.add_argument('-s', '--seconds', type=float, default=1.0,
+                        help="Time spent on every measure (default: 1.0)")
+
+    main(parser.parse_args())
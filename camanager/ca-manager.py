@@ -6,16 +6,18 @@ sys.path.append(".")
 sys.path.append("..")
 
 from factories.factory import CertificateGeneratorFactory
-from common.utils import is_unix, fatal, is_windows, info
+from common.utils import is_unix, fatal, is_windows, info, warning
 
 
-def main(generator_choice, output_directory, server_name=None):
+def main(generator_choice, output_directory, server_name=None, jobs=1):
     if is_windows():
         os.system('color')
     if is_unix() and generator_choice == 'powershell':
         fatal("Powershell not supported on linux")
     elif is_windows() and generator_choice == 'bash':
         fatal("Bash not supported on Windows")
+    if jobs != 1 and generator_choice != 'native':
+        warning("Only the native generator issues certificates in parallel")
 
     g = CertificateGeneratorFactory.from_name(generator_choice, output_directory)
     info("Generating Root CA certificate...")
@@ -24,9 +26,9 @@ def main(generator_choice, output_directory, server_name=None):
     g.load_or_generate_intermediate_certificate()
     info("Generating Server certificates...")
     if server_name:
-        g.generate_certificate(name=server_name)
+        g.generate_certificates(server_name, jobs)
     else:
-        g.generate_all_certificates()
+        g.generate_all_certificates(jobs)
 
     g.clean()
     g.print_passwords()
@@ -41,6 +43,9 @@ if __name__ == "__main__":
                         help="Specify the output directory for the generated certificates")
     parser.add_argument('-n', '--name', type=str, action='append', required=False, default=None,
                         help="Specify the name of the certificate to be generated (MUST BE IN CONFIG.INI)")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="Number of processes issuing the server certificates, 0 to use all the available cores "
+                             "(native generator only, default: 1)")
 
     args = parser.parse_args()
-    main(args.generator, args.output, args.name)
+    main(args.generator, args.output, args.name, args.jobs or os.cpu_count())
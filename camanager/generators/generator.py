@@ -12,6 +12,17 @@ from common.utils import get_project_root, info, error, snake_to_camel, translat
     progress
 
 
+# Section options choosing the key and the signature of a certificate rather than naming its subject
+KEY_OPTIONS = ('key_algorithm', 'key_size', 'signature_hash')
+
+
+def build_name(configurations) -> Name:
+    return x509.Name([
+        x509.NameAttribute(getattr(NameOID, key.upper()), value) for key, value in configurations
+        if key.lower() not in KEY_OPTIONS
+    ])
+
+
 class CertificateGenerator(ABC):
     def __init__(self, output_directory: str = "certs"):
         # Directory to save generated files
@@ -45,14 +56,7 @@ class CertificateGenerator(ABC):
 
     def generate_name(self, name) -> Union[Name, None]:
         try:
-            details = []
-
-            configurations = list(self.config.items(name))
-            for key, value in configurations:
-                details.append(
-                    x509.NameAttribute(getattr(NameOID, key.upper()), value)
-                )
-            return x509.Name(details)
+            return build_name(self.config.items(name))
         except configparser.NoSectionError:
             error("Certificate configuration for name '{}' not found".format(name))
             return None
@@ -62,6 +66,8 @@ class CertificateGenerator(ABC):
             details = []
             configurations = list(self.config.items(name))
             for key, value in configurations:
+                if key.lower() in KEY_OPTIONS:
+                    continue
                 real = snake_to_camel(key)
                 if translate:
                     real = translate_openssl_to_powershell(real)
@@ -73,10 +79,15 @@ class CertificateGenerator(ABC):
             error("Certificate configuration for name '{}' not found".format(name))
             return None
 
-    def generate_all_certificates(self):
-        for name in list(self.config.sections()):
-            if name in ["CA", "IntermediateCA"]:
-                continue
+    def get_certificate_names(self) -> list:
+        return [name for name in self.config.sections() if name not in ["CA", "IntermediateCA"]]
+
+    def generate_all_certificates(self, jobs: int = 1):
+        self.generate_certificates(self.get_certificate_names(), jobs)
+
+    def generate_certificates(self, names, jobs: int = 1):
+        # Generators able to issue certificates in parallel override this, the others ignore jobs
+        for name in names:
             self.generate_certificate(name)
 
     def print_passwords(self):
@@ -1,15 +1,18 @@
 import configparser
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from typing import Union
 
 from cryptography import x509
 from cryptography.x509 import Certificate
 from cryptography.x509.oid import NameOID
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
 from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, NoEncryption
 from cryptography.hazmat.primitives.serialization import BestAvailableEncryption
 from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from cryptography.hazmat.primitives.serialization import load_der_private_key, load_pem_private_key
 from cryptography.x509 import load_pem_x509_certificate
 
 from datetime import datetime, timedelta
@@ -17,21 +20,145 @@ import pathlib
 
 from sanitize_filename import sanitize
 
-from generators.generator import CertificateGenerator
-from common.utils import get_project_root, one_day
+from generators.generator import CertificateGenerator, build_name
+from common.utils import get_project_root, one_day, success, fatal, warning
+
+KEY_ALGORITHMS = ('RSA', 'ECDSA', 'ED25519')
+DEFAULT_KEY_ALGORITHM = 'RSA'
+DEFAULT_RSA_KEY_SIZE = 2048
+# KEY_SIZE of the ECDSA keys, their curve
+CURVES = {
+    256: ec.SECP256R1,
+    384: ec.SECP384R1,
+    521: ec.SECP521R1,
+}
+SIGNATURE_HASHES = {
+    'SHA256': hashes.SHA256,
+    'SHA384': hashes.SHA384,
+    'SHA512': hashes.SHA512,
+}
+
+# Intermediate CA certificate and private key of the pool workers, set by the pool initializer
+_issuer = None
+
+
+def check_key_options(algorithm: str, size: Union[int, None] = None):
+    if algorithm not in KEY_ALGORITHMS:
+        raise ValueError(f"Unknown key algorithm '{algorithm}', choose from {', '.join(KEY_ALGORITHMS)}")
+    if algorithm == 'RSA' and size is not None and size < 2048:
+        raise ValueError(f"RSA keys need at least 2048 bits, got {size}")
+    if algorithm == 'ECDSA' and size is not None and size not in CURVES:
+        raise ValueError(f"ECDSA key size must be one of {', '.join(map(str, CURVES))}, got {size}")
+    if algorithm == 'ED25519' and size not in (None, 256):
+        raise ValueError(f"Ed25519 keys have a fixed size, got {size}")
+
+
+def generate_private_key(algorithm: str = DEFAULT_KEY_ALGORITHM, size: Union[int, None] = None):
+    """
+    Parameters:
+        algorithm (str): RSA, ECDSA or ED25519.
+        size (int, optional): RSA modulus bits (default: 2048), or ECDSA curve size: 256 for P-256 (default), 384
+            for P-384, 521 for P-521. Ed25519 keys have no size.
+    """
+    check_key_options(algorithm, size)
+    if algorithm == 'RSA':
+        return rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=size or DEFAULT_RSA_KEY_SIZE,
+        )
+    if algorithm == 'ECDSA':
+        return ec.generate_private_key(CURVES[size or 256]())
+    return ed25519.Ed25519PrivateKey.generate()
+
+
+def signature_hash(issuer_private_key, hash_name: Union[str, None] = None):
+    """
+    Returns:
+        The hash to sign with the issuer's key: the configured one, else SHA-384 for the P-384 and P-521 keys and
+        SHA-256 for the others. None for Ed25519, which hashes the data itself.
+    """
+    if isinstance(issuer_private_key, ed25519.Ed25519PrivateKey):
+        return None
+    if hash_name:
+        try:
+            return SIGNATURE_HASHES[hash_name.upper().replace('-', '')]()
+        except KeyError:
+            raise ValueError(f"Unknown signature hash '{hash_name}', choose from {', '.join(SIGNATURE_HASHES)}")
+    if isinstance(issuer_private_key, ec.EllipticCurvePrivateKey) and issuer_private_key.curve.key_size > 256:
+        return hashes.SHA384()
+    return hashes.SHA256()
+
+
+def issue_certificate(subject, dns_name, issuer_certificate, issuer_private_key, key_algorithm=DEFAULT_KEY_ALGORITHM,
+                      key_size=None, hash_name=None):
+    """
+    Generates a server/client key pair and its certificate, signed by the issuer.
+
+    Returns:
+        tuple: The private key and the certificate.
+    """
+    # Generate server/client's private key
+    private_key = generate_private_key(key_algorithm, key_size)
+
+    # Generate server/client's certificate
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(issuer_certificate.subject)
+        .public_key(private_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.today() - one_day())
+        .not_valid_after(datetime.today() + timedelta(days=365))
+        .add_extension(
+            x509.SubjectAlternativeName([x509.DNSName(dns_name)]),
+            critical=False,
+        )
+        .sign(issuer_private_key, signature_hash(issuer_private_key, hash_name))
+    )
+    return private_key, certificate
+
+
+def save_certificate(output_dir: pathlib.Path, private_key, certificate, chain_certificate=None):
+    # Save server's key and certificate, plus the full chain when it has an intermediate
+    (private_key_pem, cert_pem) = (
+        private_key.private_bytes(
+            Encoding.PEM,
+            PrivateFormat.PKCS8,
+            NoEncryption()
+        ),
+        certificate.public_bytes(Encoding.PEM),
+    )
+
+    if chain_certificate is not None:
+        full_cert_chain = cert_pem + chain_certificate.public_bytes(Encoding.PEM)
+        output_dir.joinpath(f"fullchain.pem").write_bytes(full_cert_chain)
+
+    output_dir.joinpath("privkey.pem").write_bytes(private_key_pem)
+    output_dir.joinpath(f"server.pem").write_bytes(cert_pem)
+
+
+def _init_worker(issuer_cert_pem, issuer_private_key_der):
+    global _issuer
+    _issuer = (load_pem_x509_certificate(issuer_cert_pem), load_der_private_key(issuer_private_key_der, password=None))
+
+
+def _issue_certificate(task, issuer=None):
+    name, configurations, dns_name, output_dir, with_chain, (key_algorithm, key_size), hash_name = task
+    # CPU time, which stays the time the certificate takes alone when the workers share cores
+    started = time.process_time()
+    issuer_certificate, issuer_private_key = issuer or _issuer
+    private_key, certificate = issue_certificate(build_name(configurations), dns_name, issuer_certificate,
+                                                 issuer_private_key, key_algorithm, key_size, hash_name)
+    save_certificate(pathlib.Path(output_dir), private_key, certificate, issuer_certificate if with_chain else None)
+    return name, time.process_time() - started
 
 
 class NativeCertificateGenerator(CertificateGenerator):
     def __init__(self, output_directory: str = "certs"):
         super().__init__(output_directory)
-        self.ca_private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-        )
-        self.intermediate_private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-        )
+        # Loaded from the output directory, or generated along their certificate
+        self.ca_private_key = None
+        self.intermediate_private_key = None
         self.ca_name = self.generate_name("CA")
         self.intermediate_ca_name = self.generate_name("IntermediateCA")
         self.ca_certificate: Union[Certificate, None] = None
@@ -40,6 +167,28 @@ class NativeCertificateGenerator(CertificateGenerator):
         # Static password is NONONONO! Don't use in prod!
         self.passphrases["CA"] = self.passphrases["IntermediateCA"] = "SSIExam2024!!"
 
+    def get_key_options(self, name) -> tuple:
+        """
+        Returns:
+            tuple: The KEY_ALGORITHM and KEY_SIZE of a config.ini section, RSA 2048 when not set.
+        """
+        try:
+            algorithm = self.config.get(name, "KEY_ALGORITHM", fallback=DEFAULT_KEY_ALGORITHM).upper()
+            size = self.config.getint(name, "KEY_SIZE", fallback=None)
+            check_key_options(algorithm, size)
+        except ValueError as e:
+            fatal(f"Invalid key options for '{name}': {e}")
+        if algorithm == 'ED25519':
+            warning(f"{name}: most browsers do not accept Ed25519 certificates, keep them for internal clients")
+        return algorithm, size
+
+    def get_signature_hash(self, issuer) -> Union[str, None]:
+        # The hash is chosen by the issuer, for every certificate it signs
+        hash_name = self.config.get(issuer, "SIGNATURE_HASH", fallback=None)
+        if hash_name and hash_name.upper().replace('-', '') not in SIGNATURE_HASHES:
+            fatal(f"Invalid signature hash for '{issuer}': {hash_name}, choose from {', '.join(SIGNATURE_HASHES)}")
+        return hash_name
+
     def load_or_generate_ca_certificate(self):
             ca_key_path = self.output_dir.joinpath("ca_private_key.pem")
             ca_cert_path = self.output_dir.joinpath("ca_certificate.pem")
@@ -58,6 +207,8 @@ class NativeCertificateGenerator(CertificateGenerator):
                 self.generate_ca_certificate()
 
     def generate_ca_certificate(self):
+        self.ca_private_key = generate_private_key(*self.get_key_options("CA"))
+
         # Generate CA's certificate
         ca_certificate = (
             x509.CertificateBuilder()
@@ -70,7 +221,7 @@ class NativeCertificateGenerator(CertificateGenerator):
             .add_extension(
                 x509.BasicConstraints(ca=True, path_length=None), critical=True,
             )
-            .sign(self.ca_private_key, hashes.SHA256())
+            .sign(self.ca_private_key, signature_hash(self.ca_private_key, self.get_signature_hash("CA")))
         )
 
         # Save CA's key and certificate
@@ -121,6 +272,8 @@ class NativeCertificateGenerator(CertificateGenerator):
 
     # Generate intermediate certificate
     def generate_intermediate_certificate(self):
+        self.intermediate_private_key = generate_private_key(*self.get_key_options("IntermediateCA"))
+
         # Intermediate certificate details
         intermediate_certificate = (
             x509.CertificateBuilder()
@@ -133,7 +286,7 @@ class NativeCertificateGenerator(CertificateGenerator):
             .add_extension(
                 x509.BasicConstraints(ca=True, path_length=0), critical=True,
             )
-            .sign(self.ca_private_key, hashes.SHA256())
+            .sign(self.ca_private_key, signature_hash(self.ca_private_key, self.get_signature_hash("CA")))
         )
 
         # Save Intermediate's key and certificate
@@ -153,6 +306,11 @@ class NativeCertificateGenerator(CertificateGenerator):
         self.intermediate_certificate = intermediate_certificate
 
 
+    def certificate_directory(self, name) -> pathlib.Path:
+        output_dir = self.output_dir.joinpath(sanitize(name))
+        output_dir.mkdir(exist_ok=True)
+        return output_dir
+
     def generate_certificate(self, name):
         # Server/client's information
         self.passphrases[name] = self.generate_password(f"{name} Cert")
@@ -163,48 +321,51 @@ class NativeCertificateGenerator(CertificateGenerator):
         if not server_name:
             return False
 
-        s_name = sanitize(name)
-
-        output_dir = self.output_dir.joinpath(s_name)
-        output_dir.mkdir(exist_ok=True)
-
-        # Generate server/client's private key
-        server_private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-        )
-
-        # Generate server/client's certificate
-        server_certificate = (
-            x509.CertificateBuilder()
-            .subject_name(server_name)
-            .issuer_name(self.intermediate_certificate.subject)
-            .public_key(server_private_key.public_key())
-            .serial_number(x509.random_serial_number())
-            .not_valid_before(datetime.today() - one_day())
-            .not_valid_after(datetime.today() + timedelta(days=365))
-            .add_extension(
-                x509.SubjectAlternativeName([x509.DNSName(self.get_dns_name(name))]),
-                critical=False,
-            )
-            .sign(self.intermediate_private_key, hashes.SHA256())
-        )
-
-        # Save server's key and certificate
-        (server_private_key_pem, server_cert_pem) = (
-            server_private_key.private_bytes(
-                Encoding.PEM,
-                PrivateFormat.PKCS8,
-                NoEncryption()
-            ),
-            server_certificate.public_bytes(Encoding.PEM),
+        private_key, certificate = issue_certificate(server_name, self.get_dns_name(name),
+                                                     self.intermediate_certificate, self.intermediate_private_key,
+                                                     *self.get_key_options(name),
+                                                     self.get_signature_hash("IntermediateCA"))
+        chain_certificate = self.intermediate_certificate if server_name != self.ca_certificate.subject else None
+        save_certificate(self.certificate_directory(name), private_key, certificate, chain_certificate)
+
+    def generate_certificates(self, names, jobs: int = 1):
+        if jobs == 1 or len(names) < 2:
+            return super().generate_certificates(names, jobs)
+
+        # Passphrases are drawn here, in config order, whatever order the workers finish in
+        tasks = []
+        hash_name = self.get_signature_hash("IntermediateCA")
+        for name in names:
+            self.passphrases[name] = self.generate_password(f"{name} Cert")
+            server_name = self.generate_name(name)
+            if not server_name:
+                continue
+            tasks.append((name, list(self.config.items(name)), self.get_dns_name(name),
+                          str(self.certificate_directory(name)), server_name != self.ca_certificate.subject,
+                          self.get_key_options(name), hash_name))
+
+        if not tasks:
+            return
+
+        jobs = min(jobs or os.cpu_count(), len(tasks))
+        if jobs == 1 or all(key_options[0] != 'RSA' for *_, key_options, _ in tasks):
+            # ECDSA and Ed25519 certificates take about a millisecond each, less than starting the workers
+            issuer = (self.intermediate_certificate, self.intermediate_private_key)
+            for task in tasks:
+                _issue_certificate(task, issuer)
+            return
+
+        # The workers only get the Intermediate CA's signing material, never the Root CA key
+        signing_material = (
+            self.intermediate_certificate.public_bytes(Encoding.PEM),
+            self.intermediate_private_key.private_bytes(Encoding.DER, PrivateFormat.PKCS8, NoEncryption()),
         )
-
-        if server_name != self.ca_certificate.subject:
-            intermediate_cert_pem = self.intermediate_certificate.public_bytes(Encoding.PEM)
-            full_cert_chain = server_cert_pem + intermediate_cert_pem
-            output_dir.joinpath(f"fullchain.pem").write_bytes(full_cert_chain)
-
-        output_dir.joinpath("privkey.pem").write_bytes(server_private_key_pem)
-        output_dir.joinpath(f"server.pem").write_bytes(server_cert_pem)
+        started = time.perf_counter()
+        with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=signing_material) as pool:
+            durations = dict(pool.map(_issue_certificate, tasks))
+        elapsed = time.perf_counter() - started
+        # Estimated from the CPU time of the workers, benchmarks/bench_issue.py times a real serial run instead
+        cpu_time = sum(durations.values())
+        success(f"Issued {len(durations)} certificates in {elapsed:.2f} s with {jobs} processes, for {cpu_time:.2f} s "
+                f"of CPU time: about {cpu_time / elapsed:.1f}x faster than one at a time")
 